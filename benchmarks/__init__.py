@@ -0,0 +1 @@
+"""Бенчмарки проекта Report_K (запуск из корня репозитория: python -m benchmarks.<модуль>)."""
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_startup.py — холодный старт CLI-модулей.
+
+Для каждого модуля-точки входа в отдельном процессе выполняется `python -X importtime -c "import <модуль>"`:
+фиксируется накопленное время импорта модуля (по отчёту importtime) и полное время процесса.
+Отдельно меряется время до первого приглашения insert_date (вывод приветствия + готовый prompt_toolkit).
+Результаты пишутся в benchmarks/results/startup_YYYYMMDD_HHMMSS.json.
+
+Запуск: python -m benchmarks.bench_startup [--repeat 5] [--budget-ms 150] [--strict]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from datetime import datetime
+from typing import List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+
+ENTRY_MODULES = [
+    "main",
+    "pipeline",
+    "insert_date",
+    "name_clients",
+    "extract_isin",
+    "map_instruments",
+    "template_creator",
+    "clear_data_backup",
+    "clear_data_work",
+]
+
+# Код, выполняемый до первого приглашения к вводу в insert_date
+FIRST_PROMPT_SNIPPET = (
+    "import insert_date as m; m.print_welcome(); m.prompt_toolkit.PromptSession"
+)
+
+_IMPORTTIME_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(\S.*)$")
+
+
+def _run(code: str, importtime: bool = False) -> tuple:
+    """Выполняет код в новом интерпретаторе; возвращает (время процесса в мс, stderr)."""
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="0")
+    started = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, check=True)
+    return (time.perf_counter() - started) * 1000, proc.stderr.decode("utf-8", errors="replace")
+
+
+def module_import_ms(stderr: str, module: str) -> Optional[float]:
+    """Достаёт из отчёта -X importtime накопленное время импорта модуля (мс)."""
+    for line in stderr.splitlines():
+        m = _IMPORTTIME_RE.match(line)
+        if m and m.group(3).strip() == module:
+            return int(m.group(2)) / 1000
+    return None
+
+
+def bench_module(module: str, repeat: int) -> dict:
+    import_ms, wall_ms = [], []
+    for _ in range(repeat):
+        wall, stderr = _run(f"import {module}", importtime=True)
+        wall_ms.append(wall)
+        value = module_import_ms(stderr, module)
+        if value is not None:
+            import_ms.append(value)
+    return {
+        "module": module,
+        "import_ms": round(statistics.median(import_ms), 2) if import_ms else None,
+        "process_ms": round(statistics.median(wall_ms), 2),
+    }
+
+
+def bench_first_prompt(repeat: int) -> float:
+    return round(statistics.median(_run(FIRST_PROMPT_SNIPPET)[0] for _ in range(repeat)), 2)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк холодного старта CLI")
+    parser.add_argument("--repeat", type=int, default=5, help="Число повторов (берётся медиана)")
+    parser.add_argument("--budget-ms", type=float, default=150.0, help="Бюджет времени до первого приглашения")
+    parser.add_argument("--strict", action="store_true", help="Код возврата 1 при превышении бюджета")
+    args = parser.parse_args(argv)
+
+    # Прогрев: компиляция .pyc, чтобы не мерить её в первом повторе
+    _run("import " + ", ".join(ENTRY_MODULES))
+    baseline_ms = round(statistics.median(_run("pass")[0] for _ in range(args.repeat)), 2)
+
+    modules = [bench_module(m, args.repeat) for m in ENTRY_MODULES]
+    first_prompt_ms = bench_first_prompt(args.repeat)
+
+    print(f"{'модуль':<20} {'импорт, мс':>12} {'процесс, мс':>12}")
+    for row in modules:
+        print(f"{row['module']:<20} {row['import_ms'] or 0:>12.1f} {row['process_ms']:>12.1f}")
+    print(f"\nПустой интерпретатор: {baseline_ms:.1f} мс")
+    status = "OK" if first_prompt_ms <= args.budget_ms else "ПРЕВЫШЕН"
+    print(f"До первого приглашения insert_date: {first_prompt_ms:.1f} мс (бюджет {args.budget_ms:.0f} мс — {status})")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out_path = os.path.join(RESULTS_DIR, f"startup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "python": sys.version.split()[0],
+            "repeat": args.repeat,
+            "interpreter_ms": baseline_ms,
+            "first_prompt_ms": first_prompt_ms,
+            "budget_ms": args.budget_ms,
+            "modules": modules,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"Результаты: {out_path}")
+
+    return 1 if args.strict and first_prompt_ms > args.budget_ms else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
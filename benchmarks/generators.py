@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+generators.py — синтетические данные для бенчмарков.
+
+- make_isins(): валидные ISIN (ISO 6166, с правильной контрольной цифрой Luhn);
+- write_report(): отчет_*.xlsx с листом 'портфель' (Владелец счета, ISIN, Название, Количество),
+  с долей невалидных ISIN и дублей;
+- write_reference_stocks / write_reference_bonds / write_reference_structured: справочники
+  в формате dictionaries/ (те же листы и колонки, что читает map_instruments);
+- write_termsheets(): каталог PDF-заглушек '<ISIN>.pdf';
+- build_workspace(): полная структура проекта (Data_in, Data_work, dictionaries) для REPORT_BASE_DIR.
+
+Все генераторы детерминированы (seed).
+"""
+
+import os
+import json
+import random
+import string
+from datetime import date
+from typing import List, Optional
+
+from startup import lazy_import
+
+openpyxl = lazy_import("openpyxl")
+
+COUNTRIES = ("US", "XS", "DE", "GB", "FR", "CH", "RU", "IE", "LU", "NL")
+ALNUM = string.digits + string.ascii_uppercase
+# Короткая форма «Фамилия И.О.» — так же выглядит имя в isin_*.json и в именах файлов этапов
+CLIENT_NAME = "Иванов И.И."
+DEFAULT_DATES = {"start_date": "01.07.2025", "end_date": "30.09.2025"}
+
+
+def isin_check_digit(body: str) -> str:
+    """Контрольная цифра для 11 первых символов ISIN (буквы → 10..35, затем Luhn)."""
+    digits = "".join(str(int(ch, 36)) for ch in body)
+    total = 0
+    # Контрольная цифра будет справа, поэтому удваиваются цифры на чётных позициях с конца тела
+    for i, ch in enumerate(reversed(digits)):
+        num = int(ch)
+        if i % 2 == 0:
+            num *= 2
+            if num > 9:
+                num -= 9
+        total += num
+    return str((10 - total % 10) % 10)
+
+
+def make_isins(count: int, seed: int = 0) -> List[str]:
+    """count уникальных валидных ISIN."""
+    rng = random.Random(seed)
+    result, seen = [], set()
+    while len(result) < count:
+        body = rng.choice(COUNTRIES) + "".join(rng.choices(ALNUM, k=9))
+        isin = body + isin_check_digit(body)
+        if isin not in seen:
+            seen.add(isin)
+            result.append(isin)
+    return result
+
+
+def make_invalid_isin(rng: random.Random) -> str:
+    """ISIN с испорченной контрольной цифрой или форматом."""
+    body = rng.choice(COUNTRIES) + "".join(rng.choices(ALNUM, k=9))
+    good = isin_check_digit(body)
+    bad = str((int(good) + rng.randint(1, 9)) % 10)
+    return rng.choice([body + bad, body[:10], "N/A", body.lower() + "X"])
+
+
+def write_report(
+    path: str,
+    rows: int,
+    isin_pool: List[str],
+    invalid_ratio: float = 0.02,
+    duplicate_ratio: float = 0.05,
+    client: str = CLIENT_NAME,
+    seed: int = 0,
+) -> None:
+    """Пишет отчет_*.xlsx с листом 'портфель' (write-only, постоянная память)."""
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("портфель")
+    ws.append(["Владелец счета", "ISIN", "Название", "Количество"])
+    written: List[str] = []
+    for i in range(rows):
+        roll = rng.random()
+        if roll < invalid_ratio:
+            isin = make_invalid_isin(rng)
+        elif roll < invalid_ratio + duplicate_ratio and written:
+            isin = rng.choice(written)
+        else:
+            isin = isin_pool[i % len(isin_pool)]
+            written.append(isin)
+        ws.append([client, isin, f"Инструмент {i}", rng.randint(1, 10_000)])
+    wb.save(path)
+
+
+def write_reference_stocks(path: str, isins: List[str]) -> None:
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("акции_etf")
+    ws.append(["ISIN", "Тикер", "Название", "Тип"])
+    for i, isin in enumerate(isins):
+        ws.append([isin, f"T{i:06d}", f"Company {i}", "ETF" if i % 10 == 0 else "Акция"])
+    wb.save(path)
+
+
+def write_reference_bonds(path: str, isins: List[str]) -> None:
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("bonds")
+    ws.append(["ISIN", "Название инструмента", "Купон", "Частота", "Погашение", "Базис"])
+    for i, isin in enumerate(isins):
+        coupon = 3 + i % 5
+        maturity = date(2026 + i % 15, 1 + i % 12, 1 + i % 28)
+        ws.append([isin, f"Issuer {i}, {coupon}% {maturity.year}, USD", coupon, (1, 2, 4)[i % 3],
+                   maturity.strftime("%d.%m.%Y"), ("30/360", "ACT/ACT", "ACT/360", "ACT/365")[i % 4]])
+    wb.save(path)
+
+
+def write_reference_structured(path: str, isins: List[str]) -> None:
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("TS")
+    ws.append(["N", "ISIN", "ссылка"])
+    for i, isin in enumerate(isins, 1):
+        ws.append([i, isin, None])
+    wb.save(path)
+
+
+def write_termsheets(pdf_dir: str, isins: List[str], size_bytes: int = 4096) -> None:
+    """PDF-заглушки фиксированного размера."""
+    os.makedirs(pdf_dir, exist_ok=True)
+    header = b"%PDF-1.4\n% synthetic termsheet\n"
+    body = header + b"0" * max(0, size_bytes - len(header) - 6) + b"\n%%EOF"
+    for isin in isins:
+        with open(os.path.join(pdf_dir, f"{isin}.pdf"), "wb") as f:
+            f.write(body)
+
+
+def workspace_paths(root: str) -> dict:
+    """Пути внутри рабочей папки — те же, что использует проект при REPORT_BASE_DIR=root."""
+    return {
+        "data_in": os.path.join(root, "Data_in"),
+        "data_work": os.path.join(root, "Data_work"),
+        "stocks_xlsx": os.path.join(root, "dictionaries", "reference_stocks", "reference_stocks_etf.xlsx"),
+        "bonds_xlsx": os.path.join(root, "dictionaries", "reference_bonds", "reference_bonds.xlsx"),
+        "sp_xlsx": os.path.join(root, "dictionaries", "reference_structured", "TS", "TS.xlsx"),
+        "sp_dir": os.path.join(root, "dictionaries", "reference_structured", "TS"),
+    }
+
+
+def build_workspace(
+    root: str,
+    report_rows: int,
+    dict_size: int,
+    pdf_count: int,
+    seed: int = 0,
+    client: str = CLIENT_NAME,
+    dates: Optional[dict] = None,
+) -> dict:
+    """
+    Создаёт полную рабочую папку: справочники (акции/облигации/СП поровну от dict_size),
+    PDF TermSheets, отчет_*.xlsx и JSON с именем клиента и датами.
+    Примерно половина ISIN отчёта есть в справочниках, остальные — noname.
+    """
+    paths = workspace_paths(root)
+    for key in ("data_in", "data_work", "sp_dir"):
+        os.makedirs(paths[key], exist_ok=True)
+    os.makedirs(os.path.dirname(paths["stocks_xlsx"]), exist_ok=True)
+    os.makedirs(os.path.dirname(paths["bonds_xlsx"]), exist_ok=True)
+
+    universe = make_isins(dict_size + max(report_rows // 2, 1), seed=seed)
+    known, unknown = universe[:dict_size], universe[dict_size:]
+    third = max(dict_size // 3, 1)
+    stocks, bonds, structured = known[:third], known[third:2 * third], known[2 * third:]
+
+    write_reference_stocks(paths["stocks_xlsx"], stocks)
+    write_reference_bonds(paths["bonds_xlsx"], bonds)
+    write_reference_structured(paths["sp_xlsx"], structured)
+    write_termsheets(paths["sp_dir"], structured[:pdf_count])
+
+    # Известные ISIN берутся вперемешку из всех трёх справочников
+    sample = random.Random(seed).sample(known, min(len(known), len(unknown)))
+    pool = [isin for pair in zip(sample, unknown) for isin in pair] or known
+    report_path = os.path.join(paths["data_in"], "отчет_бенчмарк.xlsx")
+    write_report(report_path, report_rows, pool, client=client, seed=seed)
+
+    with open(os.path.join(paths["data_work"], "name_clients.json"), "w", encoding="utf-8") as f:
+        json.dump({"client_name": client}, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(paths["data_work"], "report_dates.json"), "w", encoding="utf-8") as f:
+        json.dump(dates or DEFAULT_DATES, f, ensure_ascii=False, indent=2)
+
+    paths.update({"report": report_path, "stocks": stocks, "bonds": bonds, "structured": structured})
+    return paths
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+regression_gate.py — проверка производительности против зафиксированного эталона.
+
+Запускает набор бенчмарков (run_benchmarks, синтетические данные, без сети) и сравнивает
+каждый замер с benchmarks/baseline.json:
+  время   — минимум по повторам против минимума эталона (минимум меньше всего зависит
+            от фоновой нагрузки машины; медиана остаётся в результатах для справки);
+  память  — пик tracemalloc (peak_mb) или RSS сквозного прогона (peak_rss_mb).
+Замер считается регрессией, если он хуже эталона больше чем на допуск (доля) И больше
+чем на абсолютный порог шума (мс / МБ) — чтобы микрозамеры не «мигали».
+
+Допуски задаются в эталоне: "tolerances": {"default": {...}, "<бенчмарк>": {...}}
+и сохраняются при обновлении эталона.
+
+Код возврата: 0 — регрессий нет; 1 — есть регрессии; 2 — эталон не найден или не подходит.
+
+Запуск:
+  python -m benchmarks.regression_gate                       # прогон quick + сравнение
+  python -m benchmarks.regression_gate --results FILE.json   # сравнить готовые результаты
+  python -m benchmarks.regression_gate --update-baseline     # осознанно обновить эталон
+"""
+
+import os
+import sys
+import json
+import argparse
+from datetime import datetime
+from typing import List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from benchmarks import run_benchmarks  # noqa: E402
+
+BASELINE_PATH = os.path.join(ROOT_DIR, "benchmarks", "baseline.json")
+
+DEFAULT_TOLERANCES = {
+    "default": {"time": 0.35, "memory": 0.20, "min_time_ms": 10.0, "min_memory_mb": 1.0},
+    # Сквозной прогон включает старт интерпретаторов и сильнее зависит от нагрузки машины
+    "pipeline_e2e": {"time": 0.50, "memory": 0.25, "min_time_ms": 100.0, "min_memory_mb": 10.0},
+}
+
+# Метрика памяти: пик tracemalloc для замеров в процессе, RSS — для сквозного прогона
+MEMORY_KEYS = ("peak_mb", "peak_rss_mb")
+
+
+def load_baseline(path: str) -> Optional[dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def tolerance_for(tolerances: dict, bench: str) -> dict:
+    """Допуски бенчмарка: default, перекрытый записью с его именем."""
+    merged = dict(DEFAULT_TOLERANCES["default"])
+    merged.update(tolerances.get("default", {}))
+    merged.update(tolerances.get(bench, {}))
+    return merged
+
+
+def _memory(result: dict) -> Optional[float]:
+    for key in MEMORY_KEYS:
+        if key in result:
+            return result[key]
+    return None
+
+
+def compare(baseline: dict, report: dict) -> List[dict]:
+    """
+    Сравнивает результаты прогона с эталоном.
+    Возвращает строки {"case","bench","metric","baseline","current","delta","limit","status"},
+    status: "ok" | "regression" | "improved" | "new".
+    """
+    tolerances = baseline.get("tolerances", {})
+    base_cases = {c["name"]: c["results"] for c in baseline.get("cases", [])}
+    rows = []
+    for case in report["cases"]:
+        base_results = base_cases.get(case["name"], {})
+        for bench, current in case["results"].items():
+            base = base_results.get(bench)
+            if base is None:
+                rows.append({"case": case["name"], "bench": bench, "metric": "—", "baseline": None,
+                             "current": None, "delta": None, "limit": None, "status": "new"})
+                continue
+            tol = tolerance_for(tolerances, bench)
+            metrics = [("время, мс", base["min_s"] * 1000, current["min_s"] * 1000,
+                        tol["time"], tol["min_time_ms"])]
+            base_mem, cur_mem = _memory(base), _memory(current)
+            if base_mem is not None and cur_mem is not None:
+                metrics.append(("память, МБ", base_mem, cur_mem, tol["memory"], tol["min_memory_mb"]))
+            for metric, before, after, ratio, floor in metrics:
+                delta = after - before
+                limit = max(before * ratio, floor)
+                if delta > limit:
+                    status = "regression"
+                elif -delta > limit:
+                    status = "improved"
+                else:
+                    status = "ok"
+                rows.append({"case": case["name"], "bench": bench, "metric": metric, "baseline": before,
+                             "current": after, "delta": delta, "limit": limit, "status": status})
+    return rows
+
+
+def print_report(rows: List[dict]) -> None:
+    marks = {"ok": "  ", "regression": "❌", "improved": "✅", "new": "🆕"}
+    print(f"   {'случай':<28} {'бенчмарк':<18} {'метрика':<11} {'эталон':>10} {'сейчас':>10} {'Δ':>9} {'допуск':>8}")
+    for r in rows:
+        if r["status"] == "new":
+            print(f"{marks['new']} {r['case']:<28} {r['bench']:<18} нет в эталоне")
+            continue
+        print(f"{marks[r['status']]} {r['case']:<28} {r['bench']:<18} {r['metric']:<11} "
+              f"{r['baseline']:>10.1f} {r['current']:>10.1f} {r['delta']:>+9.1f} {r['limit']:>8.1f}")
+
+
+def write_baseline(path: str, report: dict, previous: Optional[dict]) -> None:
+    """Записывает эталон атомарно, сохраняя ранее заданные допуски."""
+    tolerances = (previous or {}).get("tolerances") or DEFAULT_TOLERANCES
+    payload = {
+        "suite": report["suite"],
+        "python": report["python"],
+        "platform": report["platform"],
+        "repeat": report["repeat"],
+        "updated": datetime.now().isoformat(timespec="seconds"),
+        "tolerances": tolerances,
+        "cases": report["cases"],
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    os.replace(tmp, path)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Проверка регрессий производительности против эталона")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Путь к эталону (по умолчанию benchmarks/baseline.json)")
+    parser.add_argument("--suite", choices=sorted(run_benchmarks.SUITES),
+                        help="Набор бенчмарков (по умолчанию — набор эталона или quick)")
+    parser.add_argument("--repeat", type=int, default=5, help="Число повторов")
+    parser.add_argument("--no-e2e", action="store_true", help="Без сквозного прогона через pipeline.py")
+    parser.add_argument("--results", help="Сравнить готовый JSON run_benchmarks вместо нового прогона")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Записать результаты прогона как новый эталон (допуски сохраняются)")
+    args = parser.parse_args(argv)
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None and not args.update_baseline:
+        print(f"Эталон не найден: {args.baseline}. Создайте его: python -m benchmarks.regression_gate --update-baseline")
+        return 2
+
+    suite = args.suite or (baseline or {}).get("suite", "quick")
+    if baseline is not None and not args.update_baseline and baseline.get("suite") != suite:
+        print(f"Эталон снят для набора '{baseline.get('suite')}', а запрошен '{suite}'")
+        return 2
+
+    if args.results:
+        with open(args.results, "r", encoding="utf-8") as f:
+            report = json.load(f)
+    else:
+        report = run_benchmarks.run_suite(suite, max(1, args.repeat), keep=False, e2e=not args.no_e2e)
+
+    if args.update_baseline:
+        write_baseline(args.baseline, report, baseline)
+        print(f"Эталон обновлён: {args.baseline}")
+        return 0
+
+    rows = compare(baseline, report)
+    print()
+    print_report(rows)
+    regressions = [r for r in rows if r["status"] == "regression"]
+    if regressions:
+        print(f"\n❌ Регрессий: {len(regressions)} (эталон от {baseline.get('updated', '?')})")
+        return 1
+    print("\n✅ Регрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+run_benchmarks.py — воспроизводимые бенчмарки горячих путей на синтетических данных.
+
+Для каждого размера из набора (suite) генерируется рабочая папка (benchmarks/generators.py)
+и замеряются:
+  extract_read       — открытие отчёта, поиск листа/столбца, чтение ISIN;
+  extract_validate   — валидация ISO 6166 + уникализация;
+  reference_load     — чтение трёх справочников и каталога TermSheets из xlsx;
+  match              — сопоставление ISIN отчёта со справочниками;
+  termsheet_copy     — копирование PDF найденных СП;
+  pipeline_e2e       — все этапы конвейера после ввода дат и имени (extract_isin … template_creator)
+                       через pipeline.py в отдельном процессе (REPORT_BASE_DIR = рабочая папка).
+
+Для каждого замера: медиана и минимум времени по повторам, пик памяти tracemalloc
+(для e2e — максимальный RSS дочерних процессов). Результаты — benchmarks/results/bench_<suite>_<ts>.json.
+
+Запуск: python -m benchmarks.run_benchmarks [--suite quick|full] [--repeat 3] [--keep]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import statistics
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from benchmarks import generators  # noqa: E402
+
+# Размеры: строк в отчёте, ISIN в справочниках, PDF в каталоге TermSheets
+SUITES: Dict[str, List[dict]] = {
+    "quick": [
+        {"report_rows": 100, "dict_size": 1_000, "pdf_count": 10},
+        {"report_rows": 1_000, "dict_size": 10_000, "pdf_count": 100},
+    ],
+    "full": [
+        {"report_rows": 100, "dict_size": 1_000, "pdf_count": 10},
+        {"report_rows": 10_000, "dict_size": 100_000, "pdf_count": 1_000},
+        {"report_rows": 100_000, "dict_size": 1_000_000, "pdf_count": 10_000},
+    ],
+}
+
+
+def _case_name(case: dict) -> str:
+    return f"rows{case['report_rows']}_dict{case['dict_size']}_pdf{case['pdf_count']}"
+
+
+def measure(func: Callable, repeat: int, setup: Optional[Callable] = None) -> dict:
+    """
+    Прогрев, затем repeat замеров времени (setup — перед каждым прогоном, вне замера)
+    и отдельный прогон под tracemalloc для пика памяти (не влияет на время).
+    """
+    import tracemalloc
+
+    def _call():
+        arg = setup() if setup else None
+        started = time.perf_counter()
+        func(arg) if setup else func()
+        return time.perf_counter() - started
+
+    _call()
+    times = [_call() for _ in range(repeat)]
+    tracemalloc.start()
+    try:
+        _call()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "median_s": round(statistics.median(times), 6),
+        "min_s": round(min(times), 6),
+        "peak_mb": round(peak / 1024 / 1024, 3),
+    }
+
+
+def _load_modules(workspace: str):
+    """Импортирует модули этапов так, чтобы их пути указывали на рабочую папку."""
+    import importlib
+
+    os.environ["REPORT_BASE_DIR"] = workspace
+    modules = []
+    for name in ("extract_isin", "map_instruments"):
+        if name in sys.modules:
+            modules.append(importlib.reload(sys.modules[name]))
+        else:
+            modules.append(importlib.import_module(name))
+    return modules
+
+
+def bench_in_process(paths: dict, repeat: int) -> Dict[str, dict]:
+    extract_isin, map_instruments = _load_modules(os.path.dirname(paths["data_in"]))
+    report = Path(paths["report"])
+
+    def _read() -> List[str]:
+        wb = extract_isin.open_workbook(report)
+        ws = extract_isin.find_portfolio_sheet(wb)
+        return extract_isin.read_isins(ws, extract_isin.find_isin_column(ws))
+
+    def _validate(raw: List[str]) -> List[str]:
+        valid = [isin for isin in raw if extract_isin.validate_isin(isin)]
+        return extract_isin.unique_preserve_order(valid)[0]
+
+    def _references():
+        catalog = map_instruments.scan_termsheet_catalog(paths["sp_dir"])
+        return map_instruments._load_references_from_sources(catalog)
+
+    with redirect_stdout(io.StringIO()):
+        raw = _read()
+    isins = _validate(raw)
+    stocks, bonds, structured = _references()
+    hits_sp = map_instruments.match_isins(isins, stocks, bonds, structured)[2]
+
+    copy_root = tempfile.mkdtemp(prefix="bench_copy_")
+    counter = iter(range(repeat + 2))
+
+    def _copy_target() -> Path:
+        return Path(copy_root) / str(next(counter))
+
+    # Вывод этапов (rich пишет в текущий sys.stdout) в замер не попадает
+    try:
+        with redirect_stdout(io.StringIO()):
+            results = {
+                "extract_read": measure(_read, repeat),
+                "extract_validate": measure(lambda: _validate(raw), repeat),
+                "reference_load": measure(_references, repeat),
+                "match": measure(lambda: map_instruments.match_isins(isins, stocks, bonds, structured), repeat),
+                "termsheet_copy": measure(lambda target: map_instruments.copy_termsheets(hits_sp, target),
+                                          repeat, setup=_copy_target),
+            }
+    finally:
+        shutil.rmtree(copy_root, ignore_errors=True)
+    results["match"]["isins"] = len(isins)
+    results["termsheet_copy"]["pdfs"] = len(hits_sp)
+    return results
+
+
+def _reset_outputs(workspace: str) -> None:
+    """Убирает результаты прошлого прогона, чтобы этапы не спрашивали про перезапись."""
+    data_work = os.path.join(workspace, "Data_work")
+    keep = {"name_clients.json", "report_dates.json"}
+    for entry in os.scandir(data_work):
+        if entry.name in keep:
+            continue
+        if entry.is_dir():
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            os.remove(entry.path)
+    shutil.rmtree(os.path.join(workspace, "Data_Backup"), ignore_errors=True)
+    # История позиций растёт с каждым прогоном map_instruments — повторы должны быть одинаковыми
+    shutil.rmtree(os.path.join(workspace, "dictionaries", "history"), ignore_errors=True)
+
+
+def bench_pipeline(workspace: str, repeat: int) -> dict:
+    """Сквозной прогон конвейера через pipeline.py в отдельном процессе (все этапы после ввода дат и имени)."""
+    import resource
+    from pipeline import STAGES
+
+    # name_clients.json и report_dates.json пишет генератор — этапы ввода пропускаются,
+    # extract_isin при stdin=DEVNULL работает без вопросов
+    stages = [s.name for s in STAGES if s.name not in ("insert_date", "name_clients")]
+    cmd = [sys.executable, os.path.join(ROOT_DIR, "pipeline.py"),
+           "--only", *stages, "--force", "all", "--sequential"]
+    # Зависимости уже проверены текущим процессом; трассы бенчмарка не смешиваются с рабочими
+    env = dict(os.environ, REPORT_BASE_DIR=workspace, REPORT_DEPS_CHECKED="1", REPORT_TRACE="0")
+    times = []
+    for _ in range(repeat):
+        _reset_outputs(workspace)
+        started = time.perf_counter()
+        proc = subprocess.run(cmd, cwd=ROOT_DIR, env=env, stdin=subprocess.DEVNULL,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        times.append(time.perf_counter() - started)
+        if proc.returncode != 0:
+            raise RuntimeError(f"pipeline.py завершился с кодом {proc.returncode}: "
+                               f"{proc.stderr.decode('utf-8', errors='replace')[-500:]}")
+    # ru_maxrss — КБ в Linux; максимум по всем завершённым дочерним процессам
+    rss_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {
+        "median_s": round(statistics.median(times), 6),
+        "min_s": round(min(times), 6),
+        "peak_rss_mb": round(rss_kb / 1024, 3),
+    }
+
+
+def run_suite(suite: str, repeat: int, keep: bool, e2e: bool) -> dict:
+    cases = []
+    for case in SUITES[suite]:
+        workspace = tempfile.mkdtemp(prefix=f"bench_{_case_name(case)}_")
+        try:
+            started = time.perf_counter()
+            paths = generators.build_workspace(workspace, **case)
+            generated_s = time.perf_counter() - started
+            print(f"▶ {_case_name(case)} (данные сгенерированы за {generated_s:.1f} с)")
+            results = bench_in_process(paths, repeat)
+            if e2e:
+                results["pipeline_e2e"] = bench_pipeline(workspace, repeat)
+            for name, r in results.items():
+                mem = f"{r['peak_mb']:.1f} МБ" if "peak_mb" in r else f"RSS {r['peak_rss_mb']:.1f} МБ"
+                print(f"  {name:<18} медиана {r['median_s'] * 1000:>10.1f} мс  мин {r['min_s'] * 1000:>10.1f} мс  {mem}")
+            cases.append({"name": _case_name(case), **case, "results": results})
+        finally:
+            if keep:
+                print(f"  рабочая папка сохранена: {workspace}")
+            else:
+                shutil.rmtree(workspace, ignore_errors=True)
+    return {
+        "suite": suite,
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "repeat": repeat,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "cases": cases,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарки горячих путей на синтетических данных")
+    parser.add_argument("--suite", choices=sorted(SUITES), default="quick")
+    parser.add_argument("--repeat", type=int, default=3, help="Число повторов (берётся медиана)")
+    parser.add_argument("--no-e2e", action="store_true", help="Не запускать сквозной прогон через pipeline.py")
+    parser.add_argument("--keep", action="store_true", help="Не удалять сгенерированные рабочие папки")
+    parser.add_argument("--out", help="Путь для JSON с результатами")
+    args = parser.parse_args(argv)
+
+    report = run_suite(args.suite, max(1, args.repeat), args.keep, not args.no_e2e)
+
+    out_path = args.out or os.path.join(
+        RESULTS_DIR, f"bench_{args.suite}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты: {out_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
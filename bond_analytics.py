@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bond_analytics.py — НКД, доходность к погашению и дюрация облигаций (векторно, numpy).
+
+Параметры выпуска берутся из справочника reference_bonds.xlsx (лист 'bonds'):
+  C=Купон, % годовых   D=Частота (выплат в год)   E=Погашение   F=Базис (30/360, ACT/360, ACT/365, ACT/ACT)
+и приходят в bonds_*.json из map_instruments. Чистая цена (% от номинала) — из хранилища
+цен price_store, тикер облигации = ISIN.
+
+Все облигации всех клиентов считаются одним вызовом bond_metrics():
+  — графики купонов строятся одним плоским массивом и кэшируются по (погашение, частота);
+  — НКД и доля текущего периода — по базису расчета каждой строки;
+  — YTM — пакетный метод Ньютона по всем строкам сразу (цена и ее производная — в замкнутом
+    виде, без матрицы потоков); дюрация Маколея и модифицированная.
+Строки без параметров выпуска, без цены или погашенные не вызывают ошибок — получают флаги.
+
+Этап bond_analytics: bonds_*.json в папке → bond_metrics_{клиент}_{начало}__{конец}.json
+(метрики на конец периода), из них template_creator заполняет лист «bonds».
+  python bond_analytics.py [--dir Data_work] [--store dictionaries/prices]
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+from dataclasses import dataclass
+from glob import glob
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from startup import console, ensure_dependencies, lazy_import
+from instrumentation import count, span, stage_span
+from profiling import add_arguments as add_profile_arguments, profile_stage
+import price_store
+
+np = lazy_import("numpy")
+
+REQUIRED_MODULES = ["rich", "numpy"]
+
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+DATA_WORK = os.path.join(BASE_DIR, "Data_work")
+
+# Цена старше даты отчета больше чем на столько дней считается отсутствующей
+MAX_PRICE_LAG_DAYS = 7
+
+# Базисы расчета (day count) → код в массивах
+DAY_COUNTS = {"30/360": 0, "ACT/360": 1, "ACT/365": 2, "ACT/ACT": 3}
+DEFAULT_DAY_COUNT = "30/360"
+
+NEWTON_MAX_ITER = 50
+NEWTON_TOL = 1e-10
+
+# Флаги строки (битовая маска)
+NO_TERMS = 1
+NO_PRICE = 2
+MATURED = 4
+NOT_CONVERGED = 8
+FLAG_NAMES = {NO_TERMS: "no_terms", NO_PRICE: "no_price", MATURED: "matured", NOT_CONVERGED: "not_converged"}
+
+# bonds_{клиент}_{начало}__{конец}.json
+_BONDS_JSON_RE = re.compile(r"bonds_(.+)_(\d{2}\.\d{2}\.\d{4})__(\d{2}\.\d{2}\.\d{4})\.json")
+
+# Кэш графиков купонов: (день погашения, частота) → возрастающий массив дней купонов
+_SCHEDULES: Dict[Tuple[int, int], "np.ndarray"] = {}
+
+
+@dataclass
+class BondMetrics:
+    """Результат по строкам: все поля — numpy-массивы одной длины."""
+    accrued: "np.ndarray"            # НКД, % от номинала
+    dirty_price: "np.ndarray"        # чистая цена + НКД
+    ytm: "np.ndarray"                # доходность к погашению (доля, с периодичностью купона)
+    duration: "np.ndarray"           # дюрация Маколея, лет
+    modified_duration: "np.ndarray"
+    flags: "np.ndarray"              # int8, NO_TERMS | NO_PRICE | MATURED | NOT_CONVERGED
+
+    def __len__(self) -> int:
+        return int(self.flags.shape[0])
+
+    def flag_names(self, i: int) -> List[str]:
+        return [name for bit, name in FLAG_NAMES.items() if self.flags[i] & bit]
+
+
+# ---------- Графики купонов ----------
+
+def _build_schedules(maturities, freqs, horizon: int):
+    """
+    Даты купонов для пар (погашение, частота) одним плоским массивом: от погашения назад
+    с шагом 12/частота месяцев (день месяца погашения, ограниченный длиной месяца),
+    пока не захвачен купон не позже horizon. Возвращает список возрастающих массивов.
+    """
+    mat = maturities.astype("datetime64[D]")
+    months = mat.astype("datetime64[M]")
+    dom = (mat - months.astype("datetime64[D]")).astype(np.int64)      # день месяца − 1
+    step = 12 // freqs
+    periods = np.ceil((maturities - horizon) * freqs / 365.25).astype(np.int64) + 2
+    # Плоско, без матрицы с выравниванием по самому длинному графику: bond — номер выпуска, k — номер купона с конца
+    bond = np.repeat(np.arange(len(maturities)), periods)
+    ends = np.cumsum(periods)
+    k = np.arange(int(ends[-1])) - np.repeat(ends - periods, periods)
+    coupon_months = months.astype(np.int64)[bond] - k * step[bond]
+    # Первые дни месяцев — из небольшой таблицы: календарные преобразования numpy на всем массиве дороги
+    lo = int(coupon_months.min())
+    month_start = np.arange(lo, int(coupon_months.max()) + 2).astype("datetime64[M]") \
+        .astype("datetime64[D]").astype(np.int64)
+    idx = coupon_months - lo
+    first = month_start[idx]
+    days = first + np.minimum(dom[bond], month_start[idx + 1] - first - 1)
+    return [part[::-1].copy() for part in np.split(days, ends[:-1])]
+
+
+def coupon_schedules(maturities, freqs, horizon: int):
+    """
+    Графики купонов из кэша; недостающие (или слишком короткие) строятся одним пакетом.
+    Возвращает (номер уникального выпуска для каждой строки, графики уникальных выпусков).
+    """
+    keys = list(zip(maturities.tolist(), freqs.tolist()))
+    unique = list(dict.fromkeys(keys))
+    missing = [key for key in unique if key not in _SCHEDULES or _SCHEDULES[key][0] > horizon]
+    if missing:
+        built = _build_schedules(np.array([m for m, _ in missing], dtype=np.int64),
+                                 np.array([f for _, f in missing], dtype=np.int64), horizon)
+        _SCHEDULES.update(zip(missing, built))
+        count("bond_schedule_cache_misses", len(missing))
+    index = {key: i for i, key in enumerate(unique)}
+    uid = np.fromiter((index[key] for key in keys), dtype=np.int64, count=len(keys))
+    return uid, [_SCHEDULES[key] for key in unique]
+
+
+def _price_and_weighted(y, f, w, n, per_coupon):
+    """
+    Цена потока (n купонов per_coupon через 1 период, первый — через w периодов, номинал 100
+    с последним) и Σ t·PV в периодах — в замкнутом виде по геометрической прогрессии,
+    без матрицы потоков. v = 1/(1+y/f); Σ v^j и Σ j·v^j считаются устойчиво при v → 1.
+    """
+    x = (y / f) / (1.0 + y / f)                      # 1 − v
+    log_v = np.log1p(-x)
+    near = np.abs(x) < 1e-10
+    safe_x = np.where(near, 1.0, x)
+    geo0 = np.where(near, n, -np.expm1(n * log_v) / safe_x)                      # Σ_{j<n} v^j
+    v_last = np.exp((n - 1) * log_v)                                            # v^(n−1)
+    geo1 = np.where(near, n * (n - 1) / 2.0, (1.0 - x) / safe_x * (geo0 - n * v_last))  # Σ j·v^j
+    v_w = np.exp(w * log_v)
+    redemption = 100.0 * v_w * v_last
+    price = per_coupon * v_w * geo0 + redemption
+    weighted = per_coupon * v_w * (w * geo0 + geo1) + (w + n - 1) * redemption
+    return price, weighted
+
+
+def _ymd(days):
+    d = days.astype("datetime64[D]")
+    y = d.astype("datetime64[Y]")
+    m = d.astype("datetime64[M]")
+    return (y.astype(np.int64) + 1970, (m - y.astype("datetime64[M]")).astype(np.int64) + 1,
+            (d - m.astype("datetime64[D]")).astype(np.int64) + 1)
+
+
+def _days_30_360(start, end):
+    """Число дней между датами по базису 30/360 (US)."""
+    y1, m1, d1 = _ymd(start)
+    y2, m2, d2 = _ymd(end)
+    d1 = np.minimum(d1, 30)
+    d2 = np.where(d1 == 30, np.minimum(d2, 30), d2)
+    return 360 * (y2 - y1) + 30 * (m2 - m1) + (d2 - d1)
+
+
+# ---------- Расчет ----------
+
+def bond_metrics(
+    coupons: Sequence[float],
+    freqs: Sequence[int],
+    maturities: Sequence,
+    day_counts: Sequence[str],
+    settles: Sequence,
+    clean_prices: Sequence[float],
+) -> BondMetrics:
+    """
+    Метрики для строк (облигация, дата расчета, чистая цена % от номинала).
+    coupons — купон в % годовых; freqs — выплат в год; maturities/settles — даты
+    ('DD.MM.YYYY', 'YYYY-MM-DD', date или None); day_counts — ключи DAY_COUNTS.
+    """
+    n = len(coupons)
+    coupon = np.array([np.nan if c is None else float(c) for c in coupons], dtype=np.float64) / 100.0
+    freq = np.array([int(f or 0) for f in freqs], dtype=np.int64)
+    basis = np.array([DAY_COUNTS.get((b or DEFAULT_DAY_COUNT).upper(), 0) for b in day_counts], dtype=np.int64)
+    has_mat = np.array([bool(m) for m in maturities])
+    maturity = np.zeros(n, dtype=np.int64)
+    if has_mat.any():
+        maturity[has_mat] = price_store.to_days([m for m in maturities if m])
+    settle = price_store.to_days(settles) if n else np.empty(0, dtype=np.int64)
+    clean = np.asarray(clean_prices, dtype=np.float64)
+
+    no_terms = ~has_mat | np.isnan(coupon) | ~np.isin(freq, (1, 2, 4, 12))
+    matured = ~no_terms & (maturity <= settle)
+    no_price = np.isnan(clean)
+    ok = ~(no_terms | matured)
+
+    accrued = np.full(n, np.nan)
+    dirty = np.full(n, np.nan)
+    ytm = np.full(n, np.nan)
+    duration = np.full(n, np.nan)
+    flags = (no_terms * NO_TERMS | no_price * NO_PRICE | matured * MATURED).astype(np.int8)
+    if not ok.any():
+        return BondMetrics(accrued, dirty, ytm, duration, duration.copy(), flags)
+
+    rows = np.flatnonzero(ok)
+    c, f, b, s = coupon[rows], freq[rows], basis[rows], settle[rows]
+
+    # Графики купонов уникальных выпусков — одним плоским массивом ключей (выпуск << 32 | день),
+    # как в price_store: предыдущий купон каждой строки — один векторный searchsorted
+    uid, schedules = coupon_schedules(maturity[rows], f, int(s.min()))
+    lengths = np.fromiter((len(sch) for sch in schedules), dtype=np.int64, count=len(schedules))
+    flat = np.concatenate([(u << price_store.DAY_BITS) | sch for u, sch in enumerate(schedules)])
+    ends = np.cumsum(lengths)
+    pos = np.searchsorted(flat, (uid << price_store.DAY_BITS) | s, side="right") - 1
+    prev = flat[pos] & price_store.DAY_MASK
+    nxt = flat[pos + 1] & price_store.DAY_MASK
+    remaining = ends[uid] - pos - 1
+
+    # НКД по базису строки; доля периода до следующего купона — по фактическим дням
+    period_len = (nxt - prev).astype(np.float64)
+    elapsed = (s - prev).astype(np.float64)
+    year_frac = np.select(
+        [b == 0, b == 1, b == 2],
+        [_days_30_360(prev, s) / 360.0, elapsed / 360.0, elapsed / 365.0],
+        default=elapsed / period_len / f,
+    )
+    acc = 100.0 * c * year_frac
+    w = 1.0 - elapsed / period_len
+    per_coupon = 100.0 * c / f
+
+    # Пакетный Ньютон по всем строкам: P(y) = грязная цена
+    target = clean[rows] + acc
+    y = np.where(c > 0, c, 0.05)
+    active = ~np.isnan(target)
+    for _ in range(NEWTON_MAX_ITER):
+        if not active.any():
+            break
+        fa = f[active]
+        price, weighted = _price_and_weighted(y[active], fa, w[active], remaining[active], per_coupon[active])
+        deriv = -weighted / (fa * (1.0 + y[active] / fa))
+        step = (price - target[active]) / deriv
+        # Доходность ниже −100%·f не имеет смысла: не даем Ньютону уйти за полюс
+        y[active] = np.maximum(y[active] - step, -0.99 * fa)
+        done = np.abs(step) < NEWTON_TOL
+        active[np.flatnonzero(active)[done]] = False
+    not_converged = active
+
+    base = 1.0 + y / f
+    price, weighted = _price_and_weighted(y, f, w, remaining, per_coupon)
+    mac = weighted / price / f
+
+    priced = ~np.isnan(target)
+    accrued[rows] = acc
+    dirty[rows] = target
+    ytm[rows] = np.where(priced, y, np.nan)
+    duration[rows] = np.where(priced, mac, np.nan)
+    modified = np.full(n, np.nan)
+    modified[rows] = duration[rows] / base
+    flags[rows[not_converged]] |= NOT_CONVERGED
+    count("bond_rows", n)
+    return BondMetrics(accrued, dirty, ytm, duration, modified, flags)
+
+
+# ---------- Этап ----------
+
+def _num(value: float, digits: int = 6) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), digits)
+
+
+def metrics_items(items: list, metrics: BondMetrics, prices, price_days, offset: int = 0) -> list:
+    """Строки bond_metrics_*.json для items одного файла (строки items начинаются с offset)."""
+    result = []
+    for k, rec in enumerate(items):
+        i = offset + k
+        result.append({
+            "isin": rec.get("isin", ""),
+            "name": rec.get("name", ""),
+            "price_date": f"{price_store.from_day(price_days[i]):%d.%m.%Y}" if price_days[i] >= 0 else None,
+            "clean_price": _num(prices[i]),
+            "accrued": _num(metrics.accrued[i]),
+            "dirty_price": _num(metrics.dirty_price[i]),
+            "ytm": _num(metrics.ytm[i], 8),
+            "duration": _num(metrics.duration[i]),
+            "modified_duration": _num(metrics.modified_duration[i]),
+            "missing": metrics.flag_names(i),
+        })
+    return result
+
+
+def write_json_atomic(path: str, payload: dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="НКД, YTM и дюрация облигаций на конец периода")
+    parser.add_argument("--dir", default=DATA_WORK, help="Папка с bonds_*.json")
+    parser.add_argument("--store", default=price_store.PRICES_DIR, help="Папка хранилища цен")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    # Все файлы (клиенты, периоды) → один плоский набор строк
+    files, rows = [], []
+    for path in sorted(glob(os.path.join(args.dir, "bonds_*.json"))):
+        m = _BONDS_JSON_RE.fullmatch(os.path.basename(path))
+        if not m:
+            continue
+        client, start, end = m.groups()
+        with open(path, "r", encoding="utf-8") as f:
+            items = json.load(f).get("items") or []
+        files.append((client, {"start_date": start, "end_date": end}, items, len(rows)))
+        rows.extend((rec, end) for rec in items)
+    if not files:
+        console.print(f"[yellow]⚠️ В {args.dir} нет bonds_*.json[/yellow]")
+        return 1
+
+    store = price_store.PriceStore.open(args.store)
+    with span("bond_prices", rows=len(rows)):
+        tids = store.ticker_ids([rec.get("isin", "") for rec, _ in rows])
+        days = price_store.to_days([end for _, end in rows]) if rows else np.empty(0, dtype=np.int64)
+        prices, price_days = store.as_of_many(tids, days, MAX_PRICE_LAG_DAYS)
+    with span("bond_metrics", rows=len(rows)):
+        metrics = bond_metrics(
+            [rec.get("coupon") for rec, _ in rows],
+            [rec.get("frequency") for rec, _ in rows],
+            [rec.get("maturity") for rec, _ in rows],
+            [rec.get("day_count") for rec, _ in rows],
+            [end for _, end in rows],
+            prices,
+        )
+
+    for client, period, items, offset in files:
+        out_path = os.path.join(args.dir, f"bond_metrics_{client}_{period['start_date']}__{period['end_date']}.json")
+        write_json_atomic(out_path, {"client": client, "period": period,
+                                     "items": metrics_items(items, metrics, prices, price_days, offset)})
+
+    complete = int(np.count_nonzero(metrics.flags == 0))
+    console.print(f"[green]✅ Облигаций: {len(metrics)} в {len(files)} файлах; рассчитано полностью: {complete}[/green]")
+    return 0
+
+
+if __name__ == "__main__":
+    if not ensure_dependencies(REQUIRED_MODULES):
+        sys.exit(1)
+    with stage_span("bond_analytics"), profile_stage("bond_analytics"):
+        code = main()
+    sys.exit(code)
@@ -5,19 +5,11 @@ import os
 import shutil
 from pathlib import Path
 
-try:
-    from rich.console import Console
-    from rich import print
-except ImportError:
-    import sys
-    os.system(f'"{sys.executable}" -m pip install rich')
-    from rich.console import Console
-    from rich import print
-
-console = Console()
+# rich импортируется при первом выводе через слой startup
+from startup import console
 
 # Папка с резервами
-DATA_BACKUP = Path(r"F:\Python Projets\Report\Data_Backup")
+DATA_BACKUP = Path(os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")) / "Data_Backup"
 
 def cleanup_backup():
     if not DATA_BACKUP.exists():
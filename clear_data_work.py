@@ -8,7 +8,7 @@ def clear_folder(folder: Path, keep_files: list[str] = [".gitkeep"]):
             item.unlink()
 
 if __name__ == "__main__":
-    folder_path = Path("F:/Python Projets/Report/Data_work")
+    folder_path = Path(os.environ.get("REPORT_BASE_DIR", "F:/Python Projets/Report")) / "Data_work"
     if folder_path.exists():
         clear_folder(folder_path)
         print("✅ Папка Data_work очищена.")
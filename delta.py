@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+delta.py — режим приращений: сравнение портфеля клиента с прошлым прогоном и повторное
+использование результатов для позиций, которые не изменились.
+
+Прошлый прогон — кэш клиента Data_work/cache/delta/<клиент>.json, который map_instruments
+пишет после каждого прогона (ISIN, сопоставление по справочникам, количество); если кэша нет —
+последний снимок клиента в истории позиций (holdings_history). Разница считается над
+отсортированными массивами ISIN (np.intersect1d / np.setdiff1d с assume_unique):
+добавленные, удаленные и неизменные позиции.
+
+В режиме приращений (--delta или REPORT_DELTA=1):
+  map_instruments  — по справочникам сопоставляются и внешнему поиску тикеров (--resolve)
+                     отправляются только новые ISIN; записи неизменных берутся из кэша,
+                     если справочники с тех пор не менялись. TermSheets неизменных СП не
+                     копируются из справочника заново: берутся жесткой ссылкой из папки прошлого
+                     прогона (она архивируется в Data_Backup как обычно), копируются только
+                     PDF новых продуктов (и измененные в справочнике).
+  prices           — строки prices_*.json неизменных позиций (тот же тикер, количество и валюта)
+                     берутся из кэша <клиент>.prices.json, если совпадают период, поколение
+                     хранилища цен и базовая валюта (повторный прогон того же периода);
+                     провайдеру цен уходят только новые тикеры.
+Сводка изменений — delta_{клиент}_{начало}__{конец}.json, из нее template_creator заполняет
+лист «changes».
+"""
+
+import os
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from startup import lazy_import
+from instrumentation import count
+import price_store
+
+np = lazy_import("numpy")
+
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+DATA_WORK = os.path.join(BASE_DIR, "Data_work")
+CACHE_DIR = os.path.join(DATA_WORK, "cache", "delta")
+CACHE_VERSION = 1
+
+DELTA_ENV = "REPORT_DELTA"
+
+# Поля записей сопоставления, которые зависят от прогона, а не от справочника
+RUN_FIELDS = ("quantity", "currency")
+
+# Категория для сводки, если в записи нет "type" (как в holdings_history.snapshot_items)
+KIND_CATEGORY = {"stocks": "АКЦИЯ/ETF", "bonds": "ОБЛИГАЦИЯ", "sp": "СТРУКТУРНЫЙ ПРОДУКТ", "noname": "НЕИЗВЕСТНЫЙ"}
+
+CHANGE_ADDED = "Добавлена"
+CHANGE_REMOVED = "Удалена"
+CHANGE_QUANTITY = "Изменено количество"
+CHANGE_TOTAL = "Итого"
+
+
+def enabled(flag: bool = False) -> bool:
+    """Режим приращений: флаг --delta или REPORT_DELTA=1."""
+    return flag or os.environ.get(DELTA_ENV, "").strip().lower() in ("1", "true", "yes")
+
+
+@dataclass
+class Delta:
+    """Разница портфелей: отсортированные списки ISIN и прошлый период (None — прошлого прогона нет)."""
+    added: List[str]
+    removed: List[str]
+    unchanged: List[str]
+    previous_period: Optional[dict] = None
+    source: str = ""
+    previous_positions: Dict[str, dict] = field(default_factory=dict)
+
+    @property
+    def reused_share(self) -> float:
+        total = len(self.added) + len(self.unchanged)
+        return len(self.unchanged) / total if total else 0.0
+
+
+def diff_isins(current: Sequence[str], previous: Sequence[str]) -> Tuple[List[str], List[str], List[str]]:
+    """(добавленные, удаленные, неизменные) — операции над отсортированными уникальными массивами ISIN."""
+    cur = np.unique(np.asarray([s.strip().upper() for s in current if s and s.strip()], dtype=str))
+    prev = np.unique(np.asarray([s.strip().upper() for s in previous if s and s.strip()], dtype=str))
+    added = np.setdiff1d(cur, prev, assume_unique=True)
+    removed = np.setdiff1d(prev, cur, assume_unique=True)
+    unchanged = np.intersect1d(cur, prev, assume_unique=True)
+    return added.tolist(), removed.tolist(), unchanged.tolist()
+
+
+# ---------- Кэш клиента ----------
+
+def _cache_path(client: str, suffix: str = "") -> str:
+    return os.path.join(CACHE_DIR, f"{client.strip()}{suffix}.json")
+
+
+def load_cache(client: str, suffix: str = "") -> Optional[dict]:
+    try:
+        with open(_cache_path(client, suffix), "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return cached if cached.get("version") == CACHE_VERSION else None
+
+
+def save_cache(client: str, payload: dict, suffix: str = "") -> None:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = _cache_path(client, suffix)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": CACHE_VERSION, **payload}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def mapping_cache(period: dict, references: list, mapped: Dict[str, Tuple[str, dict]],
+                  positions: Dict[str, dict]) -> dict:
+    """Содержимое кэша map_instruments: {ISIN: [вид, запись без полей прогона]} и позиции."""
+    return {
+        "period": period,
+        "references": references,
+        "mapping": {isin: [kind, {k: v for k, v in rec.items() if k not in RUN_FIELDS}]
+                    for isin, (kind, rec) in mapped.items()},
+        "positions": positions,
+    }
+
+
+def previous_run(client: str, period: dict, cached: Optional[dict]) -> Tuple[List[str], Dict[str, dict], Optional[dict], str]:
+    """
+    ISIN, позиции и период прошлого прогона клиента: из кэша delta (если он не за более поздний
+    период), иначе — последний снимок в истории позиций с концом периода не позже текущего.
+    Нет ни того ни другого — пусто.
+    """
+    end = price_store.to_day(period["end_date"])
+    if cached is not None and price_store.to_day(cached["period"]["end_date"]) <= end:
+        return list(cached.get("mapping") or ()), cached.get("positions") or {}, cached["period"], "cache"
+    import holdings_history  # только без кэша — историю открываем по требованию
+    rows = holdings_history.HoldingsHistory.open().snapshot(period["end_date"], [client.strip()], max_age_days=None)
+    if not len(rows):
+        return [], {}, None, ""
+    records = rows.records()
+    positions = {rec["isin"]: {"quantity": rec["quantity"], "category": rec["category"]} for rec in records}
+    prev_period = {"start_date": records[0]["start_date"], "end_date": records[0]["end_date"]}
+    return list(positions), positions, prev_period, "history"
+
+
+def compute_delta(client: str, period: dict, isins: Sequence[str], cached: Optional[dict]) -> Delta:
+    previous, positions, prev_period, source = previous_run(client, period, cached)
+    added, removed, unchanged = diff_isins(isins, previous)
+    count("delta_added", len(added))
+    count("delta_removed", len(removed))
+    count("delta_unchanged", len(unchanged))
+    return Delta(added, removed, unchanged, prev_period, source, positions)
+
+
+# ---------- Сопоставление ----------
+
+def index_hits(hits_stocks: List[dict], hits_bonds: List[dict], hits_sp: List[dict],
+               misses: List[str]) -> Dict[str, Tuple[str, dict]]:
+    """Результат match_isins → {ISIN: (вид, запись)}; вид — stocks / bonds / sp / noname."""
+    mapped = {isin: ("noname", {"isin": isin}) for isin in misses}
+    for kind, hits in (("stocks", hits_stocks), ("bonds", hits_bonds), ("sp", hits_sp)):
+        for rec in hits:
+            mapped[rec["isin"]] = (kind, rec)
+    return mapped
+
+
+def ordered_hits(isins: Sequence[str], mapped: Dict[str, Tuple[str, dict]]
+                 ) -> Tuple[List[dict], List[dict], List[dict], List[str]]:
+    """Обратно к спискам match_isins в порядке входного JSON (ISIN без записи — в misses)."""
+    groups = {"stocks": [], "bonds": [], "sp": []}
+    misses: List[str] = []
+    seen = set()
+    for raw in isins:
+        isin = (raw or "").strip().upper()
+        if not isin or isin in seen:
+            continue
+        seen.add(isin)
+        kind, rec = mapped.get(isin) or ("noname", None)
+        if kind == "noname":
+            misses.append(isin)
+        else:
+            groups[kind].append(rec)
+    return groups["stocks"], groups["bonds"], groups["sp"], misses
+
+
+def reusable_mapping(cached: Optional[dict], references: list) -> Dict[str, Tuple[str, dict]]:
+    """Записи сопоставления из кэша — только если справочники не менялись с прошлого прогона."""
+    if not cached or cached.get("references") != references:
+        return {}
+    return {isin: (kind, rec) for isin, (kind, rec) in cached["mapping"].items()}
+
+
+# ---------- Сводка изменений ----------
+
+def _quantity(pos: Optional[dict]):
+    return None if not pos else pos.get("quantity")
+
+
+def change_items(delta: Delta, current: Dict[str, Tuple[str, dict]], positions: Dict[str, dict],
+                 previous: Optional[Dict[str, list]] = None) -> List[dict]:
+    """
+    Строки delta_*.json (лист «changes»): итог, добавленные, удаленные и позиции с измененным
+    количеством — {"change","isin","category","name","quantity_before","quantity_after"}.
+    current — {ISIN: (вид, запись)} текущего прогона, previous — mapping из кэша (для названий удаленных).
+    """
+    previous = previous or {}
+
+    def describe(isin: str, kind: str, rec: dict) -> Tuple[str, str]:
+        category = rec.get("type") or KIND_CATEGORY.get(kind) or \
+            (delta.previous_positions.get(isin) or {}).get("category", "")
+        return category, rec.get("name", "")
+
+    # Неизвестное количество (нет столбца в отчете, noname в истории позиций) изменением не считается
+    changed = []
+    for isin in delta.unchanged:
+        before, after = _quantity(delta.previous_positions.get(isin)), _quantity(positions.get(isin))
+        if before is not None and after is not None and before != after:
+            changed.append(isin)
+    items = [{"change": CHANGE_TOTAL, "isin": "", "category": "",
+              "name": f"добавлено {len(delta.added)}, удалено {len(delta.removed)}, "
+                      f"без изменений {len(delta.unchanged)} (из них с другим количеством {len(changed)})",
+              "quantity_before": None, "quantity_after": None}]
+    for change, isins in ((CHANGE_ADDED, delta.added), (CHANGE_REMOVED, delta.removed), (CHANGE_QUANTITY, changed)):
+        for isin in isins:
+            kind, rec = current.get(isin) or previous.get(isin) or ("", {})
+            category, name = describe(isin, kind, rec)
+            items.append({"change": change, "isin": isin, "category": category, "name": name,
+                          "quantity_before": None if change == CHANGE_ADDED else _quantity(delta.previous_positions.get(isin)),
+                          "quantity_after": None if change == CHANGE_REMOVED else _quantity(positions.get(isin))})
+    return items
+
+
+def write_changes(path: str, client: str, period: dict, delta: Delta, items: List[dict]) -> None:
+    payload = {"client": client, "period": period, "previous_period": delta.previous_period,
+               "source": delta.source, "items": items}
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+# ---------- Цены ----------
+
+def price_signature(rec: dict) -> list:
+    """То, от чего зависит строка prices_*.json при том же периоде и хранилище."""
+    return [(rec.get("ticker") or "").strip(), rec.get("quantity"), rec.get("currency") or ""]
+
+
+def price_cache_key(period: dict, store: "price_store.PriceStore", base: str) -> list:
+    return [period["start_date"], period["end_date"], store.generation, base]
+
+
+def reusable_prices(cached: Optional[dict], key: list, items: List[dict]) -> Dict[int, dict]:
+    """
+    {номер строки items: строка prices_*.json из кэша} — для позиций с тем же тикером, количеством
+    и валютой при совпадающем ключе (период, поколение хранилища, базовая валюта).
+    Строки с пропусками цен не переиспользуются: их стоит пересчитать после догрузки.
+    """
+    if not cached or cached.get("key") != key:
+        return {}
+    rows = cached.get("rows") or {}
+    reused = {}
+    for i, rec in enumerate(items):
+        hit = rows.get(rec.get("isin", ""))
+        if hit and hit[0] == price_signature(rec) and not hit[1].get("missing"):
+            reused[i] = hit[1]
+    return reused
+
+
+def prices_cache(key: list, items: List[dict], priced: List[dict]) -> dict:
+    return {"key": key, "rows": {rec.get("isin", ""): [price_signature(rec), row] for rec, row in zip(items, priced)}}
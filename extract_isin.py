@@ -3,6 +3,8 @@
 """
 Модуль извлечения уникальных валидных ISIN из Excel-отчетов.
 Извлекает ISIN из листа 'портфель', валидирует по ISO 6166, формирует JSON.
+Если на листе есть столбцы «Количество» и «Валюта», в JSON добавляются позиции
+(количество суммируется по дублям ISIN) — для оценки стоимости в базовой валюте клиента.
 """
 
 import os
@@ -14,44 +16,33 @@ from pathlib import Path
 from typing import Optional, List, Tuple
 from datetime import datetime
 
-# === Автоустановка rich (в первую очередь) ===
-try:
-    from rich.console import Console
-    from rich import print
-except ImportError:
-    print("Устанавливаю rich для цветного вывода...")
-    os.system(f'"{sys.executable}" -m pip install rich')
-    from rich.console import Console
-    from rich import print
-
-# === Автоустановка openpyxl ===
-try:
-    from openpyxl import load_workbook
-except ImportError:
-    print("[bold yellow]Устанавливаю openpyxl...[/bold yellow]")
-    os.system(f'"{sys.executable}" -m pip install openpyxl')
-    try:
-        from openpyxl import load_workbook
-    except ImportError:
-        print("[bold red]Модуль openpyxl не установлен. Установите вручную: pip install openpyxl[/bold red]")
-        sys.exit(1)
+# rich и openpyxl импортируются лениво (при первом обращении) через слой startup
+import startup
+from startup import console, lazy_import
+from instrumentation import count, span, stage_span
+from profiling import add_arguments as add_profile_arguments, profile_stage
+
+openpyxl = lazy_import("openpyxl")
+
+REQUIRED_MODULES = ["rich", "openpyxl"]
 
 # Константы путей
-BASE_DIR = r"F:\Python Projets\Report"
-DATA_IN = BASE_DIR + r"\Data_in"
-DATA_WORK = BASE_DIR + r"\Data_work"
-DATA_BACKUP = BASE_DIR + r"\Data_Backup"
-NAME_JSON = DATA_WORK + r"\name_clients.json"
-DATES_JSON = DATA_WORK + r"\report_dates.json"
+# (корень проекта можно переопределить переменной окружения REPORT_BASE_DIR)
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+DATA_IN = os.path.join(BASE_DIR, "Data_in")
+DATA_WORK = os.path.join(BASE_DIR, "Data_work")
+DATA_BACKUP = os.path.join(BASE_DIR, "Data_Backup")
+NAME_JSON = os.path.join(DATA_WORK, "name_clients.json")
+DATES_JSON = os.path.join(DATA_WORK, "report_dates.json")
 
-# Инициализация rich console
-console = Console()
+# Необязательные столбцы листа 'портфель' (заголовки сравниваются casefold+strip)
+QUANTITY_HEADERS = ("количество", "кол-во", "quantity")
+CURRENCY_HEADERS = ("валюта", "currency")
 
 
-def ensure_dependencies() -> None:
+def ensure_dependencies() -> bool:
     """Гарантирует наличие rich и openpyxl; при отсутствии — устанавливает через pip."""
-    # Зависимости уже проверены в импортах выше
-    pass
+    return startup.ensure_dependencies(REQUIRED_MODULES)
 
 
 def load_json(path: str) -> dict:
@@ -103,7 +94,7 @@ def find_input_workbook() -> Path:
 def open_workbook(ws_path: Path):
     """Открывает книгу openpyxl (read-only=False) и возвращает объект workbook."""
     try:
-        return load_workbook(ws_path, read_only=False)
+        return openpyxl.load_workbook(ws_path, read_only=False)
     except Exception as e:
         console.print(f"[red]❌ Ошибка открытия файла [/red][bright_cyan]{ws_path.name}[/bright_cyan][red]: {e}[/red]")
         sys.exit(1)
@@ -134,6 +125,45 @@ def find_isin_column(ws) -> int:
     sys.exit(1)
 
 
+def find_optional_column(ws, names: Tuple[str, ...]) -> Optional[int]:
+    """Индекс столбца с одним из заголовков names в 1-й строке; нет такого — None."""
+    for col_idx, cell in enumerate(ws[1], start=1):
+        if str(cell.value).strip().casefold() in names:
+            return col_idx
+    return None
+
+
+def parse_quantity(value) -> Optional[float]:
+    """Количество из ячейки: число или строка '1 234,5'; пусто/не число — None."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    text = str(value or "").replace("\u00a0", "").replace(" ", "").replace(",", ".")
+    try:
+        return float(text) if text else None
+    except ValueError:
+        return None
+
+
+def read_positions(ws, isin_col: int, qty_col: int, ccy_col: Optional[int]) -> List[dict]:
+    """
+    Позиции по валидным ISIN: [{"isin","quantity","currency"}] в порядке первых вхождений;
+    количество дублей ISIN суммируется, валюта — первая непустая.
+    """
+    positions: dict = {}
+    for row in ws.iter_rows(min_row=2, values_only=True):
+        raw = row[isin_col - 1] if len(row) >= isin_col else None
+        isin = str(raw).strip() if raw else ""
+        if not validate_isin(isin):
+            continue
+        qty = parse_quantity(row[qty_col - 1]) if len(row) >= qty_col else None
+        ccy = str(row[ccy_col - 1] or "").strip().upper() if ccy_col and len(row) >= ccy_col else ""
+        pos = positions.setdefault(isin, {"isin": isin, "quantity": None, "currency": ""})
+        if qty is not None:
+            pos["quantity"] = (pos["quantity"] or 0.0) + qty
+        pos["currency"] = pos["currency"] or ccy
+    return list(positions.values())
+
+
 def luhn_check_isin(isin: str) -> bool:
     """Выполняет Luhn-проверку для ISIN (после замены букв на числа A=10..Z=35)."""
     # Преобразуем буквы в числа: A=10, B=11, ..., Z=35
@@ -359,6 +389,7 @@ def main(argv: Optional[List[str]] = None) -> int:
         parser = argparse.ArgumentParser(description="Извлечение ISIN из Excel-отчетов")
         parser.add_argument("--yes", "-y", action="store_true", 
                           help="Автоматически подтверждать все действия")
+        add_profile_arguments(parser)
         args = parser.parse_args(argv)
         
         console.print("[bold green]🔍 Извлечение ISIN из Excel-отчета[/bold green]")
@@ -369,7 +400,8 @@ def main(argv: Optional[List[str]] = None) -> int:
         console.print(f"[green]✅ Найден файл: [/green][bright_cyan]{input_file.name}[/bright_cyan]")
         
         # Шаг 2: Открытие книги и поиск листа
-        wb = open_workbook(input_file)
+        with span("workbook_open", file=input_file.name):
+            wb = open_workbook(input_file)
         portfolio_sheet = find_portfolio_sheet(wb)
         console.print(f"[green]✅ Найден лист: {portfolio_sheet.title}[/green]")
         
@@ -379,7 +411,9 @@ def main(argv: Optional[List[str]] = None) -> int:
         
         # Шаг 4: Чтение и валидация ISIN
         console.print("[cyan]Чтение и валидация ISIN...[/cyan]")
-        raw_isins = read_isins(portfolio_sheet, isin_col)
+        with span("read_isins"):
+            raw_isins = read_isins(portfolio_sheet, isin_col)
+        count("rows_read", max(portfolio_sheet.max_row - 1, 0))
         
         if not raw_isins:
             console.print("[red]❌ В столбце ISIN не найдено данных[/red]")
@@ -399,8 +433,21 @@ def main(argv: Optional[List[str]] = None) -> int:
             console.print("[red]❌ Валидных ISIN не найдено[/red]")
             return 1
         
+        # Количество и валюта (если на листе есть такие столбцы)
+        qty_col = find_optional_column(portfolio_sheet, QUANTITY_HEADERS)
+        positions = None
+        if qty_col:
+            ccy_col = find_optional_column(portfolio_sheet, CURRENCY_HEADERS)
+            with span("read_positions"):
+                positions = read_positions(portfolio_sheet, isin_col, qty_col, ccy_col)
+            console.print(f"[green]✅ Найден столбец количества (колонка {qty_col})"
+                          + (f", валюты (колонка {ccy_col})" if ccy_col else "") + "[/green]")
+
         # Уникализация
         unique_isins, duplicates = unique_preserve_order(valid_isins)
+        count("isins_validated", len(raw_isins))
+        count("isins_invalid", invalid_count)
+        count("isins_duplicates", duplicates)
         
         # Шаг 5: Загрузка метаданных
         try:
@@ -440,9 +487,12 @@ def main(argv: Optional[List[str]] = None) -> int:
             },
             "isin": unique_isins
         }
+        if positions is not None:
+            payload["positions"] = positions
         
         # Шаг 10: Запись JSON
-        write_json(output_path, payload)
+        with span("json_write", file=output_path.name):
+            write_json(output_path, payload)
         
         # Шаг 11: Вывод результатов
         console.print(f"\n[green]✅ Найдено валидных ISIN: {len(unique_isins)}[/green]")
@@ -470,4 +520,8 @@ def main(argv: Optional[List[str]] = None) -> int:
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    if not ensure_dependencies():
+        sys.exit(1)
+    with stage_span("extract_isin"), profile_stage("extract_isin"):
+        code = main()
+    sys.exit(code)
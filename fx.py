@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fx.py — валютные курсы и пересчет стоимости позиций в базовую валюту клиента.
+
+Курсы лежат в том же хранилище цен (price_store), что и котировки: тикер FX:<валюта>,
+цена — сколько USD стоит 1 единица валюты (FX:EUR ≈ 1.08, FX:RUB ≈ 0.011). Загружаются
+как обычные цены: python price_store.py import fx.csv или через price_providers.
+Кросс-курс любой пары — отношение двух курсов к USD на одну дату (as-of, как цены).
+
+FxRates.from_store() один раз вынимает все ряды FX:* из хранилища в компактные массивы —
+снимок создается один раз на пакетный прогон и передается всем расчетам (и процессам пула:
+объект небольшой и сериализуется целиком). value_positions() пересчитывает стоимость всех
+позиций всех клиентов одним векторным проходом.
+
+Базовая валюта клиента — dictionaries/clients/base_currency.json:
+  {"default": "USD", "clients": {"Иванов И.И.": "RUB"}}
+
+CLI:
+  python fx.py EUR RUB [--date 30.09.2025]
+"""
+
+import os
+import sys
+import json
+import argparse
+from dataclasses import dataclass
+from datetime import date
+from typing import List, Optional, Sequence
+
+from startup import console, lazy_import
+from instrumentation import count
+import price_store
+
+np = lazy_import("numpy")
+
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+BASE_CURRENCY_JSON = os.path.join(BASE_DIR, "dictionaries", "clients", "base_currency.json")
+
+FX_PREFIX = "FX:"
+PIVOT_CURRENCY = "USD"
+DEFAULT_BASE_CURRENCY = "USD"
+
+# Курс старше даты пересчета больше чем на столько дней считается отсутствующим
+MAX_FX_LAG_DAYS = 7
+
+# Устаревшие и альтернативные коды → ISO 4217
+_ALIASES = {"RUR": "RUB", "РУБ": "RUB", "РУБЛЬ": "RUB"}
+
+
+def normalize_currency(value) -> str:
+    """Код валюты в верхнем регистре ('rur' → 'RUB'); пусто → ''."""
+    code = str(value or "").strip().upper()
+    return _ALIASES.get(code, code)
+
+
+def fx_ticker(currency: str) -> str:
+    return FX_PREFIX + normalize_currency(currency)
+
+
+def load_base_currencies(path: str = BASE_CURRENCY_JSON) -> dict:
+    """Настройки базовых валют {"default": ..., "clients": {...}}; если файла нет — USD для всех."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        config = {}
+    return {"default": normalize_currency(config.get("default")) or DEFAULT_BASE_CURRENCY,
+            "clients": {name.strip(): normalize_currency(ccy) for name, ccy in (config.get("clients") or {}).items()}}
+
+
+def base_currency(client: str, config: Optional[dict] = None) -> str:
+    """Базовая валюта клиента (по имени, как в name_clients/имени файла), иначе — по умолчанию."""
+    config = config if config is not None else load_base_currencies()
+    return config["clients"].get((client or "").strip()) or config["default"]
+
+
+class FxRates:
+    """
+    Снимок курсов к USD: keys = (индекс валюты << DAY_BITS) | день, rates — USD за 1 единицу.
+    Массивы — копии, а не mmap хранилища, поэтому снимок можно передавать в другие процессы.
+    """
+
+    def __init__(self, currencies: List[str], keys, rates):
+        self.currencies = currencies
+        self.cid = {c: i for i, c in enumerate(currencies)}
+        self.keys = keys
+        self.rates = rates
+
+    @classmethod
+    def from_store(cls, store: "price_store.PriceStore") -> "FxRates":
+        currencies, parts_keys, parts_rates = [], [], []
+        for ticker in store.tickers:
+            if not ticker.startswith(FX_PREFIX):
+                continue
+            tid = store.tid[ticker]
+            lo, hi = np.searchsorted(store.keys, [tid << price_store.DAY_BITS, (tid + 1) << price_store.DAY_BITS])
+            days = np.asarray(store.keys[lo:hi]) & price_store.DAY_MASK
+            parts_keys.append((len(currencies) << price_store.DAY_BITS) | days)
+            parts_rates.append(np.asarray(store.closes[lo:hi], dtype=np.float64))
+            currencies.append(ticker[len(FX_PREFIX):])
+        keys = np.concatenate(parts_keys) if parts_keys else np.empty(0, dtype=np.int64)
+        rates = np.concatenate(parts_rates) if parts_rates else np.empty(0, dtype=np.float64)
+        count("fx_points", int(keys.shape[0]))
+        return cls(currencies, keys, rates)
+
+    def usd_per(self, currencies: Sequence[str], days, max_lag_days: Optional[int] = MAX_FX_LAG_DAYS):
+        """USD за 1 единицу валюты на дни days (as-of); USD → 1.0, нет курса → NaN."""
+        codes = [normalize_currency(c) for c in currencies]
+        cids = np.fromiter((self.cid.get(c, -1) for c in codes), dtype=np.int64, count=len(codes))
+        pivot = np.fromiter((c == PIVOT_CURRENCY for c in codes), dtype=bool, count=len(codes))
+        return self._usd_per(cids, pivot, np.asarray(days, dtype=np.int64), max_lag_days)
+
+    def series(self, currency: str, days, max_lag_days: Optional[int] = MAX_FX_LAG_DAYS):
+        """USD за 1 единицу одной валюты на много дней (массив days любой формы)."""
+        days = np.asarray(days, dtype=np.int64)
+        code = normalize_currency(currency)
+        cids = np.full(days.size, self.cid.get(code, -1), dtype=np.int64)
+        pivot = np.full(days.size, code == PIVOT_CURRENCY)
+        return self._usd_per(cids, pivot, days.reshape(-1), max_lag_days).reshape(days.shape)
+
+    def _usd_per(self, cids, pivot, days, max_lag_days: Optional[int]):
+        result = np.full(cids.shape[0], np.nan)
+        result[pivot] = 1.0
+        known = cids >= 0
+        if known.any() and self.keys.shape[0]:
+            idx = np.searchsorted(self.keys, (cids[known] << price_store.DAY_BITS) | days[known], side="right") - 1
+            found = self.keys[np.clip(idx, 0, None)]
+            ok = (idx >= 0) & ((found >> price_store.DAY_BITS) == cids[known])
+            if max_lag_days is not None:
+                ok &= (days[known] - (found & price_store.DAY_MASK)) <= max_lag_days
+            result[np.flatnonzero(known)[ok]] = self.rates[idx[ok]]
+        return result
+
+    def cross(self, from_ccy: Sequence[str], to_ccy: Sequence[str], days,
+              max_lag_days: Optional[int] = MAX_FX_LAG_DAYS):
+        """Курс from → to (сколько единиц to за 1 from) для каждой строки; NaN — нет курса."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.usd_per(from_ccy, days, max_lag_days) / self.usd_per(to_ccy, days, max_lag_days)
+
+
+@dataclass
+class Valuation:
+    """Стоимость позиций: все поля — numpy-массивы по строкам."""
+    value: "np.ndarray"        # количество × цена, в валюте инструмента (NaN — нет цены или количества)
+    value_base: "np.ndarray"   # в базовой валюте клиента (NaN — нет стоимости или курса)
+    fx_rate: "np.ndarray"      # курс валюта инструмента → базовая
+    no_fx: "np.ndarray"        # bool: стоимость есть, курса нет
+
+
+def value_positions(fx: FxRates, quantities, prices, currencies: Sequence[str], bases: Sequence[str], days,
+                    max_lag_days: Optional[int] = MAX_FX_LAG_DAYS) -> Valuation:
+    """Стоимость и пересчет в базовую валюту для всех строк сразу (days — дни оценки, int64)."""
+    quantities = np.asarray(quantities, dtype=np.float64)
+    value = quantities * np.asarray(prices, dtype=np.float64)
+    rate = fx.cross(currencies, bases, days, max_lag_days)
+    value_base = value * rate
+    no_fx = ~np.isnan(value) & np.isnan(rate)
+    count("fx_rows", int(value.shape[0]))
+    count("fx_missing", int(np.count_nonzero(no_fx)))
+    return Valuation(value, value_base, rate, no_fx)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Кросс-курс из хранилища цен")
+    parser.add_argument("from_ccy")
+    parser.add_argument("to_ccy")
+    parser.add_argument("--date", default=f"{date.today():%d.%m.%Y}")
+    parser.add_argument("--store", default=price_store.PRICES_DIR, help="Папка хранилища цен")
+    args = parser.parse_args(argv)
+
+    fx = FxRates.from_store(price_store.PriceStore.open(args.store))
+    rate = fx.cross([args.from_ccy], [args.to_ccy], [price_store.to_day(args.date)])[0]
+    if np.isnan(rate):
+        console.print(f"[yellow]⚠️ Нет курса {args.from_ccy}/{args.to_ccy} на {args.date} "
+                      f"(валюты в хранилище: {', '.join(fx.currencies) or '—'})[/yellow]")
+        return 1
+    console.print(f"{normalize_currency(args.from_ccy)}/{normalize_currency(args.to_ccy)} на {args.date}: {rate:.6f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+holdings_history.py — история позиций клиентов между прогонами (колоночное хранилище, numpy).
+
+Каждый прогон map_instruments дописывает снимок портфеля клиента за период: строки
+(клиент, период, ISIN, категория, количество). Раньше снимок уходил в Data_Backup отдельным
+JSON, и вопросы «когда клиент впервые купил X» или «у кого был Y на конец квартала»
+требовали открывать сотни файлов.
+
+Формат на диске (dictionaries/history/):
+  history.json           — манифест: словари строк (клиенты, ISIN, категории; индекс = код),
+                           счетчик прогонов и список партиций
+  <ГГГГ-ММ>/base_<gen>.cols  — сжатая партиция месяца (по дате конца периода): столбцы
+                           client, isin, category (коды словарей), start, end (дни от 1970-01-01),
+                           quantity (NaN — неизвестно), run (номер прогона) подряд, каждый в формате .npy;
+                           отсортирована по (client, end, isin)
+  <ГГГГ-ММ>/delta_<run>.cols — дописанные прогоны, еще не слитые в base
+
+Запись — маленький delta-файл на партицию и атомарная подмена манифеста под файловой
+блокировкой; base не переписывается. Когда в партиции набирается COMPACT_AFTER дельт,
+запускается фоновый процесс (python holdings_history.py compact <месяц>): сливает base и
+дельты в новое поколение, оставляя для каждого снимка (клиент, начало, конец) только
+последний прогон — повторный отчет за тот же период заменяет прежний.
+
+Запросы (HoldingsHistory): snapshot() — портфели на дату (последний снимок каждого клиента
+не старше max_age_days), holders() — кто держал ISIN на дату, history() — все снимки по
+клиенту/ISIN за интервал, first_held() — дата первого снимка с бумагой. Читаются только
+партиции нужных месяцев, фильтры — векторные маски по кодам словарей.
+
+CLI:
+  python holdings_history.py holders US0378331005 --date 30.09.2025
+  python holdings_history.py history --client "Иванов И.И." [--isin …]
+  python holdings_history.py import --dir Data_Backup      — загрузить прошлые выходы map_instruments
+  python holdings_history.py compact [2025-09]             — слить дельты (обычно запускается в фоне)
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import subprocess
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from glob import glob
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from startup import console, lazy_import
+from instrumentation import count, span
+import price_store
+
+np = lazy_import("numpy")
+
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+HISTORY_DIR = os.path.join(BASE_DIR, "dictionaries", "history")
+MANIFEST_NAME = "history.json"
+LOCK_NAME = "history.lock"
+
+HISTORY_VERSION = 1
+COLUMNS = ("client", "isin", "category", "start", "end", "quantity", "run")
+_DTYPES = {"client": "int32", "isin": "int32", "category": "int16", "start": "int32", "end": "int32",
+           "quantity": "float64", "run": "int64"}
+
+# Сколько дельт в партиции запускают фоновое сжатие
+COMPACT_AFTER = 8
+# Снимок старше даты запроса больше чем на столько дней не считается текущим портфелем
+SNAPSHOT_MAX_AGE_DAYS = 92
+# Блокировка записи: ожидание и возраст, после которого она считается брошенной
+LOCK_TIMEOUT_SEC = 30.0
+LOCK_STALE_SEC = 600.0
+
+UNKNOWN_CATEGORY = "НЕИЗВЕСТНЫЙ"
+
+# Выходы map_instruments (текущие и из Data_Backup с суффиксом _резерв_ГГГГММДД_ЧЧММСС)
+_OUTPUT_RE = re.compile(r"(stock_etf|bonds|sp|noname_isin)_(.+)_(\d{2}\.\d{2}\.\d{4})__(\d{2}\.\d{2}\.\d{4})"
+                        r"(?:_резерв_(\d{8}_\d{6}))?\.json")
+_KIND_CATEGORY = {"bonds": "ОБЛИГАЦИЯ", "sp": "СТРУКТУРНЫЙ ПРОДУКТ", "noname_isin": UNKNOWN_CATEGORY}
+
+
+def month_of(day: int) -> str:
+    return f"{price_store.from_day(day):%Y-%m}"
+
+
+def _empty_columns() -> Dict[str, "np.ndarray"]:
+    return {name: np.empty(0, dtype=_DTYPES[name]) for name in COLUMNS}
+
+
+def latest_runs(cols: Dict[str, "np.ndarray"]) -> "np.ndarray":
+    """Маска строк последнего прогона каждого снимка (клиент, начало, конец)."""
+    if not cols["run"].size:
+        return np.zeros(0, dtype=bool)
+    key = (cols["client"].astype(np.int64) << 40) | (cols["start"].astype(np.int64) << 20) | cols["end"]
+    uniq, inverse = np.unique(key, return_inverse=True)
+    newest = np.full(uniq.shape[0], -1, dtype=np.int64)
+    np.maximum.at(newest, inverse, cols["run"])
+    return cols["run"] == newest[inverse]
+
+
+@dataclass
+class Rows:
+    """Результат запроса: столбцы-массивы (коды словарей и дни) и словари для расшифровки."""
+    columns: Dict[str, "np.ndarray"]
+    clients: List[str]
+    isins: List[str]
+    categories: List[str]
+
+    def __len__(self) -> int:
+        return int(self.columns["run"].shape[0])
+
+    def records(self) -> List[dict]:
+        """Строки в виде словарей с расшифрованными строками и датами DD.MM.YYYY."""
+        c = self.columns
+        return [{"client": self.clients[cl], "isin": self.isins[i], "category": self.categories[cat],
+                 "start_date": f"{price_store.from_day(s):%d.%m.%Y}", "end_date": f"{price_store.from_day(e):%d.%m.%Y}",
+                 "quantity": None if q != q else q}
+                for cl, i, cat, s, e, q in zip(c["client"].tolist(), c["isin"].tolist(), c["category"].tolist(),
+                                               c["start"].tolist(), c["end"].tolist(), c["quantity"].tolist())]
+
+
+class HoldingsHistory:
+    """
+    История позиций: манифест + партиции по месяцам, загружаемые по требованию.
+
+        history = HoldingsHistory.open()
+        history.holders("US0378331005", "30.09.2025")
+    """
+
+    def __init__(self, root: str, manifest: dict):
+        self.root = root
+        self.manifest = manifest
+        self.clients: List[str] = manifest["clients"]
+        self.isins: List[str] = manifest["isins"]
+        self.categories: List[str] = manifest["categories"]
+        self.client_code = {s: i for i, s in enumerate(self.clients)}
+        self.isin_code = {s: i for i, s in enumerate(self.isins)}
+        self._blank = self.isin_code.get("", -1)  # код строки-маркера пустого портфеля
+        self._partitions: Dict[str, Dict[str, "np.ndarray"]] = {}
+
+    @classmethod
+    def open(cls, root: str = HISTORY_DIR) -> "HoldingsHistory":
+        """Открывает историю только на чтение; если ее нет — пустая."""
+        return cls(root, _read_manifest(root))
+
+    @property
+    def months(self) -> List[str]:
+        return sorted(self.manifest["partitions"])
+
+    # ---------- Чтение партиций ----------
+
+    def partition(self, month: str) -> Dict[str, "np.ndarray"]:
+        """Столбцы партиции месяца: base + дельты, только последние прогоны каждого снимка."""
+        cols = self._partitions.get(month)
+        if cols is None:
+            try:
+                cols = _load_partition(self.root, month, self.manifest["partitions"].get(month))
+            except FileNotFoundError:
+                # Партицию только что сжали и удалили старые файлы — перечитываем манифест
+                self.__init__(self.root, _read_manifest(self.root))
+                cols = _load_partition(self.root, month, self.manifest["partitions"].get(month))
+            self._partitions[month] = cols
+        return cols
+
+    def _rows(self, parts: Iterable[Dict[str, "np.ndarray"]], masks: Iterable["np.ndarray"]) -> Rows:
+        chunks = [(p, m) for p, m in zip(parts, masks) if m.any()]
+        cols = {name: np.concatenate([p[name][m] for p, m in chunks]) for name in COLUMNS} if chunks \
+            else _empty_columns()
+        return Rows(cols, self.clients, self.isins, self.categories)
+
+    def _codes(self, values: Optional[Sequence[str]], table: Dict[str, int]):
+        if values is None:
+            return None
+        return np.fromiter((table.get(v, -1) for v in values), dtype=np.int64, count=len(values))
+
+    # ---------- Запросы ----------
+
+    def snapshot(self, when, clients: Optional[Sequence[str]] = None,
+                 max_age_days: Optional[int] = SNAPSHOT_MAX_AGE_DAYS) -> Rows:
+        """
+        Портфели на дату when: для каждого клиента — последний снимок с концом периода не позже when
+        (и не старше max_age_days; None — без ограничения).
+        """
+        day = price_store.to_day(when)
+        months = [m for m in self.months if m <= month_of(day)]
+        if max_age_days is not None:
+            months = [m for m in months if m >= month_of(day - max_age_days)]
+        wanted = self._codes(clients, self.client_code)
+        parts, masks = [], []
+        for month in months:
+            cols = self.partition(month)
+            mask = (cols["end"] <= day)
+            if max_age_days is not None:
+                mask &= cols["end"] >= day - max_age_days
+            if wanted is not None:
+                mask &= np.isin(cols["client"], wanted)
+            parts.append(cols)
+            masks.append(mask)
+        rows = self._rows(parts, masks)
+        if not len(rows):
+            return rows
+        # Последний снимок клиента: наибольший конец периода, при равенстве — наибольшее начало
+        c = rows.columns
+        key = (c["end"].astype(np.int64) << 20) | c["start"]
+        newest = np.full(len(self.clients), -1, dtype=np.int64)
+        np.maximum.at(newest, c["client"], key)
+        keep = (key == newest[c["client"]]) & (c["isin"] != self._blank)
+        return Rows({name: arr[keep] for name, arr in c.items()}, self.clients, self.isins, self.categories)
+
+    def holders(self, isin: str, when, max_age_days: Optional[int] = SNAPSHOT_MAX_AGE_DAYS) -> List[str]:
+        """Клиенты, у которых ISIN есть в портфеле на дату when."""
+        code = self.isin_code.get(isin.strip().upper(), -1)
+        rows = self.snapshot(when, max_age_days=max_age_days)
+        held = np.unique(rows.columns["client"][rows.columns["isin"] == code])
+        return [self.clients[i] for i in held.tolist()]
+
+    def history(self, client: Optional[str] = None, isin: Optional[str] = None,
+                start=None, end=None) -> Rows:
+        """Все снимки (по клиенту и/или ISIN) с концом периода в [start, end], по возрастанию даты."""
+        months = self.months
+        lo = price_store.to_day(start) if start else None
+        hi = price_store.to_day(end) if end else None
+        if lo is not None:
+            months = [m for m in months if m >= month_of(lo)]
+        if hi is not None:
+            months = [m for m in months if m <= month_of(hi)]
+        client_code = self.client_code.get(client.strip(), -1) if client else None
+        isin_code = self.isin_code.get(isin.strip().upper(), -1) if isin else None
+        parts, masks = [], []
+        for month in months:
+            cols = self.partition(month)
+            mask = cols["isin"] != self._blank
+            if client_code is not None:
+                mask &= cols["client"] == client_code
+            if isin_code is not None:
+                mask &= cols["isin"] == isin_code
+            if lo is not None:
+                mask &= cols["end"] >= lo
+            if hi is not None:
+                mask &= cols["end"] <= hi
+            parts.append(cols)
+            masks.append(mask)
+        rows = self._rows(parts, masks)
+        order = np.lexsort((rows.columns["isin"], rows.columns["client"], rows.columns["end"]))
+        return Rows({name: arr[order] for name, arr in rows.columns.items()}, self.clients, self.isins,
+                    self.categories)
+
+    def first_held(self, client: str, isin: str) -> Optional[str]:
+        """Дата конца первого периода, в снимке которого у клиента есть ISIN (DD.MM.YYYY), или None."""
+        rows = self.history(client=client, isin=isin)
+        if not len(rows):
+            return None
+        return f"{price_store.from_day(int(rows.columns['end'].min())):%d.%m.%Y}"
+
+
+# ---------- Манифест и файлы ----------
+
+def _read_manifest(root: str) -> dict:
+    try:
+        with open(os.path.join(root, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {"version": HISTORY_VERSION, "clients": [], "isins": [], "categories": [],
+                "next_run": 1, "partitions": {}}
+    if manifest.get("version") != HISTORY_VERSION:
+        raise ValueError(f"Неподдерживаемая версия истории позиций: {manifest.get('version')}")
+    return manifest
+
+
+def _write_manifest(root: str, manifest: dict) -> None:
+    manifest["updated"] = datetime.now().isoformat(timespec="seconds")
+    tmp = os.path.join(root, MANIFEST_NAME + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp, os.path.join(root, MANIFEST_NAME))
+
+
+def _save_columns(path: str, cols: Dict[str, "np.ndarray"]) -> None:
+    """Столбцы COLUMNS подряд в одном файле, каждый — в формате .npy (одно открытие файла на чтение)."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        for name in COLUMNS:
+            np.save(f, cols[name].astype(_DTYPES[name], copy=False))
+    os.replace(tmp, path)
+
+
+def _read_columns(path: str) -> Dict[str, "np.ndarray"]:
+    with open(path, "rb") as f:
+        return {name: np.load(f) for name in COLUMNS}
+
+
+def _load_partition(root: str, month: str, info: Optional[dict]) -> Dict[str, "np.ndarray"]:
+    if not info:
+        return _empty_columns()
+    folder = os.path.join(root, month)
+    parts = [_read_columns(os.path.join(folder, f"base_{info['base']}.cols"))] if info.get("base") else []
+    parts += [_read_columns(os.path.join(folder, f"delta_{run}.cols")) for run, _ in info.get("deltas", ())]
+    if not parts:
+        return _empty_columns()
+    if len(parts) == 1 and not info.get("deltas"):
+        return parts[0]  # base уже без повторов
+    cols = {name: np.concatenate([p[name] for p in parts]) for name in COLUMNS}
+    keep = latest_runs(cols)
+    return {name: arr[keep] for name, arr in cols.items()}
+
+
+@contextmanager
+def _locked(root: str):
+    """Файловая блокировка записи манифеста (O_EXCL); брошенная блокировка снимается по возрасту."""
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, LOCK_NAME)
+    deadline = time.monotonic() + LOCK_TIMEOUT_SEC
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.write(fd, str(os.getpid()).encode())
+            os.close(fd)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > LOCK_STALE_SEC:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"История позиций занята другим процессом: {path}")
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _encode(values: Iterable[str], table: List[str], index: Dict[str, int]) -> List[int]:
+    codes = []
+    for value in values:
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(table)
+            table.append(value)
+        codes.append(code)
+    return codes
+
+
+# ---------- Запись ----------
+
+def append_snapshots(snapshots: Sequence[Tuple[str, dict, List[dict]]], root: str = HISTORY_DIR,
+                     compact: bool = True) -> int:
+    """
+    Дописывает снимки [(клиент, {"start_date","end_date"}, [{"isin","category","quantity"}])] —
+    каждый снимок получает свой номер прогона, на партицию пишется один delta-файл.
+    При compact=True для партиций с COMPACT_AFTER дельтами запускается фоновое сжатие.
+    Возвращает число записанных строк.
+    """
+    with _locked(root), span("history_append", snapshots=len(snapshots)):
+        manifest = _read_manifest(root)
+        index = {name: {s: i for i, s in enumerate(manifest[name])} for name in ("clients", "isins", "categories")}
+        by_month: Dict[str, Dict[str, list]] = {}
+        for client, period, items in snapshots:
+            run = manifest["next_run"]
+            manifest["next_run"] += 1
+            start, end = price_store.to_day(period["start_date"]), price_store.to_day(period["end_date"])
+            cols = by_month.setdefault(month_of(end), {name: [] for name in COLUMNS})
+            # Пустой портфель — тоже снимок: строка-маркер с ISIN "" (в результаты запросов не попадает)
+            items = items or [{"isin": "", "category": UNKNOWN_CATEGORY}]
+            n = len(items)
+            cols["client"] += _encode([client.strip()] * n, manifest["clients"], index["clients"])
+            cols["isin"] += _encode(((rec.get("isin") or "").strip().upper() for rec in items),
+                                    manifest["isins"], index["isins"])
+            cols["category"] += _encode(((rec.get("category") or UNKNOWN_CATEGORY) for rec in items),
+                                        manifest["categories"], index["categories"])
+            cols["start"] += [start] * n
+            cols["end"] += [end] * n
+            cols["quantity"] += [float("nan") if rec.get("quantity") is None else float(rec["quantity"])
+                                 for rec in items]
+            cols["run"] += [run] * n
+
+        rows, to_compact = 0, []
+        for month, lists in by_month.items():
+            info = manifest["partitions"].setdefault(month, {"base": 0, "rows": 0, "deltas": []})
+            run = lists["run"][-1]
+            os.makedirs(os.path.join(root, month), exist_ok=True)
+            _save_columns(os.path.join(root, month, f"delta_{run}.cols"),
+                          {name: np.asarray(lists[name], dtype=_DTYPES[name]) for name in COLUMNS})
+            info["deltas"].append([run, len(lists["run"])])
+            info["rows"] += len(lists["run"])
+            rows += len(lists["run"])
+            if len(info["deltas"]) >= COMPACT_AFTER:
+                to_compact.append(month)
+        _write_manifest(root, manifest)
+    count("history_rows_appended", rows)
+    if compact and to_compact:
+        compact_in_background(root, to_compact)
+    return rows
+
+
+def compact_in_background(root: str, months: List[str]) -> None:
+    """Запускает сжатие отдельным процессом, не дожидаясь его (этап не ждет слияния дельт)."""
+    cmd = [sys.executable, os.path.abspath(__file__), "--root", root, "compact", *months]
+    kwargs = {"stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL, "stdin": subprocess.DEVNULL}
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    subprocess.Popen(cmd, **kwargs)
+
+
+def compact(root: str = HISTORY_DIR, months: Optional[List[str]] = None) -> int:
+    """
+    Сливает base и дельты партиций в новое поколение base. Тяжелая часть идет без блокировки:
+    под блокировкой — только снимок списка дельт и подмена манифеста (дельты, дописанные за время
+    слияния, остаются в списке). Возвращает число сжатых партиций.
+    """
+    with _locked(root):
+        manifest = _read_manifest(root)
+    months = [m for m in (months or sorted(manifest["partitions"])) if manifest["partitions"].get(m, {}).get("deltas")]
+    done = 0
+    for month in months:
+        info = dict(manifest["partitions"][month])
+        with span("history_compact", month=month, deltas=len(info["deltas"])):
+            cols = _load_partition(root, month, info)
+            order = np.lexsort((cols["isin"], cols["end"], cols["client"]))
+            cols = {name: arr[order] for name, arr in cols.items()}
+            gen = (info.get("base") or 0) + 1
+            _save_columns(os.path.join(root, month, f"base_{gen}.cols"), cols)
+        with _locked(root):
+            current = _read_manifest(root)
+            part = current["partitions"][month]
+            if part.get("base") != info.get("base"):
+                continue  # партицию уже сжал другой процесс
+            merged = {run for run, _ in info["deltas"]}
+            part["deltas"] = [d for d in part["deltas"] if d[0] not in merged]
+            part["base"] = gen
+            part["rows"] = int(cols["run"].shape[0]) + sum(n for _, n in part["deltas"])
+            _write_manifest(root, current)
+        stale = [f"delta_{run}.cols" for run in merged]
+        if info.get("base"):
+            stale.append(f"base_{info['base']}.cols")
+        for name in stale:
+            try:
+                os.remove(os.path.join(root, month, name))
+            except OSError:
+                pass
+        done += 1
+    count("history_partitions_compacted", done)
+    return done
+
+
+# ---------- Снимки из выходов map_instruments ----------
+
+def snapshot_items(hits_stocks: List[dict], hits_bonds: List[dict], hits_sp: List[dict],
+                   misses: Sequence[str] = ()) -> List[dict]:
+    """Строки снимка из результатов сопоставления: категория — тип из справочника или вид выхода."""
+    items = [{"isin": rec.get("isin", ""), "category": rec.get("type") or "АКЦИЯ/ETF", "quantity": rec.get("quantity")}
+             for rec in hits_stocks]
+    items += [{"isin": rec.get("isin", ""), "category": _KIND_CATEGORY["bonds"], "quantity": rec.get("quantity")}
+              for rec in hits_bonds]
+    items += [{"isin": rec.get("isin", ""), "category": rec.get("type") or _KIND_CATEGORY["sp"],
+               "quantity": rec.get("quantity")} for rec in hits_sp]
+    items += [{"isin": isin, "category": UNKNOWN_CATEGORY, "quantity": None} for isin in misses]
+    return items
+
+
+def collect_outputs(folder: str) -> List[Tuple[str, dict, List[dict]]]:
+    """
+    Снимки из JSON map_instruments в папке (Data_work или Data_Backup): файлы одного клиента, периода
+    и суффикса резервной копии — один снимок; порядок — по времени копии (текущие — последними).
+    """
+    groups: Dict[Tuple[str, str, str, str], List[dict]] = {}
+    for path in glob(os.path.join(folder, "*.json")):
+        m = _OUTPUT_RE.fullmatch(os.path.basename(path))
+        if not m:
+            continue
+        kind, client, start, end, stamp = m.groups()
+        with open(path, "r", encoding="utf-8") as f:
+            items = json.load(f).get("items") or []
+        category = _KIND_CATEGORY.get(kind)
+        groups.setdefault((stamp or "99999999_999999", client, start, end), []).extend(
+            {"isin": rec.get("isin", ""), "category": category or rec.get("type") or "АКЦИЯ/ETF",
+             "quantity": rec.get("quantity")} for rec in items)
+    return [(client, {"start_date": start, "end_date": end}, items)
+            for (_, client, start, end), items in sorted(groups.items())]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="История позиций клиентов")
+    parser.add_argument("--root", default=HISTORY_DIR, help="Папка истории")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_hold = sub.add_parser("holders", help="Кто держал ISIN на дату")
+    p_hold.add_argument("isin")
+    p_hold.add_argument("--date", required=True)
+    p_hist = sub.add_parser("history", help="Снимки по клиенту и/или ISIN")
+    p_hist.add_argument("--client")
+    p_hist.add_argument("--isin")
+    p_hist.add_argument("--start")
+    p_hist.add_argument("--end")
+    p_imp = sub.add_parser("import", help="Загрузить снимки из выходов map_instruments в папке")
+    p_imp.add_argument("--dir", required=True)
+    p_comp = sub.add_parser("compact", help="Слить дельты партиций")
+    p_comp.add_argument("months", nargs="*")
+    args = parser.parse_args(argv)
+
+    if args.command == "compact":
+        done = compact(args.root, args.months or None)
+        console.print(f"[green]🗜️ Сжато партиций: {done}[/green]")
+        return 0
+
+    if args.command == "import":
+        snapshots = collect_outputs(args.dir)
+        if not snapshots:
+            console.print(f"[yellow]⚠️ В {args.dir} нет выходов map_instruments[/yellow]")
+            return 1
+        rows = append_snapshots(snapshots, args.root, compact=False)
+        compact(args.root)
+        console.print(f"[green]✅ Снимков: {len(snapshots)}; строк: {rows}[/green]")
+        return 0
+
+    history = HoldingsHistory.open(args.root)
+    if args.command == "holders":
+        clients = history.holders(args.isin, args.date)
+        console.print(f"{args.isin.upper()} на {args.date}: {len(clients)} клиент(ов)")
+        for client in clients:
+            console.print(f"  {client}")
+        return 0
+
+    if not (args.client or args.isin):
+        console.print("[yellow]⚠️ Укажите --client и/или --isin[/yellow]")
+        return 1
+    rows = history.history(args.client, args.isin, args.start, args.end)
+    for rec in rows.records():
+        qty = "" if rec["quantity"] is None else f"{rec['quantity']:g}"
+        console.print(f"{rec['end_date']}  {rec['client']:<24} {rec['isin']:<14} {rec['category']:<20} {qty}")
+    console.print(f"Строк: {len(rows)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
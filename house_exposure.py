@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+house_exposure.py — сводная экспозиция дома по всем клиентам: по ISIN, эмитентам и категориям
+инструментов, с крупнейшими концентрациями (numpy, группировка по словарным кодам).
+
+Источник — выходы map_instruments всех клиентов (stock_etf_*, bonds_*, sp_*) в Data_work и Data_Backup:
+map_instruments при прогоне клиента отправляет выходы остальных клиентов в резерв
+(суффикс _резерв_ГГГГММДД_ЧЧММСС), поэтому для каждого клиента берется последний период и в нем —
+самая свежая копия (текущие файлы Data_work свежее любой резервной). Файлы читаются по одному, каждая позиция становится строкой компактных
+колонок: коды клиента, ISIN, тикера, эмитента, категории и валюты (int32, словари строка → код —
+хеш-таблицы dict), день конца периода, количество и стоимость в USD. Группировка — np.bincount по
+кодам; «держатели» — число различных клиентов (np.unique пар клиент × ключ).
+
+Стоимость — количество × цена закрытия на конец периода × курс к USD (price_store, fx), как в risk
+и look_through. Облигации и СП учитываются количеством и держателями: цена облигации в хранилище —
+% от номинала, а номинал в справочнике не хранится.
+Эмитент: для акций/ETF — название, для облигаций — название до запятой или купона,
+для СП — «Нет данных».
+
+Колонки кэшируются в Data_work/cache/house/ (house.npz + house.json с сигнатурой файлов каждого
+клиента: имя, размер, mtime). Повторный прогон одного клиента перечитывает только его файлы: строки
+клиента убираются маской и дописываются заново; после догрузки цен (новое поколение хранилища)
+стоимость всех строк пересчитывается одним векторным запросом, без чтения JSON.
+
+Результат — house_exposure.json и house_exposure.xlsx (листы «ISIN», «Эмитенты», «Категории»)
+в папке выходов: доля в стоимости дома, держатели, количество; сводка — стоимость, покрытие ценами,
+доля топ-10 и индекс Херфиндаля по эмитентам.
+  python house_exposure.py [--dir Data_work Data_Backup] [--out Data_work] [--top 50] [--no-cache]
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+from dataclasses import dataclass
+from glob import glob
+from typing import Dict, List, Optional, Tuple
+
+from startup import console, ensure_dependencies, lazy_import
+from instrumentation import count, span, stage_span
+from profiling import add_arguments as add_profile_arguments, profile_stage
+import price_store
+import fx
+
+np = lazy_import("numpy")
+openpyxl = lazy_import("openpyxl")
+
+REQUIRED_MODULES = ["rich", "numpy", "openpyxl"]
+
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+DATA_WORK = os.path.join(BASE_DIR, "Data_work")
+DATA_BACKUP = os.path.join(BASE_DIR, "Data_Backup")
+CACHE_DIR = os.path.join(DATA_WORK, "cache", "house")
+CACHE_VERSION = 1
+
+# Цена старше даты отчета больше чем на столько дней считается отсутствующей
+MAX_PRICE_LAG_DAYS = 7
+
+TOP_ROWS = 50
+TOP_SHARE_N = 10
+UNKNOWN = "Нет данных"
+BOND_TYPE = "ОБЛИГАЦИЯ"
+SP_TYPE = "СТРУКТУРНЫЙ ПРОДУКТ"
+STOCK_TYPE = "АКЦИЯ/ETF"
+
+# Выход map_instruments → префикс файла (текущие и из Data_Backup с суффиксом _резерв_ГГГГММДД_ЧЧММСС)
+SOURCES = {"stocks": "stock_etf", "bonds": "bonds", "sp": "sp"}
+_OUTPUT_RE = re.compile(r"(stock_etf|bonds|sp)_(.+)_(\d{2}\.\d{2}\.\d{4})__(\d{2}\.\d{2}\.\d{4})"
+                        r"(?:_резерв_(\d{8}_\d{6}))?\.json")
+# Метка текущих файлов (без суффикса) — свежее любой резервной копии
+CURRENT_STAMP = "99999999_999999"
+
+# Эмитент облигации — название до запятой или до купона («Issuer 5, 3% 2031» → «Issuer 5»)
+_BOND_ISSUER_RE = re.compile(r"\s*(?:,|\d+(?:[.,]\d+)?\s*%).*$")
+
+# Разрезы: колонка кодов → (название листа, заголовок ключа)
+DIMENSIONS = {"isin": ("ISIN", "ISIN"), "issuer": ("Эмитенты", "Эмитент"), "category": ("Категории", "Категория")}
+TABLE_HEADERS = ("Стоимость, USD", "Доля, %", "Держателей", "Позиций", "Количество")
+
+# Строковые колонки и их словари в кэше
+CODED = ("client", "isin", "ticker", "issuer", "category", "currency")
+
+
+@dataclass
+class Rows:
+    """Позиции всех клиентов: колонки одинаковой длины и словари кодов строковых колонок."""
+    columns: Dict[str, "np.ndarray"]
+    tables: Dict[str, List[str]]
+
+    def __len__(self) -> int:
+        return int(self.columns["client"].shape[0])
+
+
+def _empty_rows() -> Rows:
+    columns = {name: np.empty(0, dtype=np.int32) for name in CODED}
+    columns.update(end=np.empty(0, dtype=np.int32), quantity=np.empty(0), value=np.empty(0))
+    return Rows(columns, {name: [] for name in CODED})
+
+
+def issuer_of(kind: str, rec: dict) -> str:
+    if rec.get("issuer"):
+        return str(rec["issuer"]).strip()
+    name = (rec.get("name") or "").strip()
+    if kind == "bonds":
+        name = _BOND_ISSUER_RE.sub("", name)
+    return name if name and kind != "sp" else UNKNOWN
+
+
+def category_of(kind: str, rec: dict) -> str:
+    if kind == "bonds":
+        return BOND_TYPE
+    if kind == "sp":
+        return rec.get("type") or SP_TYPE
+    return rec.get("type") or STOCK_TYPE
+
+
+def collect_outputs(*folders: str) -> Dict[str, Tuple[dict, Dict[str, str]]]:
+    """
+    {клиент: (период, {вид: путь})} по всем папкам: последний период каждого клиента (по концу, затем
+    по началу), в нем — самая свежая копия прогона (файлы одного суффикса _резерв_ — одна копия).
+    """
+    found: Dict[str, Dict[Tuple[int, int], Dict[str, Dict[str, str]]]] = {}
+    kinds = {prefix: kind for kind, prefix in SOURCES.items()}
+    for folder in folders:
+        for path in glob(os.path.join(folder, "*.json")):
+            m = _OUTPUT_RE.fullmatch(os.path.basename(path))
+            if not m:
+                continue
+            prefix, client, start, end, stamp = m.groups()
+            key = (price_store.to_day(end), price_store.to_day(start))
+            copies = found.setdefault(client, {}).setdefault(key, {})
+            copies.setdefault(stamp or CURRENT_STAMP, {})[kinds[prefix]] = path
+    latest = {}
+    for client, periods in found.items():
+        end, start = max(periods)
+        copies = periods[(end, start)]
+        latest[client] = ({"start_date": f"{price_store.from_day(start):%d.%m.%Y}",
+                           "end_date": f"{price_store.from_day(end):%d.%m.%Y}"}, copies[max(copies)])
+    return latest
+
+
+def _signature(paths: Dict[str, str]) -> List[list]:
+    sig = []
+    for kind in sorted(paths):
+        st = os.stat(paths[kind])
+        sig.append([os.path.basename(paths[kind]), st.st_size, st.st_mtime_ns])
+    return sig
+
+
+def _load_cache(cache_dir: str) -> Tuple[Optional[dict], Rows]:
+    try:
+        with open(os.path.join(cache_dir, "house.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != CACHE_VERSION:
+            return None, _empty_rows()
+        with np.load(os.path.join(cache_dir, "house.npz")) as cached:
+            columns = {name: cached[name] for name in cached.files}
+        return meta, Rows(columns, meta["tables"])
+    except (OSError, ValueError, KeyError):
+        return None, _empty_rows()
+
+
+def _save_cache(cache_dir: str, meta: dict, rows: Rows) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = os.path.join(cache_dir, "house.tmp.npz")
+    np.savez(tmp, **rows.columns)
+    os.replace(tmp, os.path.join(cache_dir, "house.npz"))
+    tmp = os.path.join(cache_dir, "house.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({**meta, "tables": rows.tables}, f, ensure_ascii=False)
+    os.replace(tmp, os.path.join(cache_dir, "house.json"))
+
+
+def read_clients(outputs: Dict[str, Tuple[dict, Dict[str, str]]], rows: Rows) -> Dict[str, "np.ndarray"]:
+    """
+    Позиции перечисленных клиентов → новые строки колонок (без стоимости). Файлы читаются по одному;
+    словари rows.tables только пополняются — коды строк из кэша не меняются.
+    """
+    index = {name: {value: i for i, value in enumerate(rows.tables[name])} for name in CODED}
+
+    def code(name: str, value: str) -> int:
+        table = index[name]
+        c = table.get(value)
+        if c is None:
+            c = table[value] = len(rows.tables[name])
+            rows.tables[name].append(value)
+        return c
+
+    new = {name: [] for name in CODED}
+    ends, quantities = [], []
+    for client, (period, paths) in outputs.items():
+        client_code = code("client", client)
+        end = price_store.to_day(period["end_date"])
+        for kind, path in paths.items():
+            with open(path, "r", encoding="utf-8") as f:
+                items = json.load(f).get("items") or []
+            for rec in items:
+                isin = (rec.get("isin") or "").strip().upper()
+                if not isin:
+                    continue
+                new["client"].append(client_code)
+                new["isin"].append(code("isin", isin))
+                new["ticker"].append(code("ticker", (rec.get("ticker") or "").strip() if kind == "stocks" else ""))
+                new["issuer"].append(code("issuer", issuer_of(kind, rec)))
+                new["category"].append(code("category", category_of(kind, rec)))
+                new["currency"].append(code("currency", fx.normalize_currency(rec.get("currency")) or fx.PIVOT_CURRENCY))
+                ends.append(end)
+                quantities.append(np.nan if rec.get("quantity") is None else float(rec["quantity"]))
+    columns = {name: np.asarray(values, dtype=np.int32) for name, values in new.items()}
+    columns["end"] = np.asarray(ends, dtype=np.int32)
+    columns["quantity"] = np.asarray(quantities, dtype=np.float64)
+    return columns
+
+
+def value_rows(columns: Dict[str, "np.ndarray"], tables: Dict[str, List[str]],
+               store: "price_store.PriceStore", rates: "fx.FxRates") -> "np.ndarray":
+    """Стоимость строк в USD на конец периода: количество × цена × курс (NaN — нет цены или количества)."""
+    if not columns["client"].size:
+        return np.empty(0)
+    tickers = np.asarray(store.ticker_ids(tables["ticker"]) if tables["ticker"] else [], dtype=np.int64)
+    days = columns["end"].astype(np.int64)
+    prices, _ = store.as_of_many(tickers[columns["ticker"]], days, MAX_PRICE_LAG_DAYS)
+    currencies = np.asarray(tables["currency"], dtype=object)[columns["currency"]]
+    usd = rates.usd_per(currencies.tolist(), days)
+    return columns["quantity"] * prices * usd
+
+
+def update_rows(outputs: Dict[str, Tuple[dict, Dict[str, str]]], store: "price_store.PriceStore",
+                cache_dir: Optional[str] = CACHE_DIR) -> Tuple[Rows, int, bool]:
+    """
+    Колонки позиций по текущим выходам папки: из кэша — клиенты с неизменными файлами, заново —
+    новые и перезапущенные; строки исчезнувших клиентов удаляются.
+    Возвращает (строки, перечитано клиентов, изменилось ли что-нибудь с прошлого расчета).
+    """
+    meta, rows = _load_cache(cache_dir) if cache_dir else (None, _empty_rows())
+    signatures = {client: _signature(paths) for client, (_, paths) in outputs.items()}
+    cached = (meta or {}).get("clients", {})
+    changed = {client: outputs[client] for client, sig in signatures.items() if cached.get(client) != sig}
+    stale = {client for client in cached if client not in signatures or client in changed}
+
+    if stale:
+        codes = [i for i, client in enumerate(rows.tables["client"]) if client in stale]
+        keep = ~np.isin(rows.columns["client"], np.asarray(codes, dtype=np.int32))
+        rows.columns = {name: column[keep] for name, column in rows.columns.items()}
+    rates = None
+    if changed:
+        with span("house_read", clients=len(changed)):
+            added = read_clients(changed, rows)
+        rates = fx.FxRates.from_store(store)
+        added["value"] = value_rows(added, rows.tables, store, rates)
+        rows.columns = {name: np.concatenate((rows.columns[name], added[name]))
+                        for name in rows.columns}
+    if meta is not None and meta.get("generation") != store.generation and len(rows):
+        # Хранилище цен обновилось — переоценка всех строк без чтения JSON
+        with span("house_revalue", rows=len(rows)):
+            rows.columns["value"] = value_rows(rows.columns, rows.tables, store, rates or fx.FxRates.from_store(store))
+
+    dirty = bool(changed or stale) or meta is None or meta.get("generation") != store.generation
+    if cache_dir and dirty:
+        _save_cache(cache_dir, {"version": CACHE_VERSION, "generation": store.generation, "clients": signatures}, rows)
+    return rows, len(changed), dirty
+
+
+def group_table(rows: Rows, dimension: str, top: Optional[int] = None) -> List[dict]:
+    """
+    Таблица разреза: по ключу — стоимость в USD, доля в стоимости дома (%), держатели, позиции,
+    количество; по убыванию стоимости, затем держателей. top — только первые строки.
+    """
+    c = rows.columns
+    keys = c[dimension]
+    size = len(rows.tables[dimension])
+    value = np.nan_to_num(c["value"])
+    totals = np.bincount(keys, weights=value, minlength=size)
+    positions = np.bincount(keys, minlength=size)
+    quantity = np.bincount(keys, weights=np.nan_to_num(c["quantity"]), minlength=size)
+    pairs = np.unique(keys.astype(np.int64) * len(rows.tables["client"]) + c["client"])
+    holders = np.bincount(pairs // max(len(rows.tables["client"]), 1), minlength=size)
+    house = float(value.sum())
+
+    present = np.flatnonzero(positions)
+    order = present[np.lexsort((-holders[present], -totals[present]))]
+    if top is not None:
+        order = order[:top]
+    names = rows.tables[dimension]
+    return [{"key": names[k], "value_usd": round(float(totals[k]), 2),
+             "share": round(float(totals[k]) / house * 100.0, 4) if house > 0 else None,
+             "holders": int(holders[k]), "positions": int(positions[k]), "quantity": float(quantity[k])}
+            for k in order.tolist()]
+
+
+def concentration(rows: Rows, dimension: str, top_n: int = TOP_SHARE_N) -> dict:
+    """Доля топ-N ключей в стоимости дома (%) и индекс Херфиндаля (0–10 000)."""
+    totals = np.bincount(rows.columns[dimension], weights=np.nan_to_num(rows.columns["value"]),
+                         minlength=len(rows.tables[dimension]))
+    house = totals.sum()
+    if house <= 0:
+        return {"top_share": None, "hhi": None}
+    shares = totals / house
+    top = np.sort(shares)[::-1][:top_n]
+    return {"top_share": round(float(top.sum()) * 100.0, 4), "hhi": round(float((shares ** 2).sum()) * 10000.0, 2)}
+
+
+def house_summary(rows: Rows, outputs: Dict[str, Tuple[dict, Dict[str, str]]]) -> dict:
+    valued = ~np.isnan(rows.columns["value"])
+    ends = [price_store.to_day(period["end_date"]) for period, _ in outputs.values()]
+    return {
+        "as_of": f"{price_store.from_day(max(ends)):%d.%m.%Y}" if ends else None,
+        "clients": len(outputs),
+        "positions": len(rows),
+        "value_usd": round(float(np.nansum(rows.columns["value"])), 2),
+        "coverage": round(float(valued.mean()) * 100.0, 4) if len(rows) else None,
+        "concentration": {dimension: concentration(rows, dimension) for dimension in ("isin", "issuer")},
+    }
+
+
+def write_json_atomic(path: str, payload: dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def write_workbook(path: str, tables: Dict[str, List[dict]]) -> None:
+    """Таблицы разрезов — листы xlsx (write_only: строки пишутся потоком)."""
+    wb = openpyxl.Workbook(write_only=True)
+    for dimension, (title, key_header) in DIMENSIONS.items():
+        ws = wb.create_sheet(title)
+        ws.append((key_header,) + TABLE_HEADERS)
+        for row in tables[dimension]:
+            ws.append((row["key"], row["value_usd"], row["share"], row["holders"], row["positions"], row["quantity"]))
+    tmp = path + ".tmp"
+    wb.save(tmp)
+    os.replace(tmp, path)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Сводная экспозиция дома по ISIN, эмитентам и категориям")
+    parser.add_argument("--dir", nargs="+", default=[DATA_WORK, DATA_BACKUP],
+                        help="Папки с stock_etf_*, bonds_* и sp_*.json клиентов (по умолчанию Data_work и Data_Backup)")
+    parser.add_argument("--out", default=DATA_WORK, help="Папка для house_exposure.json/.xlsx")
+    parser.add_argument("--store", default=price_store.PRICES_DIR, help="Папка хранилища цен")
+    parser.add_argument("--top", type=int, default=TOP_ROWS, help="Сколько крупнейших строк показывать в консоли")
+    parser.add_argument("--no-cache", action="store_true", help="Перечитать выходы всех клиентов")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    outputs = collect_outputs(*args.dir)
+    if not outputs:
+        console.print(f"[yellow]⚠️ В {', '.join(args.dir)} нет stock_etf_*, bonds_* и sp_*.json[/yellow]")
+        return 1
+
+    store = price_store.PriceStore.open(args.store)
+    rows, reread, dirty = update_rows(outputs, store, None if args.no_cache else CACHE_DIR)
+    out_dir = args.out
+    json_path, xlsx_path = os.path.join(out_dir, "house_exposure.json"), os.path.join(out_dir, "house_exposure.xlsx")
+    with span("house_group_by", rows=len(rows)):
+        tables = {dimension: group_table(rows, dimension) for dimension in DIMENSIONS}
+        summary = house_summary(rows, outputs)
+    count("house_clients", len(outputs))
+    count("house_clients_reread", reread)
+
+    if dirty or not (os.path.exists(json_path) and os.path.exists(xlsx_path)):
+        os.makedirs(out_dir, exist_ok=True)
+        write_json_atomic(json_path, {"summary": summary, **tables})
+        with span("house_xlsx"):
+            write_workbook(xlsx_path, tables)
+        console.print(f"[green]📝 Сводка записана:[/green] [bright_cyan]{json_path}[/bright_cyan]")
+    else:
+        console.print(f"[green]✅ Выходы клиентов и цены не менялись — сводка актуальна:[/green] [bright_cyan]{json_path}[/bright_cyan]")
+
+    console.print(f"[green]✅ Клиентов: {summary['clients']} (перечитано {reread}); позиций: {summary['positions']}; "
+                  f"стоимость: {summary['value_usd']:,.2f} USD; покрытие ценами: {summary['coverage'] or 0:.1f}%[/green]")
+    issuers = summary["concentration"]["issuer"]
+    if issuers["top_share"] is not None:
+        console.print(f"[cyan]Эмитенты: топ-{TOP_SHARE_N} — {issuers['top_share']:.2f}%, HHI {issuers['hhi']:.0f}[/cyan]")
+    for row in tables["isin"][:args.top]:
+        share = "—" if row["share"] is None else f"{row['share']:.2f}%"
+        console.print(f"{row['key']:<14} {row['value_usd']:>16,.2f} USD {share:>8}  держателей {row['holders']}")
+    return 0
+
+
+if __name__ == "__main__":
+    if not ensure_dependencies(REQUIRED_MODULES):
+        sys.exit(1)
+    with stage_span("house_exposure"), profile_stage("house_exposure"):
+        code = main()
+    sys.exit(code)
@@ -1,44 +1,53 @@
-# Импорт стандартных и внешних модулей
-import holidays
+# Импорт стандартных модулей
 import os
 import sys
 import json
 import datetime
+import threading
 
-# Импорт prompt_toolkit для интерактивного ввода дат
-try:
-    from prompt_toolkit import PromptSession
-except ImportError:
-    # Если prompt_toolkit не установлен, устанавливаем его автоматически
-    print("Устанавливаю prompt_toolkit для интерактивного ввода...")
-    os.system(f'"{sys.executable}" -m pip install prompt_toolkit')
-    from prompt_toolkit import PromptSession
-
-# Импорт rich для цветного вывода в консоль
-try:
-    from rich import print
-except ImportError:
-    # Если rich не установлен, устанавливаем его автоматически
-    print("Устанавливаю rich для цветного вывода...")
-    os.system(f'"{sys.executable}" -m pip install rich')
-    from rich import print
-
-# Проверка наличия необходимых внешних модулей (holidays, rich)
-REQUIRED_MODULES = ["holidays", "rich"]
-for mod in REQUIRED_MODULES:
-    try:
-        __import__(mod)
-    except ImportError:
-        print(f"[bold red]Модуль '{mod}' не установлен. Установите его: pip install {mod}[/bold red]")
-        sys.exit(1)
+# Внешние библиотеки импортируются лениво (при первом обращении) через слой startup
+from startup import ensure_dependencies, lazy_import, rprint as print
+from instrumentation import stage_span
+from profiling import profile_stage
+
+holidays = lazy_import("holidays")
+prompt_toolkit = lazy_import("prompt_toolkit")
+
+REQUIRED_MODULES = ["holidays", "prompt_toolkit", "rich"]
+
+
+class DeferredHolidays:
+    """
+    Календарь праздников США, который строится в фоновом потоке,
+    пока пользователь вводит первую дату (импорт holidays и расчёт
+    календаря не задерживают появление приглашения к вводу).
+    """
+
+    def __init__(self, years):
+        self._years = years
+        self._result = None
+        self._error = None
+        self._thread = threading.Thread(target=self._build, daemon=True)
+        self._thread.start()
+
+    def _build(self):
+        try:
+            self._result = holidays.US(years=self._years)
+        except BaseException as e:
+            self._error = e
+
+    def _calendar(self):
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def __contains__(self, date_obj):
+        return date_obj in self._calendar()
+
+    def get(self, date_obj, default=None):
+        return self._calendar().get(date_obj, default)
 
-# Удаление старого файла с датами, если он существует, чтобы избежать конфликтов при повторном запуске
-json_path = os.path.join("Data_work", "report_dates.json")
-if os.path.exists(json_path):
-    try:
-        os.remove(json_path)
-    except Exception:
-        pass
 
 # Функция приветствия пользователя
 # Выводит информационное сообщение о запуске скрипта
@@ -91,7 +100,7 @@ def get_date_input(prompt_text, min_date, holidays_us, start_date=None):
     Для выхода используйте Ctrl+C.
     Проверяет корректность формата, диапазона, выходных и праздничных дней.
     """
-    session = PromptSession()
+    session = prompt_toolkit.PromptSession()
     try:
         while True:
             # Получаем строку от пользователя
@@ -183,7 +192,20 @@ def main():
     print_welcome()
     print("[bold yellow]Для выхода нажмите Ctrl+C в любой момент[/bold yellow]")
     min_date = datetime.date(2022, 1, 1)
-    holidays_us = holidays.US(years=range(2022, datetime.date.today().year + 2))
+    # prompt_toolkit импортируется до старта фонового потока, чтобы они не делили GIL
+    # на пути к первому приглашению; календарь праздников строится, пока пользователь вводит дату
+    prompt_toolkit.PromptSession
+    holidays_us = DeferredHolidays(years=range(2022, datetime.date.today().year + 2))
+
+    BASE_DIR = os.environ.get("REPORT_BASE_DIR", os.path.dirname(os.path.abspath(__file__)))
+    save_path = os.path.join(BASE_DIR, "Data_work", "report_dates.json")
+
+    # Удаление старого файла с датами, если он существует, чтобы избежать конфликтов при повторном запуске
+    if os.path.exists(save_path):
+        try:
+            os.remove(save_path)
+        except Exception:
+            pass
 
     # Ввод даты начала отчета
     start_date = get_date_input("Введите дату начала отчета (dd/mm/yyyy): ", min_date, holidays_us)
@@ -194,9 +216,6 @@ def main():
     print(f"[bold green]Дата завершения отчета: [bold cyan]{end_date.strftime('%d.%m.%Y')}[/bold cyan]")
 
     # Сохраняем выбранные даты в файл
-    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-    save_path = os.path.join(BASE_DIR, "Data_work", "report_dates.json")
-
     save_dates_to_json(start_date, end_date, save_path)
 
     # Финальный вывод периода отчета
@@ -205,5 +224,8 @@ def main():
 
 # Запуск main(), если скрипт запущен напрямую
 if __name__ == "__main__":
-    main()
+    if not ensure_dependencies(REQUIRED_MODULES):
+        sys.exit(1)
+    with stage_span("insert_date"), profile_stage("insert_date"):
+        main()
 
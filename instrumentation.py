@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+instrumentation.py — лёгкие замеры времени и счётчики для всех этапов.
+
+- span("workbook_open", file=...) — контекстный менеджер, замеряет длительность подшага;
+- count("rows_read", n) — накопительный счётчик текущего этапа;
+- stage_span("extract_isin") — обёртка точки входа: спан всего этапа + сброс счётчиков.
+
+События пишутся строками JSON в logs/trace_YYYYMMDD.jsonl (режим append, запись
+одной строкой — безопасно для параллельных этапов). Все процессы одного запуска
+конвейера делят run_id через переменную окружения REPORT_RUN_ID.
+
+CLI:
+  python instrumentation.py summary [--days 7]          — время по этапам, отчётов в минуту, регрессии
+  python instrumentation.py export-prom [--out FILE]    — Prometheus textfile по последнему запуску
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from glob import glob
+from typing import Dict, List, Optional
+
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", os.path.dirname(os.path.abspath(__file__)))
+LOGS_DIR = os.path.join(BASE_DIR, "logs")
+PROM_DEFAULT = os.path.join(LOGS_DIR, "report_k.prom")
+
+RUN_ID_ENV = "REPORT_RUN_ID"
+TRACE_ENV = "REPORT_TRACE"          # "0" — отключить запись трассы
+
+# Этап считается регрессировавшим, если он медленнее медианы прошлых запусков на эту долю
+REGRESSION_THRESHOLD = 0.25
+
+
+def trace_path(day: Optional[datetime] = None) -> str:
+    return os.path.join(LOGS_DIR, f"trace_{(day or datetime.now()).strftime('%Y%m%d')}.jsonl")
+
+
+def current_run_id() -> str:
+    """run_id текущего запуска: из окружения (если задан конвейером) или новый."""
+    run_id = os.environ.get(RUN_ID_ENV)
+    if not run_id:
+        run_id = uuid.uuid4().hex[:12]
+        os.environ[RUN_ID_ENV] = run_id
+    return run_id
+
+
+class Tracer:
+    """Накопитель спанов и счётчиков одного процесса (одного этапа)."""
+
+    def __init__(self, stage: str = "adhoc"):
+        self.stage = stage
+        self.counters: Dict[str, float] = {}
+        self.enabled = os.environ.get(TRACE_ENV, "1") != "0"
+        self._lock = threading.Lock()
+
+    def emit(self, event: dict) -> None:
+        if not self.enabled:
+            return
+        event = {"ts": datetime.now().isoformat(timespec="milliseconds"),
+                 "run_id": current_run_id(), "stage": self.stage, **event}
+        line = json.dumps(event, ensure_ascii=False, default=str) + "\n"
+        try:
+            os.makedirs(LOGS_DIR, exist_ok=True)
+            with self._lock, open(trace_path(), "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError:
+            # Замеры не должны ломать основной сценарий
+            pass
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Замеряет длительность блока; yield-ит словарь атрибутов, который можно дополнять."""
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            yield attrs
+        except SystemExit as e:
+            status = "ok" if e.code in (0, None) else f"exit {e.code}"
+            raise
+        except BaseException as e:
+            status = f"error: {type(e).__name__}"
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            # Тело спана может само выставить итоговый статус: attrs["status"] = ...
+            status = attrs.pop("status", status)
+            self.emit({"type": "span", "span": name, "duration_ms": round(duration_ms, 3),
+                       "status": status, **attrs})
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def flush_counters(self) -> None:
+        with self._lock:
+            counters, self.counters = self.counters, {}
+        if counters:
+            self.emit({"type": "counters", "counters": counters})
+
+
+_tracer = Tracer()
+
+
+def tracer() -> Tracer:
+    return _tracer
+
+
+def span(name: str, **attrs):
+    """Спан подшага текущего этапа: with span("json_write", file=...): ..."""
+    return _tracer.span(name, **attrs)
+
+
+def count(name: str, value: float = 1) -> None:
+    """Увеличивает счётчик текущего этапа (rows_read, cache_hits, bytes_copied, ...)."""
+    _tracer.count(name, value)
+
+
+@contextmanager
+def stage_span(stage: str, **attrs):
+    """Обёртка точки входа этапа: спан 'stage' и сброс счётчиков по завершении."""
+    _tracer.stage = stage
+    try:
+        with _tracer.span("stage", **attrs):
+            yield _tracer
+    finally:
+        _tracer.flush_counters()
+
+
+# ---------- Чтение трасс и отчёты ----------
+
+def read_events(days: int = 7) -> List[dict]:
+    """Читает события трасс за последние days дней (битые строки пропускаются)."""
+    since = (datetime.now() - timedelta(days=days - 1)).strftime("%Y%m%d")
+    events = []
+    for path in sorted(glob(os.path.join(LOGS_DIR, "trace_*.jsonl"))):
+        if os.path.basename(path)[6:14] < since:
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return events
+
+
+def summarize_runs(events: List[dict]) -> Dict[str, dict]:
+    """Группирует события по run_id: {run_id: {"start","end","stages": {stage: ms}, "counters": {...}, "ok"}}."""
+    runs: Dict[str, dict] = {}
+    for ev in events:
+        run = runs.setdefault(ev.get("run_id", "?"), {"start": ev["ts"], "end": ev["ts"],
+                                                      "stages": {}, "counters": {}, "ok": False})
+        run["start"] = min(run["start"], ev["ts"])
+        run["end"] = max(run["end"], ev["ts"])
+        if ev.get("type") == "span" and ev.get("span") == "stage":
+            run["stages"][ev["stage"]] = run["stages"].get(ev["stage"], 0) + ev["duration_ms"]
+        elif ev.get("type") == "span" and ev.get("span") == "pipeline":
+            run["ok"] = ev.get("status") == "ok"
+            run["stages"]["pipeline"] = ev["duration_ms"]
+        elif ev.get("type") == "counters":
+            for k, v in ev["counters"].items():
+                run["counters"][k] = run["counters"].get(k, 0) + v
+    return runs
+
+
+def find_regressions(runs: Dict[str, dict], threshold: float = REGRESSION_THRESHOLD) -> List[tuple]:
+    """Сравнивает последний запуск с медианой предыдущих по каждому этапу: [(этап, было_мс, стало_мс)]."""
+    import statistics
+
+    ordered = sorted(runs.values(), key=lambda r: r["start"])
+    if len(ordered) < 2:
+        return []
+    last, history = ordered[-1], ordered[:-1]
+    result = []
+    for stage_name, ms in last["stages"].items():
+        past = [r["stages"][stage_name] for r in history if stage_name in r["stages"]]
+        if past:
+            median = statistics.median(past)
+            if median > 0 and ms > median * (1 + threshold):
+                result.append((stage_name, median, ms))
+    return result
+
+
+def render_prometheus(run_id: str, run: dict) -> str:
+    """Формирует Prometheus textfile по одному запуску."""
+    lines = [
+        "# HELP report_k_stage_duration_seconds Длительность этапа в последнем запуске",
+        "# TYPE report_k_stage_duration_seconds gauge",
+    ]
+    for stage_name, ms in sorted(run["stages"].items()):
+        lines.append(f'report_k_stage_duration_seconds{{stage="{stage_name}"}} {ms / 1000:.6f}')
+    lines += [
+        "# HELP report_k_counter Счётчики последнего запуска",
+        "# TYPE report_k_counter gauge",
+    ]
+    for name, value in sorted(run["counters"].items()):
+        lines.append(f'report_k_counter{{name="{name}"}} {value}')
+    lines += [
+        "# HELP report_k_last_run_success 1 — последний запуск конвейера успешен",
+        "# TYPE report_k_last_run_success gauge",
+        f'report_k_last_run_success{{run_id="{run_id}"}} {1 if run["ok"] else 0}',
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def export_prometheus(out_path: str = PROM_DEFAULT, run_id: Optional[str] = None, days: int = 1) -> Optional[str]:
+    """Пишет textfile (атомарно) по запуску run_id (по умолчанию — последнему). Возвращает путь или None."""
+    runs = summarize_runs(read_events(days))
+    if not runs:
+        return None
+    if run_id is None or run_id not in runs:
+        run_id = max(runs, key=lambda k: runs[k]["start"])
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    tmp = out_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render_prometheus(run_id, runs[run_id]))
+    os.replace(tmp, out_path)
+    return out_path
+
+
+def print_summary(days: int) -> int:
+    import statistics
+
+    runs = summarize_runs(read_events(days))
+    if not runs:
+        print(f"Трассы за {days} дн. не найдены в {LOGS_DIR}")
+        return 1
+
+    per_stage: Dict[str, List[float]] = {}
+    for run in runs.values():
+        for stage_name, ms in run["stages"].items():
+            per_stage.setdefault(stage_name, []).append(ms)
+
+    print(f"{'этап':<22} {'запусков':>8} {'медиана, мс':>12} {'макс, мс':>10}")
+    for stage_name, values in sorted(per_stage.items()):
+        print(f"{stage_name:<22} {len(values):>8} {statistics.median(values):>12.1f} {max(values):>10.1f}")
+
+    completed = [r for r in runs.values() if r["ok"]]
+    if completed:
+        # Время обработки — сумма длительностей неинтерактивных этапов запуска: простои между
+        # запусками и ожидание ввода (insert_date, name_clients…) в пропускную способность не входят
+        from pipeline import STAGES
+        interactive = {s.name for s in STAGES if s.interactive}
+        busy_ms = sum(ms for r in completed for name, ms in r["stages"].items()
+                      if name != "pipeline" and name not in interactive)
+        line = f"\nУспешных запусков конвейера: {len(completed)}"
+        if busy_ms > 0:
+            line += f"; пропускная способность: {len(completed) * 60000 / busy_ms:.2f} отчётов/мин работы этапов"
+        print(line)
+
+    for stage_name, before, after in find_regressions(runs):
+        print(f"⚠️  Регрессия: {stage_name} {before:.1f} мс → {after:.1f} мс")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Трассы и метрики этапов отчёта")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_sum = sub.add_parser("summary", help="Сводка по трассам")
+    p_sum.add_argument("--days", type=int, default=7)
+    p_prom = sub.add_parser("export-prom", help="Prometheus textfile по последнему запуску")
+    p_prom.add_argument("--out", default=PROM_DEFAULT)
+    p_prom.add_argument("--run-id")
+    args = parser.parse_args(argv)
+
+    if args.command == "summary":
+        return print_summary(args.days)
+    path = export_prometheus(args.out, args.run_id)
+    if not path:
+        print("Нет трасс для экспорта")
+        return 1
+    print(f"Метрики записаны: {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
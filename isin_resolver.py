@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+isin_resolver.py — поиск тикеров для ISIN, которых нет в reference_stocks_etf.xlsx.
+
+Неизвестные ISIN (кандидаты в noname_isin_*.json) отправляются провайдеру сопоставления
+идентификаторов пакетами до 100 штук:
+  FileIsinResolver     — офлайн-заглушка: CSV isin,ticker,name,type (для тестов и без сети);
+  OpenFigiIsinResolver — OpenFIGI /v3/mapping (ключ API — переменная OPENFIGI_API_KEY, необязателен).
+
+Ответы кэшируются в dictionaries/reference_stocks/isin_resolver_cache.json:
+найденные — на POSITIVE_TTL_DAYS, ненайденные — на NEGATIVE_TTL_DAYS (потом спрашиваем снова).
+Найденные акции/ETF дописываются в reference_stocks_etf.xlsx — со следующего прогона
+они сопоставляются обычным справочником, и число noname ISIN со временем уменьшается.
+
+Включается явно: map_instruments.py --resolve <спецификация> или REPORT_ISIN_RESOLVER.
+Спецификация: file:<путь к CSV> или openfigi[:<url>].
+
+CLI:
+  python isin_resolver.py --resolver file:isin_map.csv US0378331005 US5949181045
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from startup import console, lazy_import
+from instrumentation import count, span
+
+openpyxl = lazy_import("openpyxl")
+
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+REF_STOCKS_XLSX = os.path.join(BASE_DIR, "dictionaries", "reference_stocks", "reference_stocks_etf.xlsx")
+CACHE_JSON = os.path.join(BASE_DIR, "dictionaries", "reference_stocks", "isin_resolver_cache.json")
+
+RESOLVER_ENV = "REPORT_ISIN_RESOLVER"
+OPENFIGI_URL = "https://api.openfigi.com/v3/mapping"
+OPENFIGI_KEY_ENV = "OPENFIGI_API_KEY"
+
+BATCH_SIZE = 100
+# Лимиты OpenFIGI на число ISIN в одном запросе: с ключом API и без него
+OPENFIGI_BATCH_WITH_KEY = 100
+OPENFIGI_BATCH_NO_KEY = 10
+POSITIVE_TTL_DAYS = 180
+NEGATIVE_TTL_DAYS = 14
+
+# Тип в справочнике акций/ETF
+STOCK_TYPE = "Акция"
+ETF_TYPE = "ETF"
+
+
+class IsinResolver:
+    """Интерфейс: ISIN → {"ticker","name","type"} или None (не найден / не акция и не ETF)."""
+
+    name = "base"
+    batch_size = BATCH_SIZE  # Сколько ISIN провайдер принимает за один запрос
+
+    def resolve_batch(self, isins: List[str]) -> Dict[str, Optional[dict]]:
+        raise NotImplementedError
+
+
+class FileIsinResolver(IsinResolver):
+    """Офлайн-заглушка: CSV с колонками isin,ticker,name,type."""
+
+    name = "file"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._table: Optional[Dict[str, dict]] = None
+
+    def _load(self) -> Dict[str, dict]:
+        if self._table is None:
+            self._table = {}
+            with open(self.path, "r", encoding="utf-8-sig", newline="") as f:
+                for row in csv.DictReader(f):
+                    isin = (row.get("isin") or "").strip().upper()
+                    if isin and (row.get("ticker") or "").strip():
+                        self._table[isin] = {
+                            "ticker": row["ticker"].strip(),
+                            "name": (row.get("name") or "").strip(),
+                            "type": (row.get("type") or STOCK_TYPE).strip(),
+                        }
+        return self._table
+
+    def resolve_batch(self, isins: List[str]) -> Dict[str, Optional[dict]]:
+        table = self._load()
+        return {isin: table.get(isin) for isin in isins}
+
+
+class OpenFigiIsinResolver(IsinResolver):
+    """OpenFIGI: один POST на пакет, ответ — список в порядке запросов. На 429 ждем и повторяем."""
+
+    name = "openfigi"
+    ETF_SECURITY_TYPES = {"ETP", "ETF", "Open-End Fund", "Closed-End Fund", "Mutual Fund"}
+
+    def __init__(self, url: str = OPENFIGI_URL, api_key: Optional[str] = None, retries: int = 3,
+                 backoff: float = 6.0, timeout: float = 30.0):
+        self.url = url
+        self.api_key = api_key if api_key is not None else os.environ.get(OPENFIGI_KEY_ENV)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    @property
+    def batch_size(self) -> int:
+        """Без ключа API OpenFIGI принимает не больше 10 ISIN за запрос, с ключом — 100."""
+        return OPENFIGI_BATCH_WITH_KEY if self.api_key else OPENFIGI_BATCH_NO_KEY
+
+    def _post(self, payload: list) -> list:
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["X-OPENFIGI-APIKEY"] = self.api_key
+        body = json.dumps(payload).encode("utf-8")
+        for attempt in range(self.retries + 1):
+            request = urllib.request.Request(self.url, data=body, headers=headers, method="POST")
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as resp:
+                    return json.loads(resp.read().decode("utf-8"))
+            except urllib.error.HTTPError as e:
+                if e.code not in (429, 500, 502, 503, 504) or attempt >= self.retries:
+                    raise
+            except urllib.error.URLError:
+                if attempt >= self.retries:
+                    raise
+            count("isin_resolver_retries")
+            time.sleep(self.backoff * (2 ** attempt))
+        raise RuntimeError("Исчерпаны повторы запроса к OpenFIGI")
+
+    def _pick(self, data: list) -> Optional[dict]:
+        """Из вариантов OpenFIGI — первая акция/ETF (предпочтительно с биржей US)."""
+        equities = [d for d in data or () if d.get("marketSector") == "Equity" and d.get("ticker")]
+        if not equities:
+            return None
+        best = next((d for d in equities if d.get("exchCode") == "US"), equities[0])
+        kind = ETF_TYPE if best.get("securityType2") in self.ETF_SECURITY_TYPES \
+            or best.get("securityType") in self.ETF_SECURITY_TYPES else STOCK_TYPE
+        return {"ticker": best["ticker"], "name": (best.get("name") or "").strip(), "type": kind}
+
+    def resolve_batch(self, isins: List[str]) -> Dict[str, Optional[dict]]:
+        with span("openfigi_request", isins=len(isins)):
+            answer = self._post([{"idType": "ID_ISIN", "idValue": isin} for isin in isins])
+        count("isin_resolver_requests")
+        return {isin: self._pick(item.get("data")) for isin, item in zip(isins, answer)}
+
+
+def make_resolver(spec: str) -> IsinResolver:
+    """'file:<CSV>' или 'openfigi[:<url>]' → провайдер."""
+    if spec.startswith("file:"):
+        return FileIsinResolver(spec[len("file:"):])
+    if spec == "openfigi" or spec.startswith("openfigi:"):
+        url = spec[len("openfigi:"):] or OPENFIGI_URL
+        return OpenFigiIsinResolver(url)
+    raise ValueError(f"Неизвестный провайдер ISIN: {spec} (ожидается file:<CSV> или openfigi[:<url>])")
+
+
+class ResolverCache:
+    """{ISIN: {"result": {...} | null, "checked": ISO-время}} с разным сроком для найденных и ненайденных."""
+
+    def __init__(self, path: str = CACHE_JSON, positive_ttl_days: int = POSITIVE_TTL_DAYS,
+                 negative_ttl_days: int = NEGATIVE_TTL_DAYS):
+        self.path = path
+        self.positive_ttl = timedelta(days=positive_ttl_days)
+        self.negative_ttl = timedelta(days=negative_ttl_days)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries: Dict[str, dict] = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+        self.dirty = False
+
+    def get(self, isin: str, now: datetime):
+        """(найдено в кэше, результат или None)."""
+        entry = self.entries.get(isin)
+        if entry is None:
+            return False, None
+        ttl = self.positive_ttl if entry.get("result") else self.negative_ttl
+        if now - datetime.fromisoformat(entry["checked"]) > ttl:
+            return False, None
+        return True, entry.get("result")
+
+    def put(self, isin: str, result: Optional[dict], now: datetime) -> None:
+        self.entries[isin] = {"result": result, "checked": now.isoformat(timespec="seconds")}
+        self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+def resolve_isins(isins: Iterable[str], resolver: IsinResolver, cache: Optional[ResolverCache] = None,
+                  batch_size: Optional[int] = None, now: Optional[datetime] = None) -> Dict[str, dict]:
+    """
+    Тикеры для ISIN: сначала кэш, остальное — у провайдера пакетами по batch_size
+    (по умолчанию — лимит самого провайдера, resolver.batch_size).
+    Возвращает только найденные {ISIN: {"ticker","name","type"}}; ошибка провайдера
+    прерывает загрузку, но уже полученные пакеты сохраняются в кэше.
+    """
+    now = now or datetime.now()
+    batch_size = batch_size or resolver.batch_size
+    cache = cache if cache is not None else ResolverCache()
+    found: Dict[str, dict] = {}
+    pending: List[str] = []
+    unique = list(dict.fromkeys(i.strip().upper() for i in isins if i))
+    for isin in unique:
+        hit, result = cache.get(isin, now)
+        if not hit:
+            pending.append(isin)
+        elif result:
+            found[isin] = result
+    count("isin_resolver_cache_hits", len(unique) - len(pending))
+
+    try:
+        for i in range(0, len(pending), batch_size):
+            batch = pending[i:i + batch_size]
+            for isin, result in resolver.resolve_batch(batch).items():
+                cache.put(isin, result, now)
+                if result:
+                    found[isin] = result
+    finally:
+        cache.save()
+    count("isins_resolved", len(found))
+    return found
+
+
+def append_to_reference(resolved: Dict[str, dict], xlsx_path: str = REF_STOCKS_XLSX) -> int:
+    """Дописывает найденные ISIN в справочник акций/ETF (лист 'акции_etf'); уже имеющиеся пропускает."""
+    if not resolved:
+        return 0
+    wb = openpyxl.load_workbook(xlsx_path)
+    ws = wb["акции_etf"]
+    existing = {str(row[0]).strip().upper() for row in ws.iter_rows(min_row=2, max_col=1, values_only=True) if row[0]}
+    added = 0
+    for isin, rec in sorted(resolved.items()):
+        if isin in existing:
+            continue
+        ws.append([isin, rec["ticker"], rec.get("name", ""), rec.get("type") or STOCK_TYPE])
+        added += 1
+    if added:
+        # Во временный файл рядом и os.replace — справочник никогда не остается недописанным
+        tmp = xlsx_path + ".tmp.xlsx"
+        wb.save(tmp)
+        os.replace(tmp, xlsx_path)
+    wb.close()
+    return added
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Поиск тикеров для ISIN вне справочника")
+    parser.add_argument("isins", nargs="+")
+    parser.add_argument("--resolver", default=os.environ.get(RESOLVER_ENV),
+                        help=f"file:<CSV> или openfigi[:<url>] (по умолчанию ${RESOLVER_ENV})")
+    parser.add_argument("--write-back", action="store_true", help="Дописать найденные в reference_stocks_etf.xlsx")
+    args = parser.parse_args(argv)
+
+    if not args.resolver:
+        console.print(f"[red]❌ Не задан провайдер (--resolver или {RESOLVER_ENV})[/red]")
+        return 2
+    found = resolve_isins(args.isins, make_resolver(args.resolver))
+    for isin in args.isins:
+        rec = found.get(isin.strip().upper())
+        console.print(f"{isin:<14} " + (f"{rec['ticker']:<10} {rec['type']:<6} {rec['name']}" if rec else "—"))
+    if args.write_back:
+        console.print(f"[green]📚 Добавлено в справочник: {append_to_reference(found)}[/green]")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+isin_ticker_stock_etf.py — цены начала/конца периода для акций/ETF клиента.
+
+Берет stock_etf_{клиент}_{начало}__{конец}.json (выход map_instruments), для всех тикеров
+одним векторным запросом к локальному хранилищу цен (performance.compute_items) находит
+цену закрытия на дату начала и конца периода (или в ближайший предыдущий торговый день), считает
+отклонение и пишет prices_{клиент}_{начало}__{конец}.json. Из него template_creator
+заполняет start_price / end_price / Отклонение на листе stock_etf_price.
+
+С --provider (или REPORT_PRICE_PROVIDER) перед поиском в хранилище догружаются
+только непокрытые интервалы периода (price_providers.update_store) — и история базовых активов
+структурных продуктов клиента с условиями в sp_terms.json (для следующего этапа sp_monitor).
+Позиции с количеством получают стоимость на конец периода и в базовой валюте клиента (fx.py).
+С --delta (или REPORT_DELTA=1) строки позиций, не изменившихся с прошлого прогона того же периода
+при том же хранилище цен, берутся из кэша (delta.py), считаются и догружаются только остальные.
+"""
+
+import os
+import sys
+import json
+import argparse
+from datetime import timedelta
+from typing import Iterable, List, Optional
+
+from startup import console, ensure_dependencies
+from instrumentation import count, span, stage_span
+from profiling import add_arguments as add_profile_arguments, profile_stage
+import price_store
+import price_providers
+import performance
+import fx
+import delta
+import sp_monitor
+
+REQUIRED_MODULES = ["rich", "numpy"]
+
+# Константы путей
+# (корень проекта можно переопределить переменной окружения REPORT_BASE_DIR)
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+DATA_WORK = os.path.join(BASE_DIR, "Data_work")
+NAME_JSON = os.path.join(DATA_WORK, "name_clients.json")
+DATES_JSON = os.path.join(DATA_WORK, "report_dates.json")
+
+MAX_PRICE_LAG_DAYS = performance.MAX_PRICE_LAG_DAYS
+
+
+def load_json(path: str) -> dict:
+    """Загружает JSON c UTF-8; на ошибке — понятное исключение."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Файл {path} не найден")
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Ошибка парсинга JSON в {path}: {e}")
+
+
+def stock_json_path(client: str, period: dict) -> str:
+    return os.path.join(DATA_WORK, f"stock_etf_{client}_{period['start_date']}__{period['end_date']}.json")
+
+
+def sp_json_path(client: str, period: dict) -> str:
+    return os.path.join(DATA_WORK, f"sp_{client}_{period['start_date']}__{period['end_date']}.json")
+
+
+def prices_json_path(client: str, period: dict) -> str:
+    return os.path.join(DATA_WORK, f"prices_{client}_{period['start_date']}__{period['end_date']}.json")
+
+
+def provider_requests(items: list, period: dict, base_currency: Optional[str] = None,
+                      sp_terms: Iterable[dict] = ()) -> List["price_providers.PriceRequest"]:
+    """
+    Запросы к провайдеру: период с запасом MAX_PRICE_LAG_DAYS до начала (для цены «на дату или раньше»).
+    sp_terms — условия структурных продуктов клиента (sp_terms.json): их базовые активы запрашиваются
+    с даты начальной фиксации, чтобы этапу sp_monitor хватило истории для барьера и наблюдений.
+    """
+    start = price_store.from_day(price_store.to_day(period["start_date"])) - timedelta(days=MAX_PRICE_LAG_DAYS)
+    end = price_providers.iso_date(period["end_date"])
+    tickers = {(rec.get("ticker") or "").strip() for rec in items}
+    # Курсы валют позиций и базовой валюты — для пересчета стоимости (USD — опорная, курс не нужен)
+    currencies = {fx.normalize_currency(rec.get("currency")) for rec in items if rec.get("quantity") is not None}
+    if currencies and base_currency:
+        currencies.add(fx.normalize_currency(base_currency))
+    tickers |= {fx.fx_ticker(c) for c in currencies if c and c != fx.PIVOT_CURRENCY}
+    starts = {t: start for t in tickers if t}
+    for terms in sp_terms:
+        fixing = terms.get("strike_date")
+        first = start if not fixing else min(start, price_store.from_day(price_store.to_day(fixing))
+                                             - timedelta(days=sp_monitor.MAX_PRICE_LAG_DAYS))
+        for t in terms.get("underlyings") or ():
+            t = (t or "").strip()
+            if t:
+                starts[t] = min(starts.get(t, first), first)
+    return [price_providers.PriceRequest(t, str(starts[t]), end) for t in sorted(starts)]
+
+
+def client_sp_terms(client: str, period: dict, terms_path: str = sp_monitor.TERMS_JSON) -> List[dict]:
+    """Условия (sp_terms.json) структурных продуктов из sp_*.json клиента; нет файла или условий — пусто."""
+    terms = sp_monitor.load_terms(terms_path)
+    if not terms:
+        return []
+    try:
+        items = load_json(sp_json_path(client, period)).get("items") or []
+    except FileNotFoundError:
+        return []
+    isins = dict.fromkeys(rec.get("isin") for rec in items if rec.get("isin") in terms)
+    return [terms[isin] for isin in isins]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Цены начала и конца периода для акций/ETF клиента")
+    parser.add_argument("--store", default=price_store.PRICES_DIR, help="Папка хранилища цен")
+    parser.add_argument("--provider", default=os.environ.get(price_providers.PROVIDER_ENV),
+                        help="Догрузить цены: file:<папка> или http(s)://... (по умолчанию — только хранилище)")
+    parser.add_argument("--delta", action="store_true",
+                        help=f"Переиспользовать строки неизменных позиций из прошлого прогона (или {delta.DELTA_ENV}=1)")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    console.print("[bold green]💹 Цены акций/ETF за период[/bold green]")
+    try:
+        client = (load_json(NAME_JSON).get("client_name") or "").strip()
+        dates = load_json(DATES_JSON)
+        period = {"start_date": dates["start_date"], "end_date": dates["end_date"]}
+    except (FileNotFoundError, ValueError, KeyError) as e:
+        console.print(f"[red]❌ Ошибка загрузки метаданных: {e}[/red]")
+        return 1
+
+    src = stock_json_path(client, period)
+    try:
+        items = load_json(src).get("items") or []
+    except FileNotFoundError:
+        console.print(f"[yellow]⚠️ Нет файла акций/ETF клиента: [/yellow][bright_cyan]{src}[/bright_cyan]")
+        items = []
+
+    base = fx.base_currency(client)
+    with span("price_store_open"):
+        store = price_store.PriceStore.open(args.store)
+    delta_mode = delta.enabled(args.delta)
+    generation = store.generation
+    reused = delta.reusable_prices(delta.load_cache(client, ".prices"), delta.price_cache_key(period, store, base),
+                                   items) if delta_mode else {}
+    todo = [rec for i, rec in enumerate(items) if i not in reused]
+    requests = provider_requests(todo, period, base, client_sp_terms(client, period)) if args.provider else []
+    if requests:
+        try:
+            provider = price_providers.make_provider(args.provider)
+            store, fetched = price_providers.update_store(provider, requests, store)
+            console.print(f"[cyan]🌐 Догружено пробелов в истории цен: {fetched} ({args.provider})[/cyan]")
+        except Exception as e:
+            # Нет сети или провайдер недоступен — считаем по тому, что уже есть в хранилище
+            console.print(f"[yellow]⚠️ Провайдер цен недоступен: {e}[/yellow]")
+    if not len(store):
+        console.print(f"[yellow]⚠️ Хранилище цен пусто: [/yellow][bright_cyan]{args.store}[/bright_cyan]")
+
+    if reused and store.generation != generation:
+        # Догрузка могла затронуть и курсы неизменных позиций — пересчитываем все по новому хранилищу
+        reused, todo = {}, items
+    if delta_mode:
+        console.print(f"[cyan]🔁 Режим приращений: строк из кэша {len(reused)} из {len(items)}[/cyan]")
+        count("prices_reused", len(reused))
+
+    with span("price_lookup", tickers=len(todo)):
+        computed = iter(performance.compute_items(todo, period, store, base_currency=base))
+    priced = [reused[i] if i in reused else next(computed) for i in range(len(items))]
+    missing = [p["ticker"] or p["isin"] for p in priced if p["missing"]]
+    count("prices_found", len(priced) - len(missing))
+    count("prices_missing", len(missing))
+
+    out_path = prices_json_path(client, period)
+    with span("json_write", file=os.path.basename(out_path)):
+        performance.write_json_atomic(out_path, {"client": client, "period": period, "items": priced})
+    try:
+        delta.save_cache(client, delta.prices_cache(delta.price_cache_key(period, store, base), items, priced), ".prices")
+    except OSError as e:
+        console.print(f"[yellow]⚠️ Кэш режима приращений не записан: {e}[/yellow]")
+
+    console.print(f"[green]✅ Цены найдены:[/green] {len(priced) - len(missing)} из {len(priced)}")
+    if missing:
+        shown = ", ".join(missing[:20]) + (" …" if len(missing) > 20 else "")
+        console.print(f"[yellow]⚠️ Нет цены на начало или конец периода:[/yellow] {shown}")
+    console.print(f"[green]📝 JSON записан:[/green] [bright_cyan]{out_path}[/bright_cyan]")
+    return 0
+
+
+if __name__ == "__main__":
+    if not ensure_dependencies(REQUIRED_MODULES):
+        sys.exit(1)
+    with stage_span("prices"), profile_stage("prices"):
+        code = main()
+    sys.exit(code)
@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+look_through.py — сквозной взгляд через ETF: чем клиент на самом деле владеет по секторам,
+странам и отдельным эмитентам (numpy, разреженная матрица в формате CSR).
+
+Составы фондов — файлы dictionaries/reference_stocks/etf_holdings/<тикер или ISIN ETF>.csv
+(или .xlsx, первый лист): по строке на бумагу, столбцы ISIN и/или Тикер, Название, Вес
+(доля или %), Сектор, Страна (заголовки на русском или английском, как в выгрузках провайдеров).
+
+Все составы собираются в одну матрицу H (ETF × бумага) в формате CSR: indptr/indices/data —
+три плоских массива, строка ETF — срез indices[indptr[r]:indptr[r + 1]]. Сектор и страна
+бумаг закодированы словарем (int32-код → строка), поэтому агрегирование — np.bincount.
+Для клиента с долями позиций w экспозиция по бумагам — Hᵀw, одно разреженное произведение
+матрицы на вектор по строкам ETF, которые у клиента есть (сложность — число бумаг в этих
+фондах, а не во всем справочнике). Прямые позиции в акциях добавляются в тот же вектор,
+если бумага входит в какой-либо фонд (например, AAPL напрямую и через SPY — одна строка).
+
+Разобранные составы кэшируются в Data_work/cache/look_through/ (holdings.npz + holdings.json
+с сигнатурой файлов: размер + mtime); при изменении перечитываются только измененные файлы,
+остальные строки матрицы берутся из кэша.
+
+Доли позиций — стоимость на конец периода в USD (количество × цена × курс); без количества —
+равные доли. Непокрытое (ETF без файла состава, бумаги без сектора/страны) — «Нет данных».
+
+Этап look_through: stock_etf_*.json в папке → exposure_{клиент}_{начало}__{конец}.json, из них
+template_creator заполняет лист «look_through».
+  python look_through.py [--dir Data_work] [--top 20]
+"""
+
+import os
+import re
+import csv
+import sys
+import json
+import argparse
+from dataclasses import dataclass
+from glob import glob
+from typing import Dict, List, Optional, Tuple
+
+from startup import console, ensure_dependencies, lazy_import
+from instrumentation import count, span, stage_span
+from profiling import add_arguments as add_profile_arguments, profile_stage
+import price_store
+import fx
+
+np = lazy_import("numpy")
+openpyxl = lazy_import("openpyxl")
+
+REQUIRED_MODULES = ["rich", "numpy", "openpyxl"]
+
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+DATA_WORK = os.path.join(BASE_DIR, "Data_work")
+HOLDINGS_DIR = os.path.join(BASE_DIR, "dictionaries", "reference_stocks", "etf_holdings")
+CACHE_DIR = os.path.join(DATA_WORK, "cache", "look_through")
+CACHE_VERSION = 1
+
+ETF_TYPE = "ETF"
+TOP_NAMES = 20
+UNKNOWN = "Нет данных"
+
+# Цена старше конца периода больше чем на столько дней считается отсутствующей
+MAX_PRICE_LAG_DAYS = 7
+
+# Разрезы листа «look_through»: ключ → подпись
+DIMENSIONS = {"sector": "Сектор", "country": "Страна", "name": "Эмитент"}
+
+# Заголовки файлов составов (в нижнем регистре): поле → варианты; сравнение по началу строки
+_HEADER_ALIASES = {
+    "isin": ("isin",),
+    "ticker": ("тикер", "ticker", "symbol"),
+    "name": ("название", "наименование", "name", "holding", "security"),
+    "weight": ("вес", "доля", "weight", "% of net assets", "% of fund", "market value weight"),
+    "sector": ("сектор", "sector", "gics sector"),
+    "country": ("страна", "country", "location"),
+}
+
+# stock_etf_{клиент}_{начало}__{конец}.json
+_STOCK_JSON_RE = re.compile(r"stock_etf_(.+)_(\d{2}\.\d{2}\.\d{4})__(\d{2}\.\d{2}\.\d{4})\.json")
+
+
+# ---------- Чтение файлов составов ----------
+
+def _header_map(header: List[object]) -> Dict[str, int]:
+    """Поле → номер столбца по строке заголовков (первый подходящий столбец)."""
+    names = [str(h or "").strip().lower() for h in header]
+    result = {}
+    for field, aliases in _HEADER_ALIASES.items():
+        for i, name in enumerate(names):
+            if name and any(name.startswith(a) for a in aliases):
+                result[field] = i
+                break
+    return result
+
+
+def _parse_weight(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    text = str(value or "").strip().replace("\u00a0", "").replace(" ", "").rstrip("%").replace(",", ".")
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _read_rows(path: str) -> List[List[object]]:
+    if path.lower().endswith(".xlsx"):
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            return [list(row) for row in wb.worksheets[0].iter_rows(values_only=True)]
+        finally:
+            wb.close()
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        text = f.read()
+    # Разделитель — самый частый из «;», табуляции и «,» (у выгрузок бывает шапка, которую не берет csv.Sniffer)
+    sample = text[:4096]
+    delimiter = max(";\t,", key=sample.count)
+    return list(csv.reader(text.splitlines(), delimiter=delimiter))
+
+
+def read_holdings_file(path: str) -> List[Tuple[str, str, str, float, str, str]]:
+    """
+    Состав одного ETF: [(isin, тикер, название, вес-доля, сектор, страна)].
+    Строки до заголовка (шапка выгрузки) пропускаются; веса в % переводятся в доли.
+    """
+    rows = _read_rows(path)
+    start, columns = 0, {}
+    for start, row in enumerate(rows[:50]):
+        columns = _header_map(row)
+        if "weight" in columns and ("isin" in columns or "ticker" in columns):
+            break
+    else:
+        columns = {}
+    if not columns:
+        console.print(f"[yellow]⚠️ {os.path.basename(path)}: нет столбцов ISIN/Тикер и Вес — файл пропущен[/yellow]")
+        return []
+
+    # Отсутствующий столбец — индекс за концом строки (строки дополняются пустыми ячейками)
+    width = max(columns.values()) + 1
+    i_isin, i_ticker, i_name, i_weight, i_sector, i_country = (
+        columns.get(field, width) for field in ("isin", "ticker", "name", "weight", "sector", "country"))
+    pad = [None] * (width + 1)
+    result = []
+    for row in rows[start + 1:]:
+        row = [("" if v is None else str(v).strip()) for v in (list(row) + pad)[:width + 1]]
+        weight = _parse_weight(row[i_weight])
+        isin, ticker = row[i_isin].upper(), row[i_ticker].upper()
+        if weight is None or not (isin or ticker):
+            continue  # денежные средства, итоги, сноски
+        result.append((isin, ticker, row[i_name], weight, row[i_sector], row[i_country]))
+    if sum(r[3] for r in result) > 1.5:
+        result = [(i, t, n, w / 100.0, s, c) for i, t, n, w, s, c in result]
+    return result
+
+
+# ---------- Матрица составов ----------
+
+@dataclass
+class Holdings:
+    """
+    Составы ETF: H (ETF × бумага) в CSR — indptr, indices, data; по бумагам — ключ (ISIN или тикер),
+    тикер, название и коды сектора/страны в словарях sectors/countries.
+    """
+    etfs: List[str]
+    indptr: "np.ndarray"
+    indices: "np.ndarray"
+    data: "np.ndarray"
+    keys: List[str]
+    tickers: List[str]
+    names: List[str]
+    sector: "np.ndarray"
+    country: "np.ndarray"
+    sectors: List[str]
+    countries: List[str]
+
+    def __post_init__(self):
+        self.row = {etf: r for r, etf in enumerate(self.etfs)}
+        self.column = {key: c for c, key in enumerate(self.keys)}
+        for c, ticker in enumerate(self.tickers):
+            if ticker:
+                self.column.setdefault(ticker, c)
+
+    def rmatvec(self, rows, weights):
+        """Hᵀw по строкам rows с весами weights: экспозиция по всем бумагам (вектор длины len(keys))."""
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        total = int(lengths.sum())
+        # Индексы ненулевых элементов выбранных строк одним массивом, без цикла по строкам
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        nz = offsets + np.arange(total)
+        return np.bincount(self.indices[nz], weights=self.data[nz] * np.repeat(weights, lengths),
+                           minlength=len(self.keys))
+
+    def etf_row(self, position: dict) -> Optional[int]:
+        for key in ((position.get("ticker") or "").strip().upper(), (position.get("isin") or "").strip().upper()):
+            if key in self.row:
+                return self.row[key]
+        return None
+
+
+def _file_signature(path: str) -> List[int]:
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _holdings_files(holdings_dir: str) -> Dict[str, str]:
+    """ETF (имя файла в верхнем регистре) → путь к файлу состава."""
+    files = {}
+    for path in sorted(glob(os.path.join(holdings_dir, "*.csv")) + glob(os.path.join(holdings_dir, "*.xlsx"))):
+        files.setdefault(os.path.splitext(os.path.basename(path))[0].strip().upper(), path)
+    return files
+
+
+def _load_cache(cache_dir: str) -> Tuple[Optional[dict], Optional[dict]]:
+    try:
+        with open(os.path.join(cache_dir, "holdings.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != CACHE_VERSION:
+            return None, None
+        with np.load(os.path.join(cache_dir, "holdings.npz")) as cached:
+            arrays = {name: cached[name] for name in cached.files}
+        return meta, arrays
+    except (OSError, ValueError, KeyError):
+        return None, None
+
+
+def _save_cache(cache_dir: str, meta: dict, holdings: Holdings) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = os.path.join(cache_dir, "holdings.tmp.npz")
+    np.savez(tmp, indptr=holdings.indptr, indices=holdings.indices, data=holdings.data,
+             sector=holdings.sector, country=holdings.country)
+    os.replace(tmp, os.path.join(cache_dir, "holdings.npz"))
+    tmp = os.path.join(cache_dir, "holdings.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp, os.path.join(cache_dir, "holdings.json"))
+
+
+def _holdings_from_cache(meta: Optional[dict], arrays: Optional[dict]) -> Holdings:
+    if meta is None:
+        return Holdings([], np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int32), np.empty(0), [], [], [],
+                        np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), [UNKNOWN], [UNKNOWN])
+    return Holdings(meta["etfs"], arrays["indptr"], arrays["indices"], arrays["data"], meta["keys"],
+                    meta["tickers"], meta["names"], arrays["sector"], arrays["country"],
+                    meta["sectors"], meta["countries"])
+
+
+def _update(base: Holdings, drop: set, added: Dict[str, list]) -> Holdings:
+    """
+    Новая матрица из base: строки ETF из drop убираются маской по ненулевым элементам, составы added
+    дописываются в конец. Словари бумаг, секторов и стран только пополняются — коды прежних строк не меняются.
+    """
+    lengths = np.diff(base.indptr)
+    keep = np.fromiter((etf not in drop for etf in base.etfs), dtype=bool, count=len(base.etfs))
+    mask = np.repeat(keep, lengths)
+    etfs = [etf for etf, kept in zip(base.etfs, keep) if kept]
+    parts_indices, parts_data, new_lengths = [base.indices[mask]], [base.data[mask]], []
+
+    column = dict(base.column)
+    keys, tickers, names = list(base.keys), list(base.tickers), list(base.names)
+    sector, country = base.sector.tolist(), base.country.tolist()
+    sectors = {label: i for i, label in enumerate(base.sectors)}
+    countries = {label: i for i, label in enumerate(base.countries)}
+    for etf, rows in added.items():
+        cols, weights = [], []
+        for isin, ticker, name, weight, sec, ctry in rows:
+            key = isin or ticker
+            c = column.get(key)
+            if c is None:
+                c = column[key] = len(keys)
+                if ticker:
+                    column.setdefault(ticker, c)
+                keys.append(key)
+                tickers.append(ticker)
+                names.append(name)
+                sector.append(sectors.setdefault(sec or UNKNOWN, len(sectors)))
+                country.append(countries.setdefault(ctry or UNKNOWN, len(countries)))
+            else:
+                # Разметка из первого фонда, где она есть
+                if sec and sector[c] == 0:
+                    sector[c] = sectors.setdefault(sec, len(sectors))
+                if ctry and country[c] == 0:
+                    country[c] = countries.setdefault(ctry, len(countries))
+            cols.append(c)
+            weights.append(weight)
+        etfs.append(etf)
+        parts_indices.append(np.asarray(cols, dtype=np.int32))
+        parts_data.append(np.asarray(weights, dtype=np.float64))
+        new_lengths.append(len(cols))
+
+    all_lengths = np.concatenate((lengths[keep], np.asarray(new_lengths, dtype=np.int64)))
+    indptr = np.concatenate(([0], np.cumsum(all_lengths))).astype(np.int64)
+    return Holdings(etfs, indptr, np.concatenate(parts_indices), np.concatenate(parts_data), keys, tickers, names,
+                    np.asarray(sector, dtype=np.int32), np.asarray(country, dtype=np.int32),
+                    list(sectors), list(countries))
+
+
+def load_holdings(holdings_dir: str = HOLDINGS_DIR, cache_dir: Optional[str] = CACHE_DIR) -> Holdings:
+    """
+    Матрица составов всех ETF из holdings_dir. Если сигнатуры файлов совпали с кэшем — матрица
+    читается из npz целиком; иначе перечитываются только новые и измененные файлы, а строки
+    остальных ETF берутся из кэша как есть.
+    """
+    files = _holdings_files(holdings_dir)
+    signatures = {etf: _file_signature(path) for etf, path in files.items()}
+    meta, arrays = _load_cache(cache_dir) if cache_dir else (None, None)
+    base = _holdings_from_cache(meta, arrays)
+    if meta is not None and meta["files"] == signatures:
+        count("look_through_cache_hits")
+        return base
+
+    cached = meta["files"] if meta is not None else {}
+    drop = {etf for etf in cached if signatures.get(etf) != cached[etf]}
+    changed = [etf for etf in sorted(files) if cached.get(etf) != signatures[etf]]
+    with span("look_through_read", files=len(changed)):
+        added = {etf: read_holdings_file(files[etf]) for etf in changed}
+    holdings = _update(base, drop, added)
+    count("look_through_files_read", len(changed))
+    if cache_dir:
+        _save_cache(cache_dir, {"version": CACHE_VERSION, "files": signatures, "etfs": holdings.etfs,
+                                "keys": holdings.keys, "tickers": holdings.tickers, "names": holdings.names,
+                                "sectors": holdings.sectors, "countries": holdings.countries}, holdings)
+    return holdings
+
+
+# ---------- Экспозиция клиентов ----------
+
+def position_shares(store: "price_store.PriceStore", rates: "fx.FxRates",
+                    accounts: List[dict]) -> Tuple[List["np.ndarray"], List[bool]]:
+    """
+    Доли позиций каждого счета {"end_date","positions"} по стоимости на конец периода в USD —
+    цены и курсы всех счетов одним проходом. Без количества у всех оцененных позиций — поровну;
+    позиции без цены исключаются. Возвращает (доли по счетам, признак исключенных позиций).
+    """
+    rows = [(a, pos) for a, acc in enumerate(accounts) for pos in acc.get("positions") or []]
+    owner = np.fromiter((a for a, _ in rows), dtype=np.int64, count=len(rows))
+    days = np.fromiter((price_store.to_day(accounts[a]["end_date"]) for a, _ in rows), dtype=np.int64,
+                       count=len(rows))
+    tids = store.ticker_ids([(pos.get("ticker") or "").strip() for _, pos in rows])
+    prices, _ = store.as_of_many(tids, days, MAX_PRICE_LAG_DAYS)
+    qty = np.fromiter((np.nan if pos.get("quantity") is None else float(pos["quantity"]) for _, pos in rows),
+                      dtype=np.float64, count=len(rows))
+    usd = rates.usd_per([pos.get("currency") or fx.PIVOT_CURRENCY for _, pos in rows], days) if rows else qty
+    value = qty * prices * usd
+    priced = ~np.isnan(prices)
+
+    by_value = np.zeros(len(accounts), dtype=bool)
+    by_value[owner[priced & ~np.isnan(value)]] = True
+    weight = np.where(by_value[owner], np.nan_to_num(value), 1.0) * priced
+    totals = np.bincount(owner, weights=weight, minlength=len(accounts))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shares = np.where(totals[owner] > 0, weight / totals[owner], 0.0)
+    partial = np.zeros(len(accounts), dtype=bool)
+    partial[owner[~priced]] = True
+    bounds = np.searchsorted(owner, np.arange(len(accounts) + 1))
+    return [shares[bounds[a]:bounds[a + 1]] for a in range(len(accounts))], partial.tolist()
+
+
+def client_exposure(holdings: Holdings, positions: List[dict], shares, top: int = TOP_NAMES) -> dict:
+    """
+    Экспозиция одного клиента: {"sector": [(название, доля)], "country": [...], "name": [...],
+    "coverage": доля портфеля, раскрытая через составы ETF, "no_holdings": [ETF без файла]}.
+    """
+    shares = np.asarray(shares, dtype=np.float64)
+    etf_rows, etf_weights = [], []
+    direct: Dict[int, float] = {}
+    extra: Dict[str, Tuple[str, float]] = {}
+    no_holdings = []
+    for pos, share in zip(positions, shares.tolist()):
+        if share <= 0:
+            continue
+        row = holdings.etf_row(pos)
+        if row is not None:
+            etf_rows.append(row)
+            etf_weights.append(share)
+            continue
+        if (pos.get("type") or "").strip().upper() == ETF_TYPE:
+            no_holdings.append((pos.get("ticker") or pos.get("isin") or "").strip())
+        isin, ticker = (pos.get("isin") or "").strip().upper(), (pos.get("ticker") or "").strip().upper()
+        c = holdings.column.get(isin, holdings.column.get(ticker)) if isin or ticker else None
+        if c is not None:
+            direct[c] = direct.get(c, 0.0) + share
+        else:
+            key = isin or ticker
+            name = (pos.get("name") or "").strip() or ticker or isin
+            extra[key] = (name, extra.get(key, ("", 0.0))[1] + share)
+
+    exposure = holdings.rmatvec(etf_rows, etf_weights) if etf_rows else np.zeros(len(holdings.keys))
+    if direct:
+        np.add.at(exposure, np.fromiter(direct, dtype=np.int64), np.fromiter(direct.values(), dtype=np.float64))
+
+    def grouped(codes, labels):
+        sums = np.bincount(codes, weights=exposure, minlength=len(labels)) if exposure.size else np.zeros(len(labels))
+        sums[0] += max(shares.sum() - sums.sum(), 0.0)  # вне составов и без разметки — «Нет данных»
+        order = np.argsort(-sums, kind="stable")
+        return [(labels[i], float(sums[i])) for i in order if sums[i] > 0]
+
+    # Крупнейшие эмитенты: argpartition по вектору, сортируются только top кандидатов
+    k = min(top, exposure.size)
+    candidates = np.argpartition(-exposure, k - 1)[:k] if k else np.empty(0, dtype=np.int64)
+    names = [(holdings.names[c] or holdings.tickers[c] or holdings.keys[c], float(exposure[c]))
+             for c in candidates.tolist() if exposure[c] > 0]
+    names += list(extra.values())
+    names.sort(key=lambda item: -item[1])
+    return {
+        "sector": grouped(holdings.sector, holdings.sectors),
+        "country": grouped(holdings.country, holdings.countries),
+        "name": names[:top],
+        "coverage": float(np.sum(etf_weights)),
+        "no_holdings": sorted(set(no_holdings)),
+    }
+
+
+def exposure_items(result: dict) -> List[dict]:
+    """Строки exposure_*.json (и листа «look_through»): {"dimension","group","name","weight"}; weight — в %."""
+    return [{"dimension": dim, "group": group, "name": name, "weight": round(share * 100.0, 4)}
+            for dim, group in DIMENSIONS.items() for name, share in result[dim]]
+
+
+def write_json_atomic(path: str, payload: dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Экспозиция по секторам, странам и эмитентам сквозь ETF")
+    parser.add_argument("--dir", default=DATA_WORK, help="Папка с stock_etf_*.json")
+    parser.add_argument("--holdings", default=HOLDINGS_DIR, help="Папка с составами ETF")
+    parser.add_argument("--store", default=price_store.PRICES_DIR, help="Папка хранилища цен")
+    parser.add_argument("--top", type=int, default=TOP_NAMES, help="Сколько крупнейших эмитентов показывать")
+    parser.add_argument("--no-cache", action="store_true", help="Перечитать все файлы составов")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    files = []
+    for path in sorted(glob(os.path.join(args.dir, "stock_etf_*.json"))):
+        m = _STOCK_JSON_RE.fullmatch(os.path.basename(path))
+        if not m:
+            continue
+        client, start, end = m.groups()
+        with open(path, "r", encoding="utf-8") as f:
+            positions = json.load(f).get("items") or []
+        files.append((client, {"start_date": start, "end_date": end}, positions))
+    if not files:
+        console.print(f"[yellow]⚠️ В {args.dir} нет stock_etf_*.json[/yellow]")
+        return 1
+
+    holdings = load_holdings(args.holdings, None if args.no_cache else CACHE_DIR)
+    store = price_store.PriceStore.open(args.store)
+    rates = fx.FxRates.from_store(store)
+    with span("look_through", accounts=len(files), etfs=len(holdings.etfs), nnz=int(holdings.data.shape[0])):
+        shares, partial = position_shares(store, rates, [{**period, "positions": positions}
+                                                         for _, period, positions in files])
+        results = [client_exposure(holdings, positions, s, args.top)
+                   for (_, _, positions), s in zip(files, shares)]
+
+    for (client, period, _), result, incomplete in zip(files, results, partial):
+        missing = (["partial_prices"] if incomplete else []) + [f"no_holdings:{etf}" for etf in result["no_holdings"]]
+        out_path = os.path.join(args.dir, f"exposure_{client}_{period['start_date']}__{period['end_date']}.json")
+        write_json_atomic(out_path, {"client": client, "period": period,
+                                     "coverage": round(result["coverage"] * 100.0, 4),
+                                     "missing": missing, "items": exposure_items(result)})
+    count("look_through_accounts", len(files))
+    console.print(f"[green]✅ Портфелей: {len(files)}; ETF с составами: {len(holdings.etfs)}[/green]")
+    return 0
+
+
+if __name__ == "__main__":
+    if not ensure_dependencies(REQUIRED_MODULES):
+        sys.exit(1)
+    with stage_span("look_through"), profile_stage("look_through"):
+        code = main()
+    sys.exit(code)
@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-map_instruments.py — Этап 1.
-Каркас: поиск входного JSON isin_Фамилия И.О._start__end.json в Data_work,
-чтение и валидация, печать статуса. Никакой логики справочников/записи на диск.
+map_instruments.py — сопоставление ISIN клиента со справочниками (этап map_instruments).
+
+- читает isin_Фамилия И.О._start__end.json из Data_work (ISIN и позиции отчета);
+- загружает справочники акций/ETF, облигаций (с параметрами выпуска) и СП из dictionaries/
+  через кэш Data_work/cache/references.json (--prepare-references — только пересобрать кэш);
+- пишет stock_etf_*.json, bonds_*.json, sp_*.json и noname_isin_*.json, копирует PDF TermSheets
+  найденных СП, прошлые выходы и выходы других клиентов переносит в Data_Backup;
+- --resolve — тикеры для ISIN вне справочника (isin_resolver.py), --delta — только изменившиеся
+  позиции и delta_*.json (delta.py); снимок портфеля уходит в dictionaries/history (holdings_history.py).
 """
 
 import os
@@ -11,35 +17,46 @@ import sys
 import json
 import re
 import shutil
-from datetime import datetime
+import argparse
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from glob import glob
 from pathlib import Path
 from typing import Tuple, List, Dict, Any, Optional
 
-# === Автоустановка rich для цветного вывода ===
-try:
-    from rich.console import Console
-    from rich import print
-    from rich.table import Table
-except ImportError:
-    os.system(f'"{sys.executable}" -m pip install rich')
-    from rich.console import Console
-    from rich import print
-    from rich.table import Table
+# rich и openpyxl импортируются лениво (при первом обращении) через слой startup
+from startup import console, ensure_dependencies, lazy_import
+from instrumentation import count, span, stage_span
+from profiling import add_arguments as add_profile_arguments, profile_stage
+import isin_resolver
+import holdings_history
+import delta
 
-console = Console()
+openpyxl = lazy_import("openpyxl")
+rich_table = lazy_import("rich.table")
+
+REQUIRED_MODULES = ["rich", "openpyxl"]
 
 # Константы путей (следуем принятой структуре проекта)
-BASE_DIR = r"F:\Python Projets\Report"
-DATA_WORK = BASE_DIR + r"\Data_work"
-DATA_BACKUP = BASE_DIR + r"\Data_Backup"
-NAME_JSON = DATA_WORK + r"\name_clients.json"
+# (корень проекта можно переопределить переменной окружения REPORT_BASE_DIR)
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+DATA_WORK = os.path.join(BASE_DIR, "Data_work")
+DATA_BACKUP = os.path.join(BASE_DIR, "Data_Backup")
+NAME_JSON = os.path.join(DATA_WORK, "name_clients.json")
 
 # Пути к справочникам
-REF_STOCKS_XLSX = r"F:\Python Projets\Report\dictionaries\reference_stocks\reference_stocks_etf.xlsx"
-REF_BONDS_XLSX  = r"F:\Python Projets\Report\dictionaries\reference_bonds\reference_bonds.xlsx"
-REF_SP_XLSX     = r"F:\Python Projets\Report\dictionaries\reference_structured\TS\TS.xlsx"
-REF_SP_PDF_DIR  = r"F:\Python Projets\Report\dictionaries\reference_structured\TS"
+REF_STOCKS_XLSX = os.path.join(BASE_DIR, "dictionaries", "reference_stocks", "reference_stocks_etf.xlsx")
+REF_BONDS_XLSX  = os.path.join(BASE_DIR, "dictionaries", "reference_bonds", "reference_bonds.xlsx")
+REF_SP_XLSX     = os.path.join(BASE_DIR, "dictionaries", "reference_structured", "TS", "TS.xlsx")
+REF_SP_PDF_DIR  = os.path.join(BASE_DIR, "dictionaries", "reference_structured", "TS")
+
+# Скомпилированный кэш справочников (готовит этап prepare_references)
+CACHE_DIR = os.path.join(DATA_WORK, "cache")
+REFERENCE_CACHE_JSON = os.path.join(CACHE_DIR, "references.json")
+REFERENCE_CACHE_VERSION = 2
 
 # ---------- Утилиты ----------
 
@@ -59,12 +76,13 @@ def parse_payload_name_from_filename(path: Path) -> Tuple[str, str, str]:
     return client_str, start_date, end_date
 
 
-def load_client_isins(path: Path) -> Tuple[str, Dict[str, str], List[str]]:
+def load_client_isins(path: Path) -> Tuple[str, Dict[str, str], List[str], Dict[str, dict]]:
     """
     Читает входной JSON и возвращает:
       client: строка из JSON (как есть)
       period: словарь {"start_date": "...", "end_date": "..."}
       isin_list: список ISIN
+      positions: {ISIN: {"quantity","currency"}} — если extract_isin нашел столбец количества, иначе пусто
     Бросает осмысленные ошибки при проблемах с чтением/структурой.
     """
     try:
@@ -91,7 +109,22 @@ def load_client_isins(path: Path) -> Tuple[str, Dict[str, str], List[str]]:
     if not isinstance(isins, list) or not all(isinstance(x, str) for x in isins):
         raise ValueError("Поле 'isin' должно быть списком строк")
 
-    return client, {"start_date": period["start_date"], "end_date": period["end_date"]}, isins
+    positions = {}
+    for pos in data.get("positions") or ():
+        isin = str(pos.get("isin") or "").strip().upper()
+        if isin:
+            positions[isin] = {"quantity": pos.get("quantity"), "currency": pos.get("currency") or ""}
+
+    return client, {"start_date": period["start_date"], "end_date": period["end_date"]}, isins, positions
+
+
+def attach_positions(hits: List[dict], positions: Dict[str, dict]) -> None:
+    """Добавляет в записи сопоставления количество и валюту позиции (если они есть во входном JSON)."""
+    for rec in hits:
+        pos = positions.get(rec["isin"])
+        if pos:
+            rec["quantity"] = pos["quantity"]
+            rec["currency"] = pos["currency"]
 
 
 def find_input_payload(data_work: str) -> Path:
@@ -149,14 +182,6 @@ def find_input_payload(data_work: str) -> Path:
     # Ровно один корректный файл
     return matching[0]
 
-# === Автоустановка openpyxl ===
-try:
-    from openpyxl import load_workbook
-except ImportError:
-    os.system(f'"{sys.executable}" -m pip install openpyxl')
-    from openpyxl import load_workbook
-
-
 def _norm_isin(s: str) -> str:
     return (s or "").strip().upper()
 
@@ -167,7 +192,7 @@ def load_reference_stocks(xlsx_path: str) -> dict:
     Колонки: A=ISIN, B=Тикер, C=Название, D=Тип
     Возврат: { ISIN: {"ticker": str, "type": str, "name": str} }
     """
-    wb = load_workbook(xlsx_path, read_only=True, data_only=True)
+    wb = openpyxl.load_workbook(xlsx_path, read_only=True, data_only=True)
     if "акции_etф" in wb.sheetnames:
         ws = wb["акции_etф"]
     else:
@@ -187,32 +212,189 @@ def load_reference_stocks(xlsx_path: str) -> dict:
     return ref
 
 
+# Пространства имен SpreadsheetML для потокового чтения листа без openpyxl
+_XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_XLSX_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_XLSX_PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_CELL_REF_RE = re.compile(r"([A-Z]+)")
+
+
+def _column_index(ref: str) -> int:
+    """'C12' → 2 (номер столбца с нуля)."""
+    index = 0
+    for ch in _CELL_REF_RE.match(ref).group(1):
+        index = index * 26 + ord(ch) - 64
+    return index - 1
+
+
+def _iter_sheet_rows(xlsx_path: str, sheet_name: str, ncols: int, min_row: int = 2):
+    """
+    Потоковое чтение значений листа прямо из XML книги (zipfile + iterparse, без объектов ячеек openpyxl).
+    Возвращает (строки, date1904): строки — кортежи длиной ncols из str, float и bool, пустые ячейки — None;
+    date1904 — книга в системе дат 1904. Даты в xlsx — числа-серийники, их преобразует вызывающий
+    (см. _excel_serial_to_date).
+    """
+    with zipfile.ZipFile(xlsx_path) as zf:
+        workbook = ET.fromstring(zf.read("xl/workbook.xml"))
+        date1904 = False
+        props = workbook.find(f"{_XLSX_NS}workbookPr")
+        if props is not None:
+            date1904 = props.get("date1904") in ("1", "true")
+        rel_id = next(sh.get(f"{_XLSX_REL_NS}id") for sh in workbook.iter(f"{_XLSX_NS}sheet")
+                      if sh.get("name") == sheet_name)
+        rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+        target = next(r.get("Target") for r in rels.iter(f"{_XLSX_PKG_REL_NS}Relationship")
+                      if r.get("Id") == rel_id)
+        sheet_path = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+
+        shared: List[str] = []
+        if "xl/sharedStrings.xml" in zf.namelist():
+            with zf.open("xl/sharedStrings.xml") as f:
+                for _, elem in ET.iterparse(f):
+                    if elem.tag == f"{_XLSX_NS}si":
+                        shared.append("".join(t.text or "" for t in elem.iter(f"{_XLSX_NS}t")))
+                        elem.clear()
+
+        rows = []
+        with zf.open(sheet_path) as f:
+            for _, elem in ET.iterparse(f):
+                if elem.tag != f"{_XLSX_NS}row":
+                    continue
+                if int(elem.get("r", 0)) >= min_row:
+                    values: List[Any] = [None] * ncols
+                    for pos, cell in enumerate(elem.iter(f"{_XLSX_NS}c")):
+                        ref = cell.get("r")
+                        col = _column_index(ref) if ref else pos
+                        if col >= ncols:
+                            continue
+                        kind = cell.get("t", "n")
+                        if kind == "inlineStr":
+                            values[col] = "".join(t.text or "" for t in cell.iter(f"{_XLSX_NS}t"))
+                            continue
+                        v = cell.find(f"{_XLSX_NS}v")
+                        if v is None or v.text is None:
+                            continue
+                        if kind == "s":
+                            values[col] = shared[int(v.text)]
+                        elif kind == "n":
+                            values[col] = float(v.text)
+                        elif kind == "b":
+                            values[col] = v.text == "1"
+                        elif kind != "e":
+                            values[col] = v.text  # str (результат формулы) и d (ISO-дата)
+                    rows.append(tuple(values))
+                elem.clear()
+    return rows, date1904
+
+
+def _excel_serial_to_date(serial: float, date1904: bool = False) -> datetime:
+    """Серийный номер даты Excel → datetime."""
+    epoch = datetime(1904, 1, 1) if date1904 else datetime(1899, 12, 30)
+    return epoch + timedelta(days=float(serial))
+
+
 def load_reference_bonds(xlsx_path: str) -> dict:
     """
     Лист: 'bonds'
-    Колонки: A=ISIN, B=Название инструмента
-    Возврат: { ISIN: {"name": str} }
+    Колонки: A=ISIN, B=Название инструмента;
+             необязательные параметры выпуска (для bond_analytics):
+             C=Купон, % годовых, D=Частота (выплат в год), E=Погашение, F=Базис (30/360, ACT/360, ACT/365, ACT/ACT)
+    Возврат: { ISIN: {"name": str, ["coupon", "frequency", "maturity", "day_count"]} }
+    Лист читается потоково из XML (_iter_sheet_rows): с параметрами выпуска ячеек втрое больше,
+    и разбор через объекты ячеек openpyxl стал заметной частью подготовки справочников.
     """
-    wb = load_workbook(xlsx_path, read_only=True, data_only=True)
-    ws = wb["bonds"]
+    try:
+        rows, date1904 = _iter_sheet_rows(xlsx_path, "bonds", 6)
+    except (KeyError, StopIteration, ValueError, ET.ParseError, zipfile.BadZipFile):
+        # Нестандартная книга — читаем через openpyxl (даты придут как datetime)
+        wb = openpyxl.load_workbook(xlsx_path, read_only=True, data_only=True)
+        rows = [(tuple(row) + (None,) * 6)[:6] for row in wb["bonds"].iter_rows(min_row=2, values_only=True)]
+        wb.close()
+        date1904 = False
     ref = {}
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        isin, name = row[:2]
+    for isin, name, coupon, freq, maturity, day_count in rows:
         isin = _norm_isin(isin)
         if not isin:
             continue
-        ref[isin] = {"name": (name or "").strip()}
+        rec = {"name": (name or "").strip()}
+        terms = _bond_terms(coupon, freq, maturity, day_count, date1904)
+        if terms:
+            rec.update(terms)
+        ref[isin] = rec
     return ref
 
 
-def load_reference_structured(xlsx_path: str, pdf_dir: str) -> dict:
+_MATURITY_RE = re.compile(r"\d{2}\.\d{2}\.\d{4}")
+
+
+def _to_number(value) -> Optional[float]:
+    """Число из ячейки: float/int или текст («5,25», «2.0»); пусто или не число — None."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).strip().replace("\u00a0", "").replace(" ", "").replace(",", "."))
+    except ValueError:
+        return None
+
+
+def _bond_terms(coupon, freq, maturity, day_count, date1904: bool = False) -> Optional[dict]:
+    """
+    Параметры выпуска из колонок C–F справочника облигаций. Если купон, частота или дата погашения
+    пусты или не разбираются — None: облигация остается в справочнике без параметров,
+    а не обрывает загрузку всего справочника.
+    """
+    coupon, freq = _to_number(coupon), _to_number(freq)
+    if coupon is None or not freq or freq != int(freq) or not maturity:
+        return None
+    # Дата погашения всегда в формате DD.MM.YYYY (в xlsx — дата, серийник или текст
+    # YYYY-MM-DD / YYYY-MM-DDTHH:MM:SS / DD.MM.YYYY)
+    if isinstance(maturity, (int, float)) and not isinstance(maturity, bool):
+        maturity = _excel_serial_to_date(maturity, date1904)
+    if isinstance(maturity, datetime):
+        maturity = maturity.strftime("%d.%m.%Y")
+    else:
+        maturity = str(maturity).strip()
+        if len(maturity) >= 10 and maturity[4] == "-" and maturity[7] == "-":
+            maturity = f"{maturity[8:10]}.{maturity[5:7]}.{maturity[:4]}"
+    if not _MATURITY_RE.fullmatch(maturity):
+        return None
+    return {
+        "coupon": coupon,
+        "frequency": int(freq),
+        "maturity": maturity,
+        "day_count": str(day_count or "").strip().upper() or None,
+    }
+
+
+def scan_termsheet_catalog(pdf_dir: str) -> Dict[str, str]:
+    """
+    Один проход по каталогу TermSheets вместо проверки файла на каждый ISIN.
+    Возврат: { ISIN: путь к PDF } (расширение .pdf в любом регистре).
+    """
+    catalog = {}
+    if not os.path.isdir(pdf_dir):
+        return catalog
+    with os.scandir(pdf_dir) as it:
+        for entry in it:
+            stem, ext = os.path.splitext(entry.name)
+            if ext.lower() == ".pdf" and entry.is_file():
+                catalog[_norm_isin(stem)] = entry.path
+    return catalog
+
+
+def load_reference_structured(xlsx_path: str, pdf_dir: str, catalog: Optional[Dict[str, str]] = None) -> dict:
     """
     Лист: 'TS'
     Колонки: B=ISIN, C=ссылка (необязательна для нас)
     Возврат: { ISIN: {"pdf_path": <str|None>} }
     PDF располагаются в pdf_dir и именуются '<ISIN>.pdf'
+    catalog — заранее просканированный каталог PDF (см. scan_termsheet_catalog).
     """
-    wb = load_workbook(xlsx_path, read_only=True, data_only=True)
+    if catalog is None:
+        catalog = scan_termsheet_catalog(pdf_dir)
+    wb = openpyxl.load_workbook(xlsx_path, read_only=True, data_only=True)
     ws = wb["TS"]
     ref = {}
     for row in ws.iter_rows(min_row=2, values_only=True):
@@ -221,11 +403,88 @@ def load_reference_structured(xlsx_path: str, pdf_dir: str) -> dict:
         isin = _norm_isin(isin)
         if not isin:
             continue
-        pdf_path = os.path.join(pdf_dir, f"{isin}.pdf")
-        ref[isin] = {"pdf_path": pdf_path if os.path.isfile(pdf_path) else None}
+        ref[isin] = {"pdf_path": catalog.get(isin)}
     return ref
 
 
+def _reference_sources_signature(catalog: Dict[str, str]) -> dict:
+    """Сигнатура источников справочников (размер + mtime) для проверки актуальности кэша."""
+    def _stat(path: str):
+        try:
+            st = os.stat(path)
+            return [st.st_size, st.st_mtime_ns]
+        except OSError:
+            return None
+
+    return {
+        "xlsx": {path: _stat(path) for path in (REF_STOCKS_XLSX, REF_BONDS_XLSX, REF_SP_XLSX)},
+        "pdf": {isin: _stat(path) for isin, path in sorted(catalog.items())},
+    }
+
+
+def _load_references_from_sources(catalog: Dict[str, str]) -> Tuple[dict, dict, dict]:
+    """Параллельно читает три справочника из xlsx (каждый — в своём потоке)."""
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        f_stocks = pool.submit(load_reference_stocks, REF_STOCKS_XLSX)
+        f_bonds = pool.submit(load_reference_bonds, REF_BONDS_XLSX)
+        f_struct = pool.submit(load_reference_structured, REF_SP_XLSX, REF_SP_PDF_DIR, catalog)
+        return f_stocks.result(), f_bonds.result(), f_struct.result()
+
+
+def build_reference_cache(cache_path: str = REFERENCE_CACHE_JSON) -> Tuple[dict, dict, dict]:
+    """Читает справочники из xlsx и сохраняет их в JSON-кэш вместе с сигнатурой источников."""
+    catalog = scan_termsheet_catalog(REF_SP_PDF_DIR)
+    with span("dictionary_read_xlsx"):
+        stocks, bonds, structured = _load_references_from_sources(catalog)
+    count("reference_rows_read", len(stocks) + len(bonds) + len(structured))
+    payload = {
+        "version": REFERENCE_CACHE_VERSION,
+        "sources": _reference_sources_signature(catalog),
+        "stocks": stocks,
+        "bonds": bonds,
+        "structured": structured,
+    }
+    _ensure_dir(Path(cache_path).parent)
+    tmp = Path(str(cache_path) + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+    os.replace(tmp, cache_path)
+    return stocks, bonds, structured
+
+
+def load_references(cache_path: str = REFERENCE_CACHE_JSON) -> Tuple[dict, dict, dict, bool]:
+    """
+    Возвращает (stocks, bonds, structured, from_cache).
+    Если кэш актуален (сигнатура источников совпала) — читает его,
+    иначе пересобирает из xlsx и обновляет кэш.
+    """
+    with span("dictionary_load") as attrs:
+        catalog = scan_termsheet_catalog(REF_SP_PDF_DIR)
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if (cached.get("version") == REFERENCE_CACHE_VERSION
+                    and cached.get("sources") == _reference_sources_signature(catalog)):
+                count("reference_cache_hits")
+                attrs["source"] = "cache"
+                return cached["stocks"], cached["bonds"], cached["structured"], True
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            pass
+        count("reference_cache_misses")
+        attrs["source"] = "xlsx"
+        stocks, bonds, structured = build_reference_cache(cache_path)
+        return stocks, bonds, structured, False
+
+
+def references_signature(cache_path: str = REFERENCE_CACHE_JSON) -> list:
+    """[размер, mtime_ns] кэша справочников — меняется при каждой пересборке (режим приращений)."""
+    try:
+        st = os.stat(cache_path)
+    except FileNotFoundError:
+        return []
+    return [st.st_size, st.st_mtime_ns]
+
+
 def match_isins(
     isins: List[str],
     ref_stocks: dict,
@@ -241,9 +500,10 @@ def match_isins(
       4) Иначе — в 'misses'
     Возвращает кортеж списков:
       hits_stocks: list[{"isin","ticker","type"}]
-      hits_bonds:  list[{"isin","name"}]
+      hits_bonds:  list[{"isin","name"[,"coupon","frequency","maturity","day_count"]}]
       hits_sp:     list[{"isin","type","pdf_path"}]  # type всегда "СТРУКТУРНЫЙ ПРОДУКТ"
       misses:      list[isin]
+    Количество и валюту позиции добавляет attach_positions ("quantity","currency").
     """
     seen = set()
     hits_stocks: List[dict] = []
@@ -274,6 +534,8 @@ def match_isins(
             hits_bonds.append({
                 "isin": isin,
                 "name": b.get("name", ""),
+                # Параметры выпуска (если есть в справочнике) — для bond_analytics
+                **{key: b[key] for key in ("coupon", "frequency", "maturity", "day_count") if key in b},
             })
             continue
 
@@ -313,6 +575,7 @@ def build_output_paths(client: str, period: dict) -> dict:
         "bonds_json":  base / f"bonds_{client}_{start}__{end}.json",
         "sp_json":     base / f"sp_{client}_{start}__{end}.json",
         "noname_json": base / f"noname_isin_{client}_{start}__{end}.json",
+        "delta_json":  base / f"delta_{client}_{start}__{end}.json",
         "sp_dir":      base / f"sp_{client}_{start}__{end}",
     }
 
@@ -328,13 +591,14 @@ def _archive_path_to_backup(path: Path) -> Path:
     shutil.move(str(path), str(target))
     return target
 
-def archive_existing_outputs(paths: dict) -> None:
+def archive_existing_outputs(paths: dict) -> Optional[Path]:
     """
     Если выходные JSON уже существуют — переместить в Data_Backup.
     Если папка SP уже существует — также переместить в Data_Backup.
+    Возвращает путь папки SP в резерве (или None, если ее не было).
     """
     # JSON-файлы
-    for key in ("stocks_json", "bonds_json", "sp_json", "noname_json"):
+    for key in ("stocks_json", "bonds_json", "sp_json", "noname_json", "delta_json"):
         p = Path(paths[key])
         if p.exists():
             moved = _archive_path_to_backup(p)
@@ -345,6 +609,8 @@ def archive_existing_outputs(paths: dict) -> None:
     if sp_dir.exists():
         moved = _archive_path_to_backup(sp_dir)
         console.print(f"[yellow]⚠️ Найдена существующая папка TermSheets, перемещена в резерв:[/yellow] [bright_cyan]{moved}[/bright_cyan]")
+        return moved
+    return None
 
 def find_previous_sp_dirs(client: str, keep_dir: Path) -> list[Path]:
     """
@@ -384,6 +650,7 @@ def find_previous_jsons_for_client(client: str, period: dict, keep_paths: dict)
       bonds_{client}_*.json
       sp_{client}_*.json
       noname_isin_{client}_*.json
+      delta_{client}_*.json
     КРОМЕ текущих целевых файлов из keep_paths (их имена исключаем).
     """
     base = Path(DATA_WORK)
@@ -392,12 +659,14 @@ def find_previous_jsons_for_client(client: str, period: dict, keep_paths: dict)
         base / f"bonds_{client}_*.json",
         base / f"sp_{client}_*.json",
         base / f"noname_isin_{client}_*.json",
+        base / f"delta_{client}_*.json",
     ]
     keep_names = {
         Path(keep_paths["stocks_json"]).name,
         Path(keep_paths["bonds_json"]).name,
         Path(keep_paths["sp_json"]).name,
         Path(keep_paths["noname_json"]).name,
+        Path(keep_paths["delta_json"]).name,
     }
     results = []
     for pat in patterns:
@@ -420,7 +689,7 @@ def archive_jsons_to_backup(files: list[Path]) -> None:
 
 def find_foreign_jsons(client: str, keep_paths: dict) -> list[Path]:
     """
-    Находит ВСЕ JSON-файлы в Data_work (stock_etf_*, bonds_*, sp_*, noname_isin_*),
+    Находит ВСЕ JSON-файлы в Data_work (stock_etf_*, bonds_*, sp_*, noname_isin_*, delta_*),
     относящиеся к другим клиентам (имя файла НЕ содержит client),
     и не совпадающие с текущими целевыми путями из keep_paths.
     """
@@ -430,12 +699,14 @@ def find_foreign_jsons(client: str, keep_paths: dict) -> list[Path]:
         base / "bonds_*.json",
         base / "sp_*.json",
         base / "noname_isin_*.json",
+        base / "delta_*.json",
     ]
     keep_names = {
         Path(keep_paths["stocks_json"]).name,
         Path(keep_paths["bonds_json"]).name,
         Path(keep_paths["sp_json"]).name,
         Path(keep_paths["noname_json"]).name,
+        Path(keep_paths["delta_json"]).name,
     }
     results = []
     for pat in patterns:
@@ -462,13 +733,43 @@ def write_json_with_header(out_path: Path, client: str, period: dict, items: lis
         "period": {"start_date": period["start_date"], "end_date": period["end_date"]},
         "items": items,
     }
-    with out_path.open("w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+    with span("json_write", file=out_path.name):
+        with out_path.open("w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+    count("json_files_written")
     console.print(f"[green]📝 JSON записан:[/green] [bright_cyan]{out_path}[/bright_cyan]")
 
+def reuse_previous_termsheets(sources: list[Path], target_dir: Path, hits_sp: list[dict]) -> int:
+    """
+    Режим приращений: PDF продуктов, которые по-прежнему в портфеле, берутся из самой свежей
+    папки прошлого прогона (sources) жесткой ссылкой (если ФС не умеет — копией), а не копируются
+    из справочника заново. Сами папки-источники не меняются — их, как обычно, архивирует
+    archive_dirs_to_backup / archive_existing_outputs. Возвращает число переиспользованных PDF.
+    """
+    sources = [p for p in sources if p.is_dir()]
+    if not sources:
+        return 0
+    newest = max(sources, key=lambda p: p.stat().st_mtime)
+    _ensure_dir(target_dir)
+    reused = 0
+    for isin in dict.fromkeys(rec.get("isin", "") for rec in hits_sp):
+        src, dst = newest / f"{isin}.pdf", target_dir / f"{isin}.pdf"
+        if not isin or not src.is_file() or dst.exists():
+            continue
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+        reused += 1
+    if reused:
+        console.print(f"[green]♻️ TermSheets из прошлого прогона:[/green] [bright_cyan]{reused}[/bright_cyan]"
+                      f"[green] ({newest.name})[/green]")
+    return reused
+
 def copy_termsheets(hits_sp: list[dict], target_dir: Path) -> tuple[int, int]:
     """
-    Копирует существующие PDF по именам ISIN в целевой каталог.
+    Копирует существующие PDF по именам ISIN в целевой каталог
+    (PDF, уже лежащий там с тем же размером и временем изменения, не копируется повторно).
     Возвращает (скопировано, отсутствуют).
     """
     _ensure_dir(target_dir)
@@ -479,13 +780,30 @@ def copy_termsheets(hits_sp: list[dict], target_dir: Path) -> tuple[int, int]:
         isin = rec.get("isin", "")
         if pdf and os.path.isfile(pdf):
             dst = target_dir / f"{isin}.pdf"
-            shutil.copy2(pdf, dst)
+            if _same_file(pdf, dst):
+                count("pdfs_reused")
+                copied += 1
+                continue
+            with span("pdf_copy", isin=isin):
+                # dst может быть жесткой ссылкой на PDF в резерве — заменяем файл, а не пишем поверх
+                dst.unlink(missing_ok=True)
+                shutil.copy2(pdf, dst)
+            count("pdfs_copied")
+            count("bytes_copied", os.path.getsize(dst))
             copied += 1
         else:
             console.print(f"[yellow]⚠️ TermSheet не найден для ISIN:[/yellow] [bright_cyan]{isin}[/bright_cyan]")
             missing += 1
     return copied, missing
 
+def _same_file(src: str, dst: Path) -> bool:
+    """copy2 сохраняет mtime, поэтому совпадение размера и mtime означает, что копия актуальна."""
+    try:
+        a, b = os.stat(src), os.stat(dst)
+    except FileNotFoundError:
+        return False
+    return a.st_size == b.st_size and a.st_mtime_ns == b.st_mtime_ns
+
 def _read_current_client_from_namejson() -> str | None:
     """
     Возвращает client_name из Data_work/name_clients.json, либо None.
@@ -523,10 +841,36 @@ def _pick_isin_to_keep(files: list[Path]) -> tuple[Path, list[Path]]:
 # ---------- Точка входа ----------
 
 def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Сопоставление ISIN со справочниками")
+    parser.add_argument("--prepare-references", action="store_true",
+                        help="Только собрать кэш справочников и выйти")
+    parser.add_argument("--resolve", default=os.environ.get(isin_resolver.RESOLVER_ENV),
+                        help="Искать тикеры для неизвестных ISIN: file:<CSV> или openfigi[:<url>] "
+                             "(найденные дописываются в справочник акций/ETF)")
+    parser.add_argument("--delta", action="store_true",
+                        help="Режим приращений: сопоставлять и копировать только то, что изменилось "
+                             f"с прошлого прогона клиента, и записать delta_*.json (или {delta.DELTA_ENV}=1)")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.prepare_references:
+        try:
+            stocks, bonds, structured = build_reference_cache()
+        except Exception as e:
+            console.print(f"[red]❌ Ошибка подготовки справочников: {e}[/red]")
+            return 1
+        console.print(f"[green]📚 Кэш справочников собран:[/green] [bright_cyan]{REFERENCE_CACHE_JSON}[/bright_cyan]")
+        console.print(f"[green]↳ Stocks/ETF: {len(stocks)}, Bonds: {len(bonds)}, Structured: {len(structured)}[/green]")
+        return 0
+
+    pool = ThreadPoolExecutor(max_workers=1)
     try:
         console.print("[bold green]🧭 map_instruments — Этап 1 (каркас)[/bold green]")
-        console.print(f"[bright_cyan]Поиск входного файла в: {DATA_WORK}[/bright_cyan]")
 
+        # Справочники грузятся в фоне, пока ищется и разбирается входной JSON
+        refs_future = pool.submit(load_references)
+
+        console.print(f"[bright_cyan]Поиск входного файла в: {DATA_WORK}[/bright_cyan]")
         input_path = find_input_payload(DATA_WORK)
 
         # Имя файла → ожидаемые client/start/end (по имени)
@@ -537,27 +881,62 @@ def main(argv: Optional[List[str]] = None) -> int:
                       f"period=[/green][bright_cyan]{start_from_name}..{end_from_name}[/bright_cyan]")
 
         # Фактическое содержимое JSON
-        client, period, isins = load_client_isins(input_path)
+        client, period, isins, positions = load_client_isins(input_path)
         console.print(f"[green]✅ Загружен JSON. Клиент:[/green] [bright_cyan]{client}[/bright_cyan]")
         console.print(f"[green]↳ Период:[/green] [bright_cyan]{period['start_date']}..{period['end_date']}[/bright_cyan]")
         console.print(f"[green]↳ Кол-во ISIN:[/green] [bright_cyan]{len(isins)}[/bright_cyan]")
 
-        # Загрузка справочников (только чтение, без сопоставления)
-        console.print(f"[green]🔄 Загрузка справочников…[/green]")
-        console.print(f"[green]↳ Stocks/ETF:[/green] [bright_cyan]{REF_STOCKS_XLSX}[/bright_cyan]")
-        stocks = load_reference_stocks(REF_STOCKS_XLSX)
-        console.print(f"[green]   Загружено записей:[/green] [bright_cyan]{len(stocks)}[/bright_cyan]")
-
-        console.print(f"[green]↳ Bonds:[/green] [bright_cyan]{REF_BONDS_XLSX}[/bright_cyan]")
-        bonds = load_reference_bonds(REF_BONDS_XLSX)
-        console.print(f"[green]   Загружено записей:[/green] [bright_cyan]{len(bonds)}[/bright_cyan]")
-
-        console.print(f"[green]↳ Structured (TS):[/green] [bright_cyan]{REF_SP_XLSX}[/bright_cyan]")
-        structured = load_reference_structured(REF_SP_XLSX, REF_SP_PDF_DIR)
-        console.print(f"[green]   Загружено записей:[/green] [bright_cyan]{len(structured)}[/bright_cyan]")
+        # Справочники (загружались параллельно с разбором входного JSON)
+        console.print("[green]🔄 Загрузка справочников…[/green]")
+        stocks, bonds, structured, from_cache = refs_future.result()
+        source = "кэш " + REFERENCE_CACHE_JSON if from_cache else "xlsx (кэш обновлён)"
+        console.print(f"[green]↳ Источник:[/green] [bright_cyan]{source}[/bright_cyan]")
+        console.print(f"[green]↳ Stocks/ETF:[/green] [bright_cyan]{len(stocks)}[/bright_cyan]")
+        console.print(f"[green]↳ Bonds:[/green] [bright_cyan]{len(bonds)}[/bright_cyan]")
+        console.print(f"[green]↳ Structured (TS):[/green] [bright_cyan]{len(structured)}[/bright_cyan]")
+
+        # Режим приращений: записи неизменных ISIN — из кэша прошлого прогона (если справочники те же)
+        delta_mode = delta.enabled(args.delta)
+        references = references_signature()
+        cached = delta.load_cache(client) if delta_mode else None
+        reused = delta.reusable_mapping(cached, references) if delta_mode else {}
+        todo = [isin for isin in isins if (isin or "").strip().upper() not in reused] if reused else isins
+        if delta_mode:
+            changes = delta.compute_delta(client, period, isins, cached)
+            console.print(f"[green]🔁 Режим приращений ({changes.source or 'прошлого прогона нет'}):[/green] "
+                          f"[bright_cyan]+{len(changes.added)} / −{len(changes.removed)} / ={len(changes.unchanged)}[/bright_cyan]"
+                          f"[green]; из кэша сопоставления:[/green] [bright_cyan]{len(isins) - len(todo)}[/bright_cyan]")
+            count("isins_reused", len(isins) - len(todo))
 
         # Сопоставление ISIN по справочникам (без записи на диск)
-        hits_stocks, hits_bonds, hits_sp, misses = match_isins(isins, stocks, bonds, structured)
+        with span("match", isins=len(todo)):
+            hits_stocks, hits_bonds, hits_sp, misses = match_isins(todo, stocks, bonds, structured)
+
+        # Неизвестные ISIN — внешнему провайдеру (только по явному --resolve / REPORT_ISIN_RESOLVER)
+        if misses and args.resolve:
+            try:
+                with span("isin_resolve", isins=len(misses)):
+                    resolved = isin_resolver.resolve_isins(misses, isin_resolver.make_resolver(args.resolve))
+                for isin in misses:
+                    rec = resolved.get(isin)
+                    if rec:
+                        hits_stocks.append({"isin": isin, "ticker": rec["ticker"],
+                                            "name": rec.get("name", ""), "type": rec.get("type", "")})
+                misses = [isin for isin in misses if isin not in resolved]
+                added = isin_resolver.append_to_reference(resolved, REF_STOCKS_XLSX)
+                console.print(f"[green]🔎 Найдено тикеров для неизвестных ISIN:[/green] [bright_cyan]{len(resolved)}[/bright_cyan]"
+                              f"[green]; добавлено в справочник:[/green] [bright_cyan]{added}[/bright_cyan]")
+            except Exception as e:
+                # Провайдер недоступен — работаем как раньше, неизвестные уходят в noname
+                console.print(f"[yellow]⚠️ Поиск тикеров для неизвестных ISIN не удался: {e}[/yellow]")
+        if reused:
+            mapped = {**reused, **delta.index_hits(hits_stocks, hits_bonds, hits_sp, misses)}
+            hits_stocks, hits_bonds, hits_sp, misses = delta.ordered_hits(isins, mapped)
+        if positions:
+            for hits in (hits_stocks, hits_bonds, hits_sp):
+                attach_positions(hits, positions)
+        count("isins_matched", len(hits_stocks) + len(hits_bonds) + len(hits_sp))
+        count("isins_unmatched", len(misses))
 
         console.print("[green]🧩 Результат сопоставления:[/green]")
         console.print(f"  Акции/ETF: [bright_cyan]{len(hits_stocks)}[/bright_cyan]")
@@ -572,7 +951,7 @@ def main(argv: Optional[List[str]] = None) -> int:
             if not rows:
                 console.print(f"[yellow]{title}: нет записей[/yellow]")
                 return
-            table = Table(title=title, show_lines=False)
+            table = rich_table.Table(title=title, show_lines=False)
             for col in columns:
                 # номер колонки и короткие поля делаем no_wrap для аккуратного вида
                 if col in ("№", "ISIN", "Ticker", "Type"):
@@ -611,7 +990,13 @@ def main(argv: Optional[List[str]] = None) -> int:
         paths = build_output_paths(client, period)
 
         # Архивировать прошлые результаты (если есть)
-        archive_existing_outputs(paths)
+        archived_sp_dir = archive_existing_outputs(paths)
+
+        # Режим приращений: TermSheets неизменных СП берутся из папки прошлого прогона того же
+        # периода (уже в резерве) или прошлого периода (ее архивирует уборка ниже)
+        if delta_mode:
+            sources = [archived_sp_dir] if archived_sp_dir else find_previous_sp_dirs(client, paths["sp_dir"])
+            reuse_previous_termsheets(sources, paths["sp_dir"], hits_sp)
 
         # Архивирование всех прошлых JSON этого клиента (с другими периодами), кроме текущих
         old_jsons = find_previous_jsons_for_client(client, period, paths)
@@ -639,6 +1024,26 @@ def main(argv: Optional[List[str]] = None) -> int:
         else:
             console.print("[green]✅ Неизвестных ISIN нет — noname JSON не создавался[/green]")
 
+        # Кэш прогона (для следующего режима приращений) и сводка изменений
+        mapped = delta.index_hits(hits_stocks, hits_bonds, hits_sp, misses)
+        if delta_mode:
+            items = delta.change_items(changes, mapped, positions, (cached or {}).get("mapping"))
+            delta.write_changes(str(paths["delta_json"]), client, period, changes, items)
+            console.print(f"[green]📝 Сводка изменений:[/green] [bright_cyan]{paths['delta_json']}[/bright_cyan]")
+        try:
+            delta.save_cache(client, delta.mapping_cache(period, references, mapped, positions))
+        except OSError as e:
+            console.print(f"[yellow]⚠️ Кэш режима приращений не записан: {e}[/yellow]")
+
+        # Снимок портфеля в историю позиций (запросы «кто держал ISIN на дату», «когда впервые купил»)
+        try:
+            rows = holdings_history.append_snapshots(
+                [(client, period, holdings_history.snapshot_items(hits_stocks, hits_bonds, hits_sp, misses))])
+            console.print(f"[green]🗂️ История позиций:[/green] [bright_cyan]{rows}[/bright_cyan][green] строк → "
+                          f"{holdings_history.HISTORY_DIR}[/green]")
+        except Exception as e:
+            console.print(f"[yellow]⚠️ Снимок в историю позиций не записан: {e}[/yellow]")
+
         # Копирование TermSheets
         copied, missing = copy_termsheets(hits_sp, paths["sp_dir"])
         console.print(f"[green]📦 Папка TermSheets:[/green] [bright_cyan]{paths['sp_dir']}[/bright_cyan]")
@@ -653,7 +1058,14 @@ def main(argv: Optional[List[str]] = None) -> int:
     except Exception as e:
         console.print(f"[red]❌ Критическая ошибка: {e}[/red]")
         return 1
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    if not ensure_dependencies(REQUIRED_MODULES):
+        sys.exit(1)
+    stage_name = "prepare_references" if "--prepare-references" in sys.argv else "map_instruments"
+    with stage_span(stage_name), profile_stage(stage_name):
+        code = main()
+    sys.exit(code)
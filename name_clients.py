@@ -5,49 +5,20 @@ import json
 import glob
 from pathlib import Path
 
+# rich и xlwings импортируются лениво (при первом обращении) через слой startup
+from startup import ensure_dependencies, lazy_import, rprint as print
+from instrumentation import span, stage_span
+from profiling import profile_stage
 
-import os
-import sys
-
-# === Автоустановка rich (в первую очередь) ===
-try:
-    from rich import print
-except ImportError:
-    print("Устанавливаю rich для цветного вывода...")
-    os.system(f'"{sys.executable}" -m pip install rich')
-    from rich import print
+xw = lazy_import("xlwings")
 
-# === Автоустановка xlwings ===
-try:
-    import xlwings as xw
-except ImportError:
-    print("[bold yellow]Устанавливаю xlwings...[/bold yellow]")
-    os.system(f'"{sys.executable}" -m pip install xlwings')
-    try:
-        import xlwings as xw
-    except ImportError:
-        print("[bold red]Модуль xlwings не установлен. Установите вручную: pip install xlwings[/bold red]")
-        sys.exit(1)
-
-
-# Импорт xlwings для работы с Excel-файлами
-try:
-    import xlwings as xw
-except ImportError:
-    print("[bold red]Модуль xlwings не установлен. Установите его: pip install xlwings[/bold red]")
-    sys.exit(1)
-
-# Импорт rich для цветного вывода
-try:
-    from rich import print
-except ImportError:
-    print("Устанавливаю rich для цветного вывода...")
-    os.system(f'"{sys.executable}" -m pip install rich')
-    from rich import print
+REQUIRED_MODULES = ["rich", "xlwings"]
 
 # Константы путей
-DATA_IN_PATH = r"F:\Python Projets\Report\Data_in"
-DATA_WORK_PATH = r"F:\Python Projets\Report\Data_work"
+# (корень проекта можно переопределить переменной окружения REPORT_BASE_DIR)
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+DATA_IN_PATH = os.path.join(BASE_DIR, "Data_in")
+DATA_WORK_PATH = os.path.join(BASE_DIR, "Data_work")
 OUTPUT_FILE = os.path.join(DATA_WORK_PATH, "name_clients.json")
 
 def find_report_files():
@@ -260,11 +231,14 @@ def main():
     print(f"[bold green]Найден файл: {os.path.basename(report_file)}[/bold green]")
     
     # Шаг 3: Проверка наличия листа 'портфель'
-    if not check_portfolio_sheet(report_file):
+    with span("workbook_open", file=os.path.basename(report_file)):
+        has_portfolio = check_portfolio_sheet(report_file)
+    if not has_portfolio:
         sys.exit(1)
     
     # Шаг 4: Извлечение имени клиента
-    client_name = extract_client_name(report_file)
+    with span("client_name_extract"):
+        client_name = extract_client_name(report_file)
     if not client_name:
         sys.exit(1)
     
@@ -283,5 +257,8 @@ def main():
 
 # Запуск модуля, если файл выполняется напрямую
 if __name__ == "__main__":
-    main()
+    if not ensure_dependencies(REQUIRED_MODULES):
+        sys.exit(1)
+    with stage_span("name_clients"), profile_stage("name_clients"):
+        main()
 
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+performance.py — изменение цены (столбец «Отклонение» листа stock_etf_price) векторно.
+
+compute_performance() принимает хранилище цен и произвольный набор пар
+(ISIN, начало, конец) — все позиции всех клиентов за все нужные периоды сразу —
+и за два as-of join (PriceStore.as_of_many) получает цены начала и конца, абсолютное
+и относительное изменение в виде numpy-массивов. Отсутствующие цены не вызывают
+ошибок: строка получает флаги (нет тикера, нет цены на начало, нет цены на конец).
+Если в items есть количество и валюта (колонки листа «портфель»), строка получает и
+стоимость на конец периода — в валюте инструмента и в базовой валюте клиента (fx.py).
+
+CLI — этап цен для всего дома одним вызовом: все stock_etf_*.json в папке
+(все клиенты и периоды) → prices_{клиент}_{начало}__{конец}.json для каждого файла:
+  python performance.py [--dir Data_work] [--store dictionaries/prices]
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+from dataclasses import dataclass
+from glob import glob
+from typing import Dict, List, Optional, Sequence
+
+from startup import console, ensure_dependencies, lazy_import
+from instrumentation import count, span, stage_span
+from profiling import add_arguments as add_profile_arguments, profile_stage
+import price_store
+import fx
+
+np = lazy_import("numpy")
+
+REQUIRED_MODULES = ["rich", "numpy"]
+
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+DATA_WORK = os.path.join(BASE_DIR, "Data_work")
+
+# Цена старше даты отчета больше чем на столько дней считается отсутствующей
+MAX_PRICE_LAG_DAYS = 7
+
+# Флаги строки (битовая маска)
+NO_TICKER = 1
+NO_START_PRICE = 2
+NO_END_PRICE = 4
+FLAG_NAMES = {NO_TICKER: "no_ticker", NO_START_PRICE: "no_start_price", NO_END_PRICE: "no_end_price"}
+
+# stock_etf_{клиент}_{начало}__{конец}.json
+_STOCK_JSON_RE = re.compile(r"stock_etf_(.+)_(\d{2}\.\d{2}\.\d{4})__(\d{2}\.\d{2}\.\d{4})\.json")
+
+
+@dataclass
+class Performance:
+    """Результат по строкам запроса: все поля — numpy-массивы одной длины."""
+    start_price: "np.ndarray"   # float64, NaN — нет цены
+    end_price: "np.ndarray"
+    start_day: "np.ndarray"     # int64, фактический день цены; -1 — нет цены
+    end_day: "np.ndarray"
+    change: "np.ndarray"        # end - start
+    change_pct: "np.ndarray"    # end / start - 1 (доля, как «Отклонение» в отчете)
+    flags: "np.ndarray"         # int8, битовая маска NO_TICKER | NO_START_PRICE | NO_END_PRICE
+
+    def __len__(self) -> int:
+        return int(self.flags.shape[0])
+
+    def flag_names(self, i: int) -> List[str]:
+        return [name for bit, name in FLAG_NAMES.items() if self.flags[i] & bit]
+
+
+def compute_performance(
+    store: "price_store.PriceStore",
+    isins: Sequence[str],
+    starts: Sequence,
+    ends: Sequence,
+    tickers: Dict[str, str],
+    max_lag_days: Optional[int] = MAX_PRICE_LAG_DAYS,
+) -> Performance:
+    """
+    Изменение цены для пар (isins[i], starts[i], ends[i]); даты — 'DD.MM.YYYY', 'YYYY-MM-DD' или date.
+    tickers — соответствие ISIN → тикер (из stock_etf items); ISIN без тикера получает флаг NO_TICKER.
+    """
+    tids = store.ticker_ids([tickers.get(isin) or "" for isin in isins])
+    no_ticker = np.fromiter((not tickers.get(isin) for isin in isins), dtype=bool, count=len(isins))
+    start_days = price_store.to_days(starts) if len(starts) else np.empty(0, dtype=np.int64)
+    end_days = price_store.to_days(ends) if len(ends) else np.empty(0, dtype=np.int64)
+
+    with span("performance_asof", rows=len(isins)):
+        start_price, start_found = store.as_of_many(tids, start_days, max_lag_days)
+        end_price, end_found = store.as_of_many(tids, end_days, max_lag_days)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = end_price - start_price
+        change_pct = np.where(start_price > 0, end_price / start_price - 1.0, np.nan)
+
+    flags = (no_ticker * NO_TICKER
+             | np.isnan(start_price) * NO_START_PRICE
+             | np.isnan(end_price) * NO_END_PRICE).astype(np.int8)
+    count("performance_rows", len(isins))
+    count("performance_missing", int(np.count_nonzero(flags)))
+    return Performance(start_price, end_price, start_found, end_found, change, change_pct, flags)
+
+
+def _fmt_day(day: int) -> Optional[str]:
+    return f"{price_store.from_day(day):%d.%m.%Y}" if day >= 0 else None
+
+
+def _num(value: float) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), 6)
+
+
+def value_rows(perf: Performance, items: Sequence[dict], bases: Sequence[str],
+               rates: "fx.FxRates") -> "fx.Valuation":
+    """Стоимость строк на конец периода (цена конца × количество) и в базовой валюте — одним проходом."""
+    quantities = np.fromiter((rec.get("quantity") if rec.get("quantity") is not None else np.nan for rec in items),
+                             dtype=np.float64, count=len(items))
+    with span("fx_valuation", rows=len(items)):
+        return fx.value_positions(rates, quantities, perf.end_price,
+                                  [rec.get("currency") or "" for rec in items], bases, perf.end_day)
+
+
+def price_items(items: list, perf: Performance, offset: int = 0, valuation: Optional["fx.Valuation"] = None,
+                bases: Optional[Sequence[str]] = None) -> list:
+    """
+    Строки prices_*.json для items одного файла; perf (и valuation с bases) — результат,
+    где строки items начинаются с позиции offset.
+    """
+    result = []
+    for j, rec in enumerate(items):
+        i = offset + j
+        row = {
+            "isin": rec.get("isin", ""),
+            "ticker": (rec.get("ticker") or "").strip(),
+            "start_date": _fmt_day(perf.start_day[i]),
+            "start_price": _num(perf.start_price[i]),
+            "end_date": _fmt_day(perf.end_day[i]),
+            "end_price": _num(perf.end_price[i]),
+            "change": _num(perf.change[i]),
+            "deviation": _num(perf.change_pct[i]),
+            "missing": perf.flag_names(i),
+        }
+        if valuation is not None and rec.get("quantity") is not None:
+            row.update({
+                "quantity": rec["quantity"],
+                "currency": rec.get("currency") or None,
+                "value": _num(valuation.value[i]),
+                "base_currency": bases[i],
+                "fx_rate": _num(valuation.fx_rate[i]),
+                "value_base": _num(valuation.value_base[i]),
+            })
+            if valuation.no_fx[i]:
+                row["missing"].append("no_fx")
+        result.append(row)
+    return result
+
+
+def compute_items(items: list, period: dict, store: "price_store.PriceStore",
+                  max_lag_days: Optional[int] = MAX_PRICE_LAG_DAYS, base_currency: Optional[str] = None,
+                  rates: Optional["fx.FxRates"] = None) -> list:
+    """prices_*.json items для одного клиента и периода (со стоимостью, если у позиций есть количество)."""
+    isins = [rec.get("isin", "") for rec in items]
+    tickers = {rec.get("isin", ""): (rec.get("ticker") or "").strip() for rec in items}
+    perf = compute_performance(store, isins, [period["start_date"]] * len(items),
+                               [period["end_date"]] * len(items), tickers, max_lag_days)
+    if not any(rec.get("quantity") is not None for rec in items):
+        return price_items(items, perf)
+    bases = [base_currency or fx.DEFAULT_BASE_CURRENCY] * len(items)
+    valuation = value_rows(perf, items, bases, rates or fx.FxRates.from_store(store))
+    return price_items(items, perf, valuation=valuation, bases=bases)
+
+
+def write_json_atomic(path: str, payload: dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Отклонение цен акций/ETF для всех клиентов и периодов")
+    parser.add_argument("--dir", default=DATA_WORK, help="Папка с stock_etf_*.json")
+    parser.add_argument("--store", default=price_store.PRICES_DIR, help="Папка хранилища цен")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    # Все файлы → один плоский набор строк (ISIN, начало, конец)
+    files, isins, starts, ends, tickers, rows, bases = [], [], [], [], {}, [], []
+    base_config = fx.load_base_currencies()
+    for path in sorted(glob(os.path.join(args.dir, "stock_etf_*.json"))):
+        m = _STOCK_JSON_RE.fullmatch(os.path.basename(path))
+        if not m:
+            continue
+        client, start, end = m.groups()
+        with open(path, "r", encoding="utf-8") as f:
+            items = json.load(f).get("items") or []
+        files.append((client, {"start_date": start, "end_date": end}, items, len(isins)))
+        for rec in items:
+            isin = rec.get("isin", "")
+            isins.append(isin)
+            tickers.setdefault(isin, (rec.get("ticker") or "").strip())
+        starts.extend([start] * len(items))
+        ends.extend([end] * len(items))
+        rows.extend(items)
+        bases.extend([fx.base_currency(client, base_config)] * len(items))
+    if not files:
+        console.print(f"[yellow]⚠️ В {args.dir} нет stock_etf_*.json[/yellow]")
+        return 1
+
+    store = price_store.PriceStore.open(args.store)
+    with span("performance", rows=len(isins), files=len(files)):
+        perf = compute_performance(store, isins, starts, ends, tickers)
+    # Курсы — один снимок на весь прогон, пересчет всех позиций всех клиентов — один проход
+    valuation = value_rows(perf, rows, bases, fx.FxRates.from_store(store)) \
+        if any(rec.get("quantity") is not None for rec in rows) else None
+
+    for client, period, items, offset in files:
+        out_path = os.path.join(args.dir, f"prices_{client}_{period['start_date']}__{period['end_date']}.json")
+        write_json_atomic(out_path, {"client": client, "period": period,
+                                     "items": price_items(items, perf, offset, valuation, bases)})
+
+    missing = int(np.count_nonzero(perf.flags))
+    console.print(f"[green]✅ Строк: {len(perf)} в {len(files)} файлах; без цены: {missing}[/green]")
+    return 0
+
+
+if __name__ == "__main__":
+    if not ensure_dependencies(REQUIRED_MODULES):
+        sys.exit(1)
+    with stage_span("performance"), profile_stage("performance"):
+        code = main()
+    sys.exit(code)
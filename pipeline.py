@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+pipeline.py — граф этапов подготовки отчета (DAG) с контрольными точками.
+
+Каждый этап объявляет свои входы и выходы (glob-маски относительно корня проекта).
+Перед запуском для этапа считается ключ: отпечаток скрипта, аргументов и содержимого
+всех входов (SHA-256). Если ключ совпадает с сохранённым в pipeline_state.json и
+выходы не менялись с момента последнего успешного запуска — этап пропускается
+(как в make). Состояние сохраняется после каждого успешного этапа, поэтому
+повторный запуск продолжает работу с последней удачной контрольной точки.
+
+Этапы запускаются по готовности зависимостей (deps) в пуле потоков: независимые
+этапы (например, подготовка справочников) идут параллельно
+с интерактивными. Интерактивные этапы выполняются строго по одному и владеют
+консолью; вывод фоновых этапов буферизуется и печатается по их завершении —
+но не раньше, чем интерактивный этап освободит консоль.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from glob import glob
+from typing import Callable, Dict, List, Optional, Tuple
+
+import instrumentation
+import profiling
+# rich импортируется при первом выводе через слой startup
+from startup import console, ensure_dependencies
+
+# Константы путей
+# Скрипты этапов лежат рядом с pipeline.py; данные — в BASE_DIR (можно переопределить REPORT_BASE_DIR)
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", SCRIPT_DIR)
+DATA_WORK = os.path.join(BASE_DIR, "Data_work")
+STATE_PATH = os.path.join(DATA_WORK, "pipeline_state.json")
+
+STATE_VERSION = 1
+HASH_CHUNK = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class Stage:
+    """Этап конвейера: скрипт, его зависимости по данным и порядок запуска."""
+    name: str
+    script: str
+    description: str
+    inputs: Tuple[str, ...] = ()
+    outputs: Tuple[str, ...] = ()
+    deps: Tuple[str, ...] = ()
+    args: Tuple[str, ...] = ()
+    interactive: bool = False
+
+
+# Справочники, от которых зависит сопоставление инструментов
+REFERENCE_INPUTS = (
+    "dictionaries/reference_stocks/reference_stocks_etf.xlsx",
+    "dictionaries/reference_bonds/reference_bonds.xlsx",
+    "dictionaries/reference_structured/TS/TS.xlsx",
+    "dictionaries/reference_structured/TS/*.pdf",
+    "dictionaries/reference_structured/TS/*.PDF",
+)
+
+# Этапы в порядке топологической сортировки
+STAGES: List[Stage] = [
+    Stage(
+        name="insert_date",
+        script="insert_date.py",
+        description="📅 Ввод даты",
+        # Новый отчет в Data_in — новый период: даты спрашиваются заново, а не берутся из прошлого прогона
+        inputs=("Data_in/*отчет*.xlsx", "Data_in/*ОТЧЕТ*.xlsx"),
+        outputs=("Data_work/report_dates.json",),
+        interactive=True,
+    ),
+    Stage(
+        name="name_clients",
+        script="name_clients.py",
+        description="👤 Имя клиента",
+        inputs=("Data_in/*отчет*.xlsx", "Data_in/*ОТЧЕТ*.xlsx"),
+        outputs=("Data_work/name_clients.json",),
+        deps=("insert_date",),
+        interactive=True,
+    ),
+    Stage(
+        name="prepare_references",
+        script="map_instruments.py",
+        description="📚 Подготовка справочников",
+        inputs=REFERENCE_INPUTS,
+        outputs=("Data_work/cache/references.json",),
+        args=("--prepare-references",),
+    ),
+    Stage(
+        name="extract_isin",
+        script="extract_isin.py",
+        description="🔎 Извлечение ISIN",
+        inputs=("Data_in/отчет_*.xlsx", "Data_work/name_clients.json", "Data_work/report_dates.json"),
+        outputs=("Data_work/isin_*.json",),
+        deps=("insert_date", "name_clients"),
+        interactive=True,
+    ),
+    Stage(
+        name="map_instruments",
+        script="map_instruments.py",
+        description="🧭 Сопоставление инструментов",
+        inputs=("Data_work/isin_*.json", "Data_work/name_clients.json", "Data_work/cache/references.json"),
+        outputs=("Data_work/stock_etf_*.json", "Data_work/bonds_*.json", "Data_work/sp_*.json",
+                 "Data_work/delta_*.json"),
+        deps=("extract_isin", "prepare_references"),
+    ),
+    Stage(
+        name="prices",
+        script="isin_ticker_stock_etf.py",
+        description="💹 Цены акций/ETF за период",
+        inputs=("Data_work/name_clients.json", "Data_work/report_dates.json",
+                "Data_work/stock_etf_*.json", "Data_work/sp_*.json", "dictionaries/prices/store.json",
+                "dictionaries/clients/base_currency.json", "dictionaries/reference_structured/sp_terms.json"),
+        # Этап догружает цены в хранилище: манифест — его выход, от которого зависят этапы аналитики
+        outputs=("Data_work/prices_*.json", "dictionaries/prices/store.json"),
+        deps=("map_instruments",),
+    ),
+    Stage(
+        name="sp_monitor",
+        script="sp_monitor.py",
+        description="🛡️ Мониторинг структурных продуктов",
+        inputs=("Data_work/sp_*.json", "dictionaries/reference_structured/sp_terms.json",
+                "dictionaries/prices/store.json"),
+        outputs=("Data_work/monitoring_*.json",),
+        deps=("map_instruments", "prices"),
+    ),
+    Stage(
+        name="bond_analytics",
+        script="bond_analytics.py",
+        description="📈 НКД, доходность и дюрация облигаций",
+        inputs=("Data_work/bonds_*.json", "dictionaries/prices/store.json"),
+        outputs=("Data_work/bond_metrics_*.json",),
+        deps=("map_instruments", "prices"),
+    ),
+    Stage(
+        name="returns",
+        script="returns.py",
+        description="📊 Доходность TWR/MWR с учетом сделок",
+        inputs=("Data_in/отчет_*.xlsx", "Data_work/stock_etf_*.json", "dictionaries/prices/store.json",
+                "dictionaries/clients/base_currency.json"),
+        outputs=("Data_work/transactions_*.json", "Data_work/returns_*.json"),
+        deps=("extract_isin", "map_instruments", "prices"),
+    ),
+    Stage(
+        name="risk",
+        script="risk.py",
+        description="⚖️ Волатильность, просадка, бета и VaR",
+        inputs=("Data_work/stock_etf_*.json", "dictionaries/prices/store.json"),
+        outputs=("Data_work/risk_*.json",),
+        deps=("map_instruments", "prices"),
+    ),
+    Stage(
+        name="look_through",
+        script="look_through.py",
+        description="🔬 Экспозиция сквозь ETF",
+        inputs=("Data_work/stock_etf_*.json", "dictionaries/reference_stocks/etf_holdings/*.csv",
+                "dictionaries/reference_stocks/etf_holdings/*.xlsx", "dictionaries/prices/store.json"),
+        outputs=("Data_work/exposure_*.json",),
+        deps=("map_instruments", "prices"),
+    ),
+    Stage(
+        name="template_creator",
+        script="template_creator.py",
+        description="📄 Создание и заполнение отчета",
+        inputs=("Data_work/name_clients.json", "Data_work/report_dates.json",
+                "Data_work/stock_etf_*.json", "Data_work/bonds_*.json", "Data_work/sp_*.json",
+                "Data_work/prices_*.json", "Data_work/bond_metrics_*.json", "Data_work/risk_*.json",
+                "Data_work/exposure_*.json", "Data_work/delta_*.json"),
+        outputs=("Data_work/портфель_*.xlsx",),
+        deps=("insert_date", "name_clients", "map_instruments", "prices", "bond_analytics", "risk", "look_through"),
+    ),
+]
+
+
+# ---------- Отпечатки файлов ----------
+
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def expand_patterns(patterns: Tuple[str, ...]) -> List[str]:
+    """Раскрывает glob-маски (относительно BASE_DIR) в отсортированный список относительных путей файлов."""
+    found = set()
+    for pat in patterns:
+        for p in glob(os.path.join(BASE_DIR, pat)):
+            if os.path.isfile(p) and not os.path.basename(p).startswith("~$"):
+                found.add(os.path.relpath(p, BASE_DIR).replace(os.sep, "/"))
+    return sorted(found)
+
+
+def fingerprint_files(patterns: Tuple[str, ...], stat_cache: dict) -> Dict[str, str]:
+    """
+    Возвращает {относительный_путь: sha256} для всех файлов по маскам.
+    stat_cache = {путь: [size, mtime_ns, sha256]} — позволяет не перечитывать
+    неизменившиеся файлы (совпали размер и mtime) и пополняется на месте.
+    """
+    result = {}
+    for rel in expand_patterns(patterns):
+        st = os.stat(os.path.join(BASE_DIR, rel))
+        cached = stat_cache.get(rel)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            digest = cached[2]
+        else:
+            digest = _sha256_file(os.path.join(BASE_DIR, rel))
+            stat_cache[rel] = [st.st_size, st.st_mtime_ns, digest]
+        result[rel] = digest
+    return result
+
+
+def stage_key(stage: Stage, input_prints: Dict[str, str], stat_cache: dict) -> str:
+    """Ключ этапа: скрипт + аргументы + содержимое входов. Любое изменение → новый ключ."""
+    h = hashlib.sha256()
+    h.update(stage.name.encode("utf-8"))
+    h.update(json.dumps(list(stage.args)).encode("utf-8"))
+    h.update(_sha256_file(os.path.join(SCRIPT_DIR, stage.script)).encode("utf-8"))
+    for rel, digest in sorted(input_prints.items()):
+        h.update(f"{rel}\0{digest}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+# ---------- Состояние (контрольные точки) ----------
+
+def load_state(path: Optional[str] = None) -> dict:
+    """Читает pipeline_state.json; при отсутствии/повреждении — пустое состояние."""
+    path = path or STATE_PATH
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("version") == STATE_VERSION:
+            state.setdefault("stages", {})
+            state.setdefault("files", {})
+            return state
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    return {"version": STATE_VERSION, "stages": {}, "files": {}}
+
+
+def save_state(state: dict, path: Optional[str] = None) -> None:
+    """Атомарно записывает состояние: во временный файл, затем os.replace."""
+    path = path or STATE_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def is_up_to_date(stage: Stage, key: str, state: dict) -> Tuple[bool, str]:
+    """Проверяет, можно ли пропустить этап. Возвращает (пропустить, причина)."""
+    record = state["stages"].get(stage.name)
+    if not record:
+        return False, "нет контрольной точки"
+    if record.get("key") != key:
+        return False, "изменились входы или скрипт"
+    # Успешный прогон без выходов (например, у клиента нет СП) — тоже контрольная точка:
+    # сверяются ровно те выходы, что были записаны при ней
+    if "outputs" not in record:
+        return False, "выходы не найдены"
+    recorded_outputs = record["outputs"]
+    current_outputs = fingerprint_files(stage.outputs, state["files"])
+    for rel, digest in recorded_outputs.items():
+        if current_outputs.get(rel) != digest:
+            return False, f"выход изменён или удалён: {rel}"
+    return True, "актуален"
+
+
+# ---------- Планирование и запуск ----------
+
+def select_stages(only: Optional[List[str]], start_from: Optional[str]) -> List[Stage]:
+    """Фильтрует STAGES по --only / --from, сохраняя топологический порядок."""
+    names = [s.name for s in STAGES]
+    for n in (only or []) + ([start_from] if start_from else []):
+        if n not in names:
+            raise ValueError(f"Неизвестный этап: {n}. Доступные: {', '.join(names)}")
+    selected = STAGES
+    if start_from:
+        selected = selected[names.index(start_from):]
+    if only:
+        selected = [s for s in selected if s.name in only]
+    return selected
+
+
+def run_stage_process(stage: Stage, extra_args: Tuple[str, ...] = ()) -> Tuple[int, str, float]:
+    """
+    Запускает скрипт этапа текущим интерпретатором Python с REPORT_BASE_DIR = BASE_DIR конвейера.
+    extra_args — служебные флаги запуска (например, --profile); в ключ этапа не входят.
+    Интерактивный этап пишет прямо в консоль; у фонового этапа вывод буферизуется.
+    Возвращает (код возврата, буферизованный вывод, длительность в секундах).
+    """
+    cmd = [sys.executable, os.path.join(SCRIPT_DIR, stage.script), *stage.args, *extra_args]
+    # Корень данных этапа — тот же, по которому конвейер считает отпечатки и контрольные точки
+    env = dict(os.environ, REPORT_BASE_DIR=BASE_DIR)
+    started = time.perf_counter()
+    if stage.interactive:
+        code, output = subprocess.run(cmd, cwd=BASE_DIR, env=env).returncode, ""
+    else:
+        env["PYTHONIOENCODING"] = "utf-8"
+        proc = subprocess.run(cmd, cwd=BASE_DIR, env=env, stdin=subprocess.DEVNULL,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        code, output = proc.returncode, proc.stdout.decode("utf-8", errors="replace")
+    return code, output, time.perf_counter() - started
+
+
+def _record_checkpoint(stage: Stage, state: dict) -> None:
+    # Входы могли измениться во время работы этапа (например, insert_date) — пересчитываем ключ
+    input_prints = fingerprint_files(stage.inputs, state["files"])
+    state["stages"][stage.name] = {
+        "key": stage_key(stage, input_prints, state["files"]),
+        "outputs": fingerprint_files(stage.outputs, state["files"]),
+    }
+    save_state(state)
+
+
+def run_pipeline(
+    stages: List[Stage],
+    force: Optional[List[str]] = None,
+    dry_run: bool = False,
+    sequential: bool = False,
+    extra_args: Tuple[str, ...] = (),
+) -> int:
+    """
+    Выполняет этапы по мере готовности зависимостей, пропуская актуальные.
+    Этапы из force (или все при 'all') выполняются безусловно; их потомки
+    перезапустятся сами, т.к. изменятся их входы.
+    sequential=True — строго по одному этапу в порядке списка (прежнее поведение).
+    extra_args пробрасываются каждому запускаемому этапу (флаги профилирования).
+    Состояние и отпечатки обрабатываются только в главном потоке.
+    Пока интерактивный этап ждет ввода, сообщения и вывод фоновых этапов копятся
+    и печатаются, когда консоль освободится.
+    """
+    force = set(force or [])
+    state = load_state()
+    selected = {s.name for s in stages}
+    pending = list(stages)
+    done: set = set()
+    running: Dict = {}
+    failed_code = 0
+    busy_total = 0.0
+    started = time.perf_counter()
+    deferred: List[Callable[[], None]] = []
+
+    def _flush() -> None:
+        while deferred:
+            deferred.pop(0)()
+
+    def _say(show: Callable[[], None]) -> None:
+        """Печать сейчас или, если консоль занята интерактивным этапом, — после его завершения."""
+        if any(s.interactive for s in running.values()):
+            deferred.append(show)
+        else:
+            _flush()
+            show()
+
+    def _report(stage: Stage, code: int, output: str, elapsed: float) -> None:
+        if output:
+            console.print(f"[grey50]── вывод этапа {stage.name} ──[/grey50]")
+            sys.stdout.write(output)
+            sys.stdout.flush()
+        if code != 0:
+            console.print(f"[red]❌ Этап {stage.name} завершился с кодом {code}[/red]")
+            console.print("[yellow]Повторный запуск продолжит работу с этого этапа.[/yellow]")
+        else:
+            console.print(f"[green]✅ Завершено: {stage.description}[/green] [grey50]({elapsed:.2f} с)[/grey50]")
+
+    def _ready(stage: Stage) -> bool:
+        if any(d in selected and d not in done for d in stage.deps):
+            return False
+        if sequential and running:
+            return False
+        if stage.interactive and any(s.interactive for s in running.values()):
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(1, len(stages))) as pool:
+        while pending or running:
+            # Запускаем всё, что готово (в порядке списка, чтобы интерактивные шли по очереди)
+            launched = True
+            while launched and not failed_code:
+                launched = False
+                for stage in list(pending):
+                    if not _ready(stage):
+                        if sequential:
+                            break
+                        continue
+                    pending.remove(stage)
+                    input_prints = fingerprint_files(stage.inputs, state["files"])
+                    key = stage_key(stage, input_prints, state["files"])
+                    forced = "all" in force or stage.name in force
+                    fresh, reason = is_up_to_date(stage, key, state)
+
+                    if fresh and not forced:
+                        _say(lambda text=f"[grey50]⏭  {stage.description}: пропущен ({reason})[/grey50]":
+                             console.print(text))
+                        instrumentation.count("stages_skipped")
+                        done.add(stage.name)
+                        launched = True
+                        break
+
+                    reason = "принудительный запуск" if forced else reason
+                    if dry_run:
+                        console.print(f"[yellow]▶ {stage.description}: будет выполнен ({reason})[/yellow]")
+                        done.add(stage.name)
+                        launched = True
+                        break
+
+                    mode = "" if stage.interactive else " [grey50]в фоне[/grey50]"
+                    _say(lambda text=f"\n[bold cyan]🔸 Запуск этапа: {stage.description}[/bold cyan]{mode} "
+                                     f"[grey50]({reason})[/grey50]": console.print(text))
+                    # Пока этап выполняется, его контрольная точка недействительна
+                    state["stages"].pop(stage.name, None)
+                    save_state(state)
+                    instrumentation.count("stages_executed")
+                    running[pool.submit(run_stage_process, stage, extra_args)] = stage
+                    launched = True
+                    break
+
+            if not running:
+                if pending and not failed_code:
+                    names = ", ".join(s.name for s in pending)
+                    console.print(f"[red]❌ Не удалось запустить этапы (неразрешённые зависимости): {names}[/red]")
+                    return 1
+                break
+
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for fut in finished:
+                stage = running.pop(fut)
+                code, output, elapsed = fut.result()
+                busy_total += elapsed
+                _say(lambda args=(stage, code, output, elapsed): _report(*args))
+                if code != 0:
+                    failed_code = failed_code or code
+                    continue
+                _record_checkpoint(stage, state)
+                done.add(stage.name)
+            if not any(s.interactive for s in running.values()):
+                _flush()
+
+            if failed_code:
+                # Новые этапы не запускаем, дожидаемся уже идущих
+                pending.clear()
+
+    _flush()
+    if failed_code:
+        return failed_code
+
+    if busy_total and not dry_run:
+        wall = time.perf_counter() - started
+        console.print(f"[grey50]⏱  Время: {wall:.2f} с (сумма этапов {busy_total:.2f} с)[/grey50]")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Конвейер подготовки отчета с пропуском актуальных этапов")
+    parser.add_argument("--force", "-f", nargs="+", metavar="STAGE", default=[],
+                        help="Выполнить этапы безусловно ('all' — все этапы)")
+    parser.add_argument("--from", dest="start_from", metavar="STAGE",
+                        help="Начать с указанного этапа (предыдущие не проверяются)")
+    parser.add_argument("--only", nargs="+", metavar="STAGE",
+                        help="Выполнить только указанные этапы")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Показать план без запуска")
+    parser.add_argument("--sequential", action="store_true",
+                        help="Выполнять этапы строго последовательно, без параллелизма")
+    parser.add_argument("--metrics-prom", nargs="?", const=instrumentation.PROM_DEFAULT, metavar="FILE",
+                        help="Записать Prometheus textfile по итогам запуска (по умолчанию logs/report_k.prom)")
+    # --profile / --profile-memory пробрасываются во все выполняемые этапы
+    # (актуальные этапы пропускаются — для профиля их можно запустить с --force)
+    profiling.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        stages = select_stages(args.only, args.start_from)
+    except ValueError as e:
+        console.print(f"[red]❌ {e}[/red]")
+        return 2
+
+    # Зависимости проверяются один раз здесь; дочерние этапы наследуют результат через окружение
+    if not ensure_dependencies():
+        return 1
+
+    console.print("[bold green]=== 🚀 Запуск подготовки отчета N1 Broker ===[/bold green]")
+    # run_id выставляется в окружение до запуска этапов — их трассы попадут в тот же запуск
+    run_id = instrumentation.current_run_id()
+    tracer = instrumentation.tracer()
+    tracer.stage = "pipeline"
+    tracer.enabled = tracer.enabled and not args.dry_run
+    try:
+        with instrumentation.span("pipeline") as attrs:
+            code = run_pipeline(stages, force=args.force, dry_run=args.dry_run, sequential=args.sequential,
+                                extra_args=tuple(profiling.forwarded_args(args)))
+            attrs["status"] = "ok" if code == 0 else f"exit {code}"
+    finally:
+        tracer.flush_counters()
+
+    if code == 0 and not args.dry_run:
+        console.print("\n[bold green]=== 🏁 Все этапы завершены успешно ===[/bold green]")
+    if args.metrics_prom and not args.dry_run:
+        path = instrumentation.export_prometheus(args.metrics_prom, run_id)
+        if path:
+            console.print(f"[grey50]📈 Метрики: {path}[/grey50]")
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
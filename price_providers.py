@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+price_providers.py — источники котировок для локального хранилища цен (price_store).
+
+Провайдер получает пакет запросов (тикер, начало, конец) и возвращает дневные цены закрытия:
+  FilePriceProvider  — офлайн-заглушка: папка с CSV <ТИКЕР>.csv (date,close) — для тестов и без сети;
+                       символы тикера, кроме букв, цифр, «.» и «-», в имени файла заменяются на «_»
+                       (курс FX:EUR — FX_EUR.csv: «:» недопустим в именах файлов Windows);
+  HttpPriceProvider  — HTTP API: пакеты тикеров в одном запросе, общий пул соединений aiohttp,
+                       не больше N запросов одновременно (asyncio.Semaphore), повторы с backoff.
+CachedProvider оборачивает любой провайдер дисковым кэшем с TTL (Data_work/cache/prices/).
+
+update_store() убирает дубли тикеров из всех запросов пакета (например, по всем клиентам
+месячного прогона) и запрашивает у провайдера только непокрытые хранилищем интервалы
+(PriceStore.missing_intervals — по торговому календарю), после чего отмечает их покрытыми.
+В установившемся режиме ежемесячный прогон догружает по несколько дней на тикер.
+
+Спецификация провайдера в CLI и в isin_ticker_stock_etf.py (--provider или REPORT_PRICE_PROVIDER):
+  file:<папка>    http(s)://host/path
+
+CLI (все stock_etf_*.json в папке → уникальные тикеры → загрузка → price_store):
+  python price_providers.py fetch --provider file:prices_csv [--dir Data_work]
+"""
+
+import os
+import re
+import sys
+import csv
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, timedelta
+from glob import glob
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from startup import console, lazy_import, missing_dependencies
+from instrumentation import count, span, stage_span
+import price_store
+
+aiohttp = lazy_import("aiohttp")
+np = lazy_import("numpy")
+
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+DATA_WORK = os.path.join(BASE_DIR, "Data_work")
+CACHE_DIR = os.path.join(DATA_WORK, "cache", "prices")
+
+PROVIDER_ENV = "REPORT_PRICE_PROVIDER"
+DEFAULT_TTL_SECONDS = 12 * 3600
+
+# Цены: {тикер: (["YYYY-MM-DD", ...], [close, ...])}
+PriceRecords = Dict[str, Tuple[List[str], List[float]]]
+
+
+@dataclass(frozen=True)
+class PriceRequest:
+    """Запрос истории одного тикера за период (даты — YYYY-MM-DD, включительно)."""
+    ticker: str
+    start: str
+    end: str
+
+
+def iso_date(value: str) -> str:
+    """'DD.MM.YYYY' или 'YYYY-MM-DD' → 'YYYY-MM-DD'."""
+    return str(price_store.from_day(price_store.to_day(value)))
+
+
+class PriceProvider:
+    """Интерфейс провайдера: пакетная асинхронная загрузка."""
+
+    name = "base"
+
+    async def fetch_batch(self, requests: List[PriceRequest]) -> PriceRecords:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+def ticker_file_stem(ticker: str) -> str:
+    """Тикер → безопасная часть имени файла (FX:EUR → FX_EUR)."""
+    return re.sub(r"[^\w.\-]+", "_", ticker)
+
+
+class FilePriceProvider(PriceProvider):
+    """Офлайн-провайдер: <root>/<ticker_file_stem(тикер)>.csv с колонками date,close (даты в любом из форматов price_store)."""
+
+    name = "file"
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _read(self, req: PriceRequest) -> Optional[Tuple[List[str], List[float]]]:
+        path = os.path.join(self.root, f"{ticker_file_stem(req.ticker)}.csv")
+        if not os.path.isfile(path):
+            return None
+        lo, hi = price_store.to_day(req.start), price_store.to_day(req.end)
+        dates, closes = [], []
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                day = price_store.to_day(row["date"])
+                if lo <= day <= hi:
+                    dates.append(str(price_store.from_day(day)))
+                    closes.append(float(row["close"]))
+        return dates, closes
+
+    async def fetch_batch(self, requests: List[PriceRequest]) -> PriceRecords:
+        result: PriceRecords = {}
+        for req, data in zip(requests, await asyncio.gather(*(asyncio.to_thread(self._read, r) for r in requests))):
+            if data is not None:
+                result[req.ticker] = data
+        return result
+
+
+class HttpPriceProvider(PriceProvider):
+    """
+    HTTP-провайдер. Один запрос — пакет тикеров с общим периодом:
+      GET <url>?symbols=A,B,C&start=YYYY-MM-DD&end=YYYY-MM-DD
+      → {"A": [["YYYY-MM-DD", close], ...], "B": [...]}
+    Ответы 429/5xx и сетевые ошибки повторяются retries раз с экспоненциальной паузой.
+    """
+
+    name = "http"
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, url: str, concurrency: int = 8, retries: int = 3, backoff: float = 0.5,
+                 timeout: float = 30.0):
+        if missing_dependencies(["aiohttp"]):
+            raise RuntimeError("Для HTTP-провайдера нужен aiohttp: pip install aiohttp")
+        self.url = url
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.concurrency = concurrency
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def _get(self, params: dict) -> dict:
+        session = self._get_session()
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.semaphore:
+                    async with session.get(self.url, params=params) as resp:
+                        if resp.status in self.RETRY_STATUSES and attempt < self.retries:
+                            count("price_http_retries")
+                        else:
+                            resp.raise_for_status()
+                            return await resp.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= self.retries:
+                    raise
+                count("price_http_retries")
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+        raise RuntimeError("Исчерпаны повторы запроса цен")
+
+    async def fetch_batch(self, requests: List[PriceRequest]) -> PriceRecords:
+        # Внутри пакета период общий: объединение периодов запросов
+        params = {
+            "symbols": ",".join(r.ticker for r in requests),
+            "start": min(r.start for r in requests),
+            "end": max(r.end for r in requests),
+        }
+        with span("price_http_request", tickers=len(requests)):
+            payload = await self._get(params)
+        count("price_http_requests")
+        result: PriceRecords = {}
+        for ticker, points in (payload or {}).items():
+            if points:
+                result[ticker] = ([iso_date(d) for d, _ in points], [float(c) for _, c in points])
+        return result
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class CachedProvider(PriceProvider):
+    """Дисковый кэш с TTL перед любым провайдером: один JSON на (провайдер, тикер, период)."""
+
+    def __init__(self, inner: PriceProvider, cache_dir: str = CACHE_DIR, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.inner = inner
+        self.name = inner.name
+        self.cache_dir = os.path.join(cache_dir, inner.name)
+        self.ttl_seconds = ttl_seconds
+
+    def _path(self, req: PriceRequest) -> str:
+        digest = hashlib.sha1(f"{req.ticker}|{req.start}|{req.end}".encode("utf-8")).hexdigest()[:20]
+        return os.path.join(self.cache_dir, f"{ticker_file_stem(req.ticker)}_{digest}.json")
+
+    def _load(self, req: PriceRequest) -> Optional[Tuple[List[str], List[float]]]:
+        path = self._path(req)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data["dates"], data["closes"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _store(self, req: PriceRequest, data: Tuple[List[str], List[float]]) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(req)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"ticker": req.ticker, "start": req.start, "end": req.end,
+                       "dates": data[0], "closes": data[1]}, f)
+        os.replace(tmp, path)
+
+    async def fetch_batch(self, requests: List[PriceRequest]) -> PriceRecords:
+        result: PriceRecords = {}
+        misses = []
+        for req in requests:
+            data = self._load(req)
+            if data is None:
+                misses.append(req)
+            else:
+                result[req.ticker] = data
+        count("price_cache_hits", len(requests) - len(misses))
+        count("price_cache_misses", len(misses))
+        if misses:
+            fetched = await self.inner.fetch_batch(misses)
+            for req in misses:
+                # Пустой ответ тоже кэшируется: не спрашиваем заведомо отсутствующий тикер до истечения TTL
+                data = fetched.get(req.ticker, ([], []))
+                self._store(req, data)
+                if data[0]:
+                    result[req.ticker] = data
+        return result
+
+    async def close(self) -> None:
+        await self.inner.close()
+
+
+def make_provider(spec: str, cache: bool = True, ttl_seconds: float = DEFAULT_TTL_SECONDS) -> PriceProvider:
+    """'file:<папка>' или 'http(s)://...' → провайдер (по умолчанию с дисковым кэшем)."""
+    if spec.startswith("file:"):
+        provider: PriceProvider = FilePriceProvider(spec[len("file:"):])
+    elif spec.startswith(("http://", "https://")):
+        provider = HttpPriceProvider(spec)
+    else:
+        raise ValueError(f"Неизвестный провайдер цен: {spec} (ожидается file:<папка> или http(s)://...)")
+    return CachedProvider(provider, ttl_seconds=ttl_seconds) if cache else provider
+
+
+def dedupe_requests(requests: Iterable[PriceRequest]) -> List[PriceRequest]:
+    """Один запрос на тикер: период — объединение всех запрошенных периодов."""
+    merged: Dict[str, PriceRequest] = {}
+    for req in requests:
+        prev = merged.get(req.ticker)
+        if prev is None:
+            merged[req.ticker] = req
+        else:
+            merged[req.ticker] = PriceRequest(req.ticker, min(prev.start, req.start), max(prev.end, req.end))
+    return list(merged.values())
+
+
+def plan_requests(requests: Iterable[PriceRequest], store: "price_store.PriceStore") -> List[PriceRequest]:
+    """Дедупликация по тикерам и вычитание покрытия хранилища: по запросу на каждый пробел."""
+    planned = []
+    for req in dedupe_requests(requests):
+        for lo, hi in store.missing_intervals(req.ticker, req.start, req.end):
+            planned.append(PriceRequest(req.ticker, str(price_store.from_day(lo)), str(price_store.from_day(hi))))
+    return planned
+
+
+def _batches(requests: List[PriceRequest], batch_size: int) -> List[List[PriceRequest]]:
+    """
+    Пакеты по batch_size. Тикер встречается в пакете не больше одного раза (его пробелы
+    раскладываются по разным пакетам), а тикеры с одинаковым периодом идут вместе —
+    HTTP-провайдер не расширяет период пакета зря.
+    """
+    ranked: Dict[int, List[PriceRequest]] = defaultdict(list)
+    seen: Dict[str, int] = defaultdict(int)
+    for req in sorted(requests, key=lambda r: (r.start, r.end, r.ticker)):
+        ranked[seen[req.ticker]].append(req)
+        seen[req.ticker] += 1
+    batches = []
+    for rank in sorted(ranked):
+        group = ranked[rank]
+        batches.extend(group[i:i + batch_size] for i in range(0, len(group), batch_size))
+    return batches
+
+
+async def fetch_prices_async(provider: PriceProvider, requests: Iterable[PriceRequest],
+                             batch_size: int = 50) -> PriceRecords:
+    """Разбиение на пакеты и параллельная загрузка; цены нескольких запросов одного тикера объединяются."""
+    requests = list(requests)
+    results: PriceRecords = {}
+    try:
+        parts = await asyncio.gather(*(provider.fetch_batch(b) for b in _batches(requests, batch_size)))
+    finally:
+        await provider.close()
+    for part in parts:
+        for ticker, (dates, closes) in part.items():
+            acc = results.setdefault(ticker, ([], []))
+            acc[0].extend(dates)
+            acc[1].extend(closes)
+    count("price_requests", len(requests))
+    return results
+
+
+def fetch_prices(provider: PriceProvider, requests: Iterable[PriceRequest], batch_size: int = 50) -> PriceRecords:
+    """Синхронная обертка над fetch_prices_async."""
+    return asyncio.run(fetch_prices_async(provider, requests, batch_size))
+
+
+def update_store(provider: PriceProvider, requests: Iterable[PriceRequest], store: "price_store.PriceStore",
+                 batch_size: int = 50, today: Optional[date] = None) -> Tuple["price_store.PriceStore", int]:
+    """
+    Догружает в хранилище только недостающие интервалы. Возвращает (хранилище, число запросов к провайдеру).
+    Покрытыми отмечаются запрошенные дни до вчерашнего включительно: цена сегодняшнего дня еще может измениться.
+    Покрытие отмечается по каждому запросу (пробелу): только если среди полученных цен тикера есть день
+    внутри этого пробела. Пробел без единой цены (сбой, пустой ответ, неизвестный тикер) покрытым
+    не становится и будет запрошен снова при следующем обновлении (пробелы всегда содержат торговые дни).
+    """
+    planned = plan_requests(requests, store)
+    if not planned:
+        return store, 0
+    with span("price_fetch", requests=len(planned)):
+        records = fetch_prices(provider, planned, batch_size)
+    records = {t: data for t, data in records.items() if data[0]}
+    last_final = price_store.to_day((today or date.today()) - timedelta(days=1))
+    covered: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    received = {t: np.sort(price_store.to_days(data[0])) for t, data in records.items()}
+    for req in planned:
+        days = received.get(req.ticker)
+        lo, end = price_store.to_day(req.start), price_store.to_day(req.end)
+        if days is None or np.searchsorted(days, lo) == np.searchsorted(days, end, side="right"):
+            continue
+        hi = min(end, last_final)
+        if lo <= hi:
+            covered[req.ticker].append((lo, hi))
+    with span("price_store_merge", tickers=len(records)):
+        store = store.merge(records, covered)
+    return store, len(planned)
+
+
+# stock_etf_{клиент}_{начало}__{конец}.json
+_STOCK_JSON_RE = re.compile(r"stock_etf_(.+)_(\d{2}\.\d{2}\.\d{4})__(\d{2}\.\d{2}\.\d{4})\.json")
+
+
+def requests_from_dir(data_dir: str) -> List[PriceRequest]:
+    """Запросы по всем stock_etf_*.json в папке (все клиенты пакетного прогона)."""
+    requests = []
+    for path in sorted(glob(os.path.join(data_dir, "stock_etf_*.json"))):
+        m = _STOCK_JSON_RE.fullmatch(os.path.basename(path))
+        if not m:
+            continue
+        start, end = iso_date(m.group(2)), iso_date(m.group(3))
+        with open(path, "r", encoding="utf-8") as f:
+            items = json.load(f).get("items") or []
+        for rec in items:
+            ticker = (rec.get("ticker") or "").strip()
+            if ticker:
+                requests.append(PriceRequest(ticker, start, end))
+    return requests
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Загрузка котировок в локальное хранилище цен")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_fetch = sub.add_parser("fetch", help="Цены для всех stock_etf_*.json в папке")
+    p_fetch.add_argument("--provider", default=os.environ.get(PROVIDER_ENV),
+                         help=f"file:<папка> или http(s)://... (по умолчанию ${PROVIDER_ENV})")
+    p_fetch.add_argument("--dir", default=DATA_WORK, help="Папка с выходами map_instruments")
+    p_fetch.add_argument("--store", default=price_store.PRICES_DIR, help="Папка хранилища цен")
+    p_fetch.add_argument("--batch-size", type=int, default=50)
+    p_fetch.add_argument("--ttl", type=float, default=DEFAULT_TTL_SECONDS, help="TTL дискового кэша, с")
+    p_fetch.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args(argv)
+
+    if not args.provider:
+        console.print(f"[red]❌ Не задан провайдер цен (--provider или {PROVIDER_ENV})[/red]")
+        return 2
+    requests = requests_from_dir(args.dir)
+    unique = len({r.ticker for r in requests})
+    console.print(f"[cyan]💹 Запросов: {len(requests)}, уникальных тикеров: {unique}[/cyan]")
+    provider = make_provider(args.provider, cache=not args.no_cache, ttl_seconds=args.ttl)
+    store, fetched = update_store(provider, requests, price_store.PriceStore.open(args.store), args.batch_size)
+    console.print(f"[green]✅ Запросов к провайдеру: {fetched} (остальное уже в хранилище); "
+                  f"точек в хранилище: {len(store)}[/green]")
+    return 0
+
+
+if __name__ == "__main__":
+    with stage_span("price_fetch"):
+        code = main()
+    sys.exit(code)
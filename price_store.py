@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+price_store.py — локальная история дневных цен закрытия для тикеров акций/ETF.
+
+Формат на диске (dictionaries/prices/):
+  store.json           — манифест: версия, поколение, список тикеров (индекс = tid),
+                         покрытие — для каждого тикера уже запрошенные интервалы дней
+  keys_<gen>.npy       — int64, отсортированные ключи  tid << 32 | день (дни от 1970-01-01)
+  close_<gen>.npy      — float64, цена закрытия для ключа с тем же индексом
+
+Все цены всех тикеров лежат в двух плоских массивах, упорядоченных по (тикер, дата),
+поэтому поиск «цена на дату или в ближайший предыдущий торговый день» для тысяч
+тикеров — один векторный np.searchsorted. Массивы открываются через mmap только
+на чтение: параллельные процессы (render_reports, этапы конвейера) делят одни и те же
+страницы файла. Запись создает новое поколение файлов и атомарно подменяет манифест —
+читатели всегда видят согласованную пару массивов.
+
+Покрытие (coverage) позволяет догружать только пробелы: missing_intervals() вычитает
+покрытые интервалы из запрошенного периода и обрезает остаток по торговому календарю
+(будни без праздников США), так что ежемесячный прогон запрашивает лишь несколько новых дней.
+
+CLI:
+  python price_store.py import prices.csv     — добавить цены (колонки ticker,date,close; date — YYYY-MM-DD или DD.MM.YYYY)
+  python price_store.py info                  — тикеры, число точек, диапазон дат
+  python price_store.py asof 30.09.2025 AAPL MSFT
+"""
+
+import os
+import sys
+import csv
+import json
+import argparse
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from startup import lazy_import
+
+np = lazy_import("numpy")
+holidays = lazy_import("holidays")
+
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+PRICES_DIR = os.path.join(BASE_DIR, "dictionaries", "prices")
+MANIFEST_NAME = "store.json"
+
+STORE_VERSION = 1
+DAY_BITS = 32
+DAY_MASK = (1 << DAY_BITS) - 1
+
+
+def _iso_date(value):
+    """Дата в любом из принятых видов → date или строка 'YYYY-MM-DD' (формат — по самому значению)."""
+    if isinstance(value, str):
+        parts = value.split()
+        # Время после даты ('DD.MM.YYYY HH:MM', 'YYYY-MM-DD HH:MM:SS', 'YYYY-MM-DDTHH:MM:SS') отбрасывается
+        text = parts[0] if parts else ""
+        if "." in text[:6]:
+            if len(text) == 10:
+                return f"{text[6:10]}-{text[3:5]}-{text[0:2]}"
+            return datetime.strptime(text, "%d.%m.%Y").date()
+        return text[:10]
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def to_day(value) -> int:
+    """Дата (date, datetime, 'YYYY-MM-DD' или 'DD.MM.YYYY', в т.ч. со временем) → номер дня от 1970-01-01."""
+    value = _iso_date(value)
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    return (value - date(1970, 1, 1)).days
+
+
+def to_days(values: Iterable):
+    """
+    Векторная версия to_day: список дат → int64-массив дней.
+    Формат определяется для каждого элемента — в одном списке могут быть date, datetime и строки обоих видов.
+    """
+    values = list(values)
+    try:
+        # ISO-строки, date и datetime numpy разбирает сам; 'DD.MM.YYYY' он отвергает целиком
+        return np.asarray(values, dtype="datetime64[D]").astype(np.int64)
+    except ValueError:
+        return np.asarray([_iso_date(v) for v in values], dtype="datetime64[D]").astype(np.int64)
+
+
+def from_day(day: int) -> date:
+    return date.fromordinal(date(1970, 1, 1).toordinal() + int(day))
+
+
+@lru_cache(maxsize=None)
+def _us_holidays(first_year: int, last_year: int):
+    days = holidays.US(years=range(first_year, last_year + 1))
+    return np.asarray(sorted(days), dtype="datetime64[D]")
+
+
+def trading_days(lo: int, hi: int):
+    """Торговые дни в [lo, hi] (номера дней): будни без праздников США."""
+    if hi < lo:
+        return np.empty(0, dtype=np.int64)
+    days = np.arange(lo, hi + 1, dtype=np.int64)
+    mask = np.is_busday(days.astype("datetime64[D]"),
+                        holidays=_us_holidays(from_day(lo).year, from_day(hi).year))
+    return days[mask]
+
+
+def merge_intervals(intervals: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Объединяет пересекающиеся и соседние интервалы дней [lo, hi]."""
+    result: List[Tuple[int, int]] = []
+    for lo, hi in sorted(intervals):
+        if result and lo <= result[-1][1] + 1:
+            result[-1] = (result[-1][0], max(result[-1][1], hi))
+        else:
+            result.append((lo, hi))
+    return result
+
+
+class PriceStore:
+    """
+    Хранилище цен. Чтение — через mmap (read-only), запись — merge() с новым поколением файлов.
+
+        store = PriceStore.open()
+        prices, days = store.as_of(["AAPL", "MSFT"], "30.09.2025")
+    """
+
+    def __init__(self, root: str, tickers: List[str], generation: int, keys, closes,
+                 coverage: Optional[Dict[str, List[Tuple[int, int]]]] = None):
+        self.root = root
+        self.tickers = tickers
+        self.tid = {t: i for i, t in enumerate(tickers)}
+        self.generation = generation
+        self.keys = keys
+        self.closes = closes
+        self.coverage = coverage or {}
+
+    # ---------- Открытие ----------
+
+    @classmethod
+    def open(cls, root: str = PRICES_DIR) -> "PriceStore":
+        """Открывает хранилище только на чтение; если его нет — пустое."""
+        try:
+            with open(os.path.join(root, MANIFEST_NAME), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return cls(root, [], 0, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+        if manifest.get("version") != STORE_VERSION:
+            raise ValueError(f"Неподдерживаемая версия хранилища цен: {manifest.get('version')}")
+        gen = manifest["generation"]
+        keys = np.load(os.path.join(root, f"keys_{gen}.npy"), mmap_mode="r")
+        closes = np.load(os.path.join(root, f"close_{gen}.npy"), mmap_mode="r")
+        coverage = {t: [tuple(iv) for iv in ivs] for t, ivs in (manifest.get("coverage") or {}).items()}
+        return cls(root, list(manifest["tickers"]), gen, keys, closes, coverage)
+
+    def __len__(self) -> int:
+        return int(self.keys.shape[0])
+
+    # ---------- Чтение ----------
+
+    def ticker_ids(self, tickers: Sequence[str]):
+        """Массив tid для тикеров; неизвестным тикерам — -1."""
+        return np.fromiter((self.tid.get(t, -1) for t in tickers), dtype=np.int64, count=len(tickers))
+
+    def as_of(self, tickers: Sequence[str], when, max_lag_days: Optional[int] = None):
+        """
+        Цена каждого тикера на дату when или в ближайший предыдущий день с ценой.
+        Возвращает (цены float64 с NaN, где цены нет; дни цены int64 с -1).
+        max_lag_days — не брать цену старше when на столько дней (защита от «застывших» тикеров).
+        """
+        return self.as_of_many(self.ticker_ids(tickers), np.full(len(tickers), to_day(when), dtype=np.int64),
+                               max_lag_days)
+
+    def as_of_many(self, tids, days, max_lag_days: Optional[int] = None):
+        """
+        Векторный as-of join: для пар (tid[i], day[i]) — цена на день или ближайший предыдущий.
+        tid < 0 — неизвестный тикер. Возвращает (цены с NaN, дни цен с -1), как as_of.
+        """
+        tids = np.asarray(tids, dtype=np.int64)
+        days = np.asarray(days, dtype=np.int64)
+        prices = np.full(tids.shape[0], np.nan)
+        found = np.full(tids.shape[0], -1, dtype=np.int64)
+        known = tids >= 0
+        if not known.any() or len(self) == 0:
+            return prices, found
+
+        wanted = (tids[known] << DAY_BITS) | days[known]
+        idx = np.searchsorted(self.keys, wanted, side="right") - 1
+        found_keys = self.keys[np.clip(idx, 0, None)]
+        ok = (idx >= 0) & ((found_keys >> DAY_BITS) == tids[known])
+        found_days = found_keys & DAY_MASK
+        if max_lag_days is not None:
+            ok &= (days[known] - found_days) <= max_lag_days
+
+        positions = np.flatnonzero(known)[ok]
+        prices[positions] = self.closes[idx[ok]]
+        found[positions] = found_days[ok]
+        return prices, found
+
+    def series(self, ticker: str, start=None, end=None) -> Tuple[object, object]:
+        """(дни, цены) одного тикера в диапазоне [start, end] (границы включительно)."""
+        tid = self.tid.get(ticker)
+        if tid is None:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        lo_day = to_day(start) if start is not None else 0
+        hi_day = to_day(end) if end is not None else DAY_MASK
+        lo = np.searchsorted(self.keys, (tid << DAY_BITS) | lo_day, side="left")
+        hi = np.searchsorted(self.keys, (tid << DAY_BITS) | hi_day, side="right")
+        return self.keys[lo:hi] & DAY_MASK, self.closes[lo:hi]
+
+    def missing_intervals(self, ticker: str, start, end) -> List[Tuple[int, int]]:
+        """
+        Непокрытые интервалы [start, end] тикера (номера дней), обрезанные до торговых дней:
+        интервалы без единого торгового дня (выходные, праздники) не возвращаются.
+        """
+        lo, hi = to_day(start), to_day(end)
+        gaps, cursor = [], lo
+        for c_lo, c_hi in self.coverage.get(ticker, ()):
+            if c_hi < cursor:
+                continue
+            if c_lo > hi:
+                break
+            if c_lo > cursor:
+                gaps.append((cursor, c_lo - 1))
+            cursor = max(cursor, c_hi + 1)
+        if cursor <= hi:
+            gaps.append((cursor, hi))
+
+        result = []
+        for g_lo, g_hi in gaps:
+            days = trading_days(g_lo, g_hi)
+            if days.size:
+                result.append((int(days[0]), int(days[-1])))
+        return result
+
+    # ---------- Запись ----------
+
+    def merge(self, records: Dict[str, Tuple[Iterable, Iterable]],
+              covered: Optional[Dict[str, Iterable[Tuple[int, int]]]] = None) -> "PriceStore":
+        """
+        Добавляет цены {тикер: (даты, цены)}; при совпадении (тикер, дата) побеждает новое значение.
+        covered — запрошенные интервалы дней {тикер: [(lo, hi), ...]}, включая тикеры без цен;
+        если не задано, покрытием записи считается интервал от ее первой до последней даты.
+        Пишет новое поколение файлов, атомарно подменяет манифест и возвращает открытое хранилище.
+        """
+        tickers = list(self.tickers)
+        tid = dict(self.tid)
+        coverage = dict(self.coverage)
+        new_keys, new_closes = [], []
+        for ticker, (dates, closes) in records.items():
+            if ticker not in tid:
+                tid[ticker] = len(tickers)
+                tickers.append(ticker)
+            day_arr = to_days(dates)
+            close_arr = np.asarray(list(closes), dtype=np.float64)
+            if day_arr.shape != close_arr.shape:
+                raise ValueError(f"{ticker}: число дат и цен не совпадает")
+            new_keys.append((tid[ticker] << DAY_BITS) | day_arr)
+            new_closes.append(close_arr)
+            if covered is None and day_arr.size:
+                coverage[ticker] = merge_intervals(coverage.get(ticker, []) + [(int(day_arr.min()), int(day_arr.max()))])
+        for ticker, intervals in (covered or {}).items():
+            coverage[ticker] = merge_intervals(coverage.get(ticker, []) + [tuple(iv) for iv in intervals])
+
+        if not new_keys:
+            if coverage == self.coverage:
+                return self
+            # Новых цен нет (например, тикер не торговался) — меняется только манифест
+            return self._write_manifest(tickers, self.generation, len(self), coverage)
+        # Новые записи идут первыми: после стабильной сортировки unique оставит их при дублях ключа
+        keys = np.concatenate(new_keys + [np.asarray(self.keys)])
+        closes = np.concatenate(new_closes + [np.asarray(self.closes)])
+        order = np.argsort(keys, kind="stable")
+        keys, closes = keys[order], closes[order]
+        keys, first = np.unique(keys, return_index=True)
+        closes = closes[first]
+        return self._write(tickers, keys, closes, coverage)
+
+    def _write(self, tickers: List[str], keys, closes, coverage: Dict[str, List[Tuple[int, int]]]) -> "PriceStore":
+        os.makedirs(self.root, exist_ok=True)
+        gen = self.generation + 1
+        np.save(os.path.join(self.root, f"keys_{gen}.npy"), keys.astype(np.int64, copy=False))
+        np.save(os.path.join(self.root, f"close_{gen}.npy"), closes.astype(np.float64, copy=False))
+        store = self._write_manifest(tickers, gen, int(keys.shape[0]), coverage)
+        self._remove_old_generations(keep=(gen - 1, gen))
+        return store
+
+    def _write_manifest(self, tickers: List[str], gen: int, points: int,
+                        coverage: Dict[str, List[Tuple[int, int]]]) -> "PriceStore":
+        if gen == 0:
+            # Пустое хранилище без цен: сохраняем пустые массивы, чтобы open() нашел поколение
+            return self._write(tickers, np.empty(0, dtype=np.int64), np.empty(0), coverage)
+        manifest = {"version": STORE_VERSION, "generation": gen, "tickers": tickers, "points": points,
+                    "coverage": {t: [list(iv) for iv in ivs] for t, ivs in coverage.items()},
+                    "updated": datetime.now().isoformat(timespec="seconds")}
+        tmp = os.path.join(self.root, MANIFEST_NAME + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.root, MANIFEST_NAME))
+        return PriceStore.open(self.root)
+
+    def _remove_old_generations(self, keep: Tuple[int, ...]) -> None:
+        """Удаляет поколения старше предыдущего (предыдущее могут еще читать открытые процессы)."""
+        for name in os.listdir(self.root):
+            stem, ext = os.path.splitext(name)
+            if ext != ".npy" or "_" not in stem:
+                continue
+            try:
+                gen = int(stem.rsplit("_", 1)[1])
+            except ValueError:
+                continue
+            if gen not in keep:
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except OSError:
+                    pass
+
+
+def read_price_csv(path: str) -> Dict[str, Tuple[List[str], List[float]]]:
+    """CSV с колонками ticker,date,close → {тикер: (даты, цены)}."""
+    records: Dict[str, Tuple[List[str], List[float]]] = {}
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            dates, closes = records.setdefault(row["ticker"].strip(), ([], []))
+            dates.append(row["date"])
+            closes.append(float(row["close"]))
+    return records
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Локальная история цен акций/ETF")
+    parser.add_argument("--root", default=PRICES_DIR, help="Папка хранилища")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_imp = sub.add_parser("import", help="Добавить цены из CSV (ticker,date,close)")
+    p_imp.add_argument("csv", nargs="+")
+    sub.add_parser("info", help="Сводка по хранилищу")
+    p_asof = sub.add_parser("asof", help="Цены на дату (или предыдущий торговый день)")
+    p_asof.add_argument("date")
+    p_asof.add_argument("tickers", nargs="+")
+    args = parser.parse_args(argv)
+
+    store = PriceStore.open(args.root)
+    if args.command == "import":
+        for path in args.csv:
+            records = read_price_csv(path)
+            store = store.merge(records)
+            print(f"{path}: тикеров {len(records)}, всего точек в хранилище {len(store)}")
+        return 0
+
+    if args.command == "info":
+        if not len(store):
+            print(f"Хранилище пусто: {args.root}")
+            return 1
+        days = np.asarray(store.keys) & DAY_MASK
+        print(f"Тикеров: {len(store.tickers)}; точек: {len(store)}; "
+              f"даты: {from_day(days.min()):%d.%m.%Y} — {from_day(days.max()):%d.%m.%Y}")
+        return 0
+
+    prices, days = store.as_of(args.tickers, args.date)
+    for ticker, price, day in zip(args.tickers, prices, days):
+        when = f"{from_day(day):%d.%m.%Y}" if day >= 0 else "—"
+        print(f"{ticker:<12} {price:>14.4f}  {when}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
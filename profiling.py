@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+profiling.py — встроенное профилирование любого этапа.
+
+Флаги точек входа (и main.py, который пробрасывает их в запускаемые этапы):
+  --profile            cProfile: logs/profiles/<метка>.prof + топ-N горячих функций в <метка>.txt
+  --profile-memory     tracemalloc: пик памяти и топ мест выделения в <метка>_memory.txt
+  --profile-top N      размер топа (по умолчанию 30)
+
+Метка: <этап>_<клиент>_<начало>__<конец>_<YYYYMMDD_HHMMSS> — клиент и период берутся
+из Data_work/name_clients.json и report_dates.json, если они уже есть.
+
+CLI сравнения медленного и обычного запуска:
+  python profiling.py compare logs/profiles/slow.prof logs/profiles/normal.prof [--top 20]
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Optional
+
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", os.path.dirname(os.path.abspath(__file__)))
+DATA_WORK = os.path.join(BASE_DIR, "Data_work")
+PROFILES_DIR = os.path.join(BASE_DIR, "logs", "profiles")
+
+DEFAULT_TOP = 30
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Добавляет флаги профилирования в парсер точки входа."""
+    group = parser.add_argument_group("профилирование")
+    group.add_argument("--profile", action="store_true",
+                       help="Профилировать этап cProfile (logs/profiles/*.prof + топ функций)")
+    group.add_argument("--profile-memory", action="store_true",
+                       help="Замерить пик памяти и места выделения (tracemalloc)")
+    group.add_argument("--profile-top", type=int, default=DEFAULT_TOP, metavar="N",
+                       help=f"Размер топа в отчёте (по умолчанию {DEFAULT_TOP})")
+
+
+def options_from_argv(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Достаёт флаги профилирования из argv, не мешая собственному парсеру модуля."""
+    parser = argparse.ArgumentParser(add_help=False)
+    add_arguments(parser)
+    options, _ = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+    return options
+
+
+def forwarded_args(options: argparse.Namespace) -> List[str]:
+    """Флаги для дочерних этапов (используется конвейером)."""
+    args = []
+    if options.profile:
+        args.append("--profile")
+    if options.profile_memory:
+        args.append("--profile-memory")
+    if (options.profile or options.profile_memory) and options.profile_top != DEFAULT_TOP:
+        args += ["--profile-top", str(options.profile_top)]
+    return args
+
+
+def _read_json(name: str) -> dict:
+    try:
+        with open(os.path.join(DATA_WORK, name), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def profile_label(stage: str) -> str:
+    """Метка профиля: этап, клиент и период (если известны) и время запуска."""
+    client = (_read_json("name_clients.json").get("client_name") or "").strip()
+    dates = _read_json("report_dates.json")
+    parts = [stage]
+    if client:
+        parts.append(client)
+    if dates.get("start_date") and dates.get("end_date"):
+        parts.append(f"{dates['start_date']}__{dates['end_date']}")
+    parts.append(datetime.now().strftime("%Y%m%d_%H%M%S"))
+    # Только безопасные для имени файла символы (кириллица сохраняется)
+    return re.sub(r"[^\w.\-]+", "_", "_".join(parts))
+
+
+def _write_cpu_report(profiler, label: str, top: int) -> str:
+    import io
+    import pstats
+
+    prof_path = os.path.join(PROFILES_DIR, f"{label}.prof")
+    profiler.dump_stats(prof_path)
+    buf = io.StringIO()
+    stats = pstats.Stats(profiler, stream=buf)
+    stats.sort_stats("cumulative").print_stats(top)
+    stats.sort_stats("tottime").print_stats(top)
+    with open(os.path.join(PROFILES_DIR, f"{label}.txt"), "w", encoding="utf-8") as f:
+        f.write(buf.getvalue())
+    return prof_path
+
+
+def _write_memory_report(snapshot, peak: int, label: str, top: int) -> str:
+    path = os.path.join(PROFILES_DIR, f"{label}_memory.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"Пик памяти (tracemalloc): {peak / 1024 / 1024:.2f} МБ\n\n")
+        f.write(f"Топ-{top} мест выделения:\n")
+        for i, stat in enumerate(snapshot.statistics("lineno")[:top], 1):
+            frame = stat.traceback[0]
+            f.write(f"{i:3d}. {stat.size / 1024:10.1f} КБ {stat.count:8d} блоков  {frame.filename}:{frame.lineno}\n")
+    return path
+
+
+@contextmanager
+def profile_stage(stage: str, options: Optional[argparse.Namespace] = None):
+    """
+    Оборачивает этап в cProfile и/или tracemalloc согласно флагам.
+    Без флагов ничего не делает (нулевая стоимость).
+    """
+    options = options or options_from_argv()
+    if not (options.profile or options.profile_memory):
+        yield
+        return
+
+    import cProfile
+    import tracemalloc
+
+    profiler = cProfile.Profile() if options.profile else None
+    if options.profile_memory:
+        tracemalloc.start(25)
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+        snapshot, peak = None, 0
+        if options.profile_memory:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        label = profile_label(stage)
+        if profiler:
+            path = _write_cpu_report(profiler, label, options.profile_top)
+            print(f"[profile] cProfile: {path}", file=sys.stderr)
+        if snapshot is not None:
+            path = _write_memory_report(snapshot, peak, label, options.profile_top)
+            print(f"[profile] пик памяти {peak / 1024 / 1024:.2f} МБ: {path}", file=sys.stderr)
+
+
+def compare_profiles(slow_path: str, normal_path: str, top: int = 20) -> List[tuple]:
+    """Возвращает [(функция, cumtime_slow, cumtime_normal, разница)] по убыванию разницы."""
+    import pstats
+
+    def _cumtimes(path: str) -> dict:
+        stats = pstats.Stats(path).stats
+        return {f"{fn}:{line}({name})": entry[3] for (fn, line, name), entry in stats.items()}
+
+    slow, normal = _cumtimes(slow_path), _cumtimes(normal_path)
+    rows = [(func, t, normal.get(func, 0.0), t - normal.get(func, 0.0)) for func, t in slow.items()]
+    rows.sort(key=lambda r: r[3], reverse=True)
+    return rows[:top]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Работа с профилями этапов")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_cmp = sub.add_parser("compare", help="Сравнить медленный запуск с обычным")
+    p_cmp.add_argument("slow")
+    p_cmp.add_argument("normal")
+    p_cmp.add_argument("--top", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    print(f"{'медленный, с':>12} {'обычный, с':>12} {'разница, с':>12}  функция")
+    for func, slow_t, normal_t, delta in compare_profiles(args.slow, args.normal, args.top):
+        print(f"{slow_t:>12.4f} {normal_t:>12.4f} {delta:>+12.4f}  {func}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+render_reports.py — параллельная сборка отчетов «портфель_*.xlsx» для многих клиентов.
+
+Задание (job) — словарь:
+  {"client": "Иванов И.И.", "period": {"start_date": "...", "end_date": "..."},
+   "mapped": {"stocks": [...], "bonds": [...], "sp": [...], "prices": [...], "bond_metrics": [...], "risk": [...], "exposure": [...], "delta": [...]}}  — данные целиком, или
+   "mapped_paths": {"stocks": "...json", ...} — пути к выходам map_instruments и этапа цен.
+
+render_reports() распределяет задания по пулу процессов. Одновременно в работе не больше
+max_in_flight заданий (по умолчанию 2 × число процессов), поэтому память не растет с числом
+клиентов. Каждый отчет пишется во временный файл и переименовывается (os.replace) —
+недописанный файл никогда не появится под итоговым именем.
+
+CLI (собирает задания по выходам map_instruments в папке):
+  python render_reports.py [--dir Data_work] [--out Data_work] [--workers N] [--max-in-flight M]
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from glob import glob
+from typing import Dict, Iterable, List, Optional
+
+import template_creator
+from startup import console, ensure_dependencies
+from instrumentation import count, span, stage_span
+from profiling import add_arguments as add_profile_arguments, profile_stage
+
+BASE_DIR = template_creator.BASE_DIR
+DATA_WORK = os.path.join(BASE_DIR, "Data_work")
+
+# stock_etf_{клиент}_{начало}__{конец}.json (аналогично bonds_, sp_, prices_, bond_metrics_, risk_, exposure_ и delta_)
+_MAPPED_NAME_RE = re.compile(r"(stock_etf|bonds|sp|prices|bond_metrics|risk|exposure|delta)_(.+)_(\d{2}\.\d{2}\.\d{4})__(\d{2}\.\d{2}\.\d{4})\.json")
+
+
+def _render_job(job: dict, out_dir: str) -> dict:
+    """Выполняется в дочернем процессе: собирает один отчет и возвращает сводку с временем."""
+    started = time.perf_counter()
+    client, period = job["client"], job["period"]
+    mapped = job.get("mapped")
+    if mapped is None:
+        mapped = {kind: template_creator.load_mapped_items(path)
+                  for kind, path in (job.get("mapped_paths") or {}).items()}
+    filename = template_creator.get_output_filename({"client_name": client}, period)
+    output_path = os.path.join(out_dir, filename)
+    rows = template_creator.build_sheet_rows(mapped, period)
+    # Skeleton кэшируется в памяти процесса: компиляция — один раз на процесс пула
+    template_creator.get_skeleton().render(output_path, rows)
+    return {
+        "client": client,
+        "output": output_path,
+        "instruments": sum(len(mapped.get(kind) or ()) for kind in template_creator.INSTRUMENT_KINDS),
+        "seconds": time.perf_counter() - started,
+        "pid": os.getpid(),
+    }
+
+
+def render_reports(
+    jobs: Iterable[dict],
+    out_dir: str = DATA_WORK,
+    workers: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+) -> List[dict]:
+    """
+    Собирает отчеты по заданиям в пуле процессов.
+    Возвращает сводки в порядке завершения: {"client","output","instruments","seconds","pid"}
+    или {"client","error","seconds"} для упавших заданий (остальные продолжают выполняться).
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max(max_in_flight or 2 * workers, 1)
+    os.makedirs(out_dir, exist_ok=True)
+    # Компилируем skeleton заранее, чтобы процессы пула сразу читали готовый файл
+    template_creator.get_skeleton()
+
+    results: List[dict] = []
+    pending = iter(jobs)
+    running: Dict = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            while len(running) < max_in_flight:
+                job = next(pending, None)
+                if job is None:
+                    break
+                running[pool.submit(_render_job, job, out_dir)] = (job["client"], time.perf_counter())
+            if not running:
+                break
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for fut in finished:
+                client, submitted = running.pop(fut)
+                try:
+                    result = fut.result()
+                    count("reports_rendered")
+                except Exception as e:
+                    result = {"client": client, "error": f"{type(e).__name__}: {e}",
+                              "seconds": time.perf_counter() - submitted}
+                    count("reports_failed")
+                results.append(result)
+    return results
+
+
+def collect_jobs(data_dir: str) -> List[dict]:
+    """Задания по выходам map_instruments в папке: одно задание на пару (клиент, период)."""
+    jobs: Dict[tuple, dict] = {}
+    kinds = {prefix: kind for kind, prefix in template_creator.MAPPED_KINDS.items()}
+    for path in sorted(glob(os.path.join(data_dir, "*.json"))):
+        m = _MAPPED_NAME_RE.fullmatch(os.path.basename(path))
+        if not m:
+            continue
+        prefix, client, start, end = m.groups()
+        job = jobs.setdefault((client, start, end), {
+            "client": client,
+            "period": {"start_date": start, "end_date": end},
+            "mapped_paths": {},
+        })
+        job["mapped_paths"][kinds[prefix]] = path
+    return list(jobs.values())
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Параллельная сборка отчетов для многих клиентов")
+    parser.add_argument("--dir", default=DATA_WORK, help="Папка с выходами map_instruments")
+    parser.add_argument("--out", help="Куда писать отчеты (по умолчанию — та же папка)")
+    parser.add_argument("--workers", type=int, help="Число процессов (по умолчанию — число ядер)")
+    parser.add_argument("--max-in-flight", type=int, help="Максимум заданий в работе одновременно")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    jobs = collect_jobs(args.dir)
+    if not jobs:
+        console.print(f"[yellow]⚠️ В {args.dir} нет выходов map_instruments (stock_etf_/bonds_/sp_/prices_*.json)[/yellow]")
+        return 1
+
+    workers = args.workers or os.cpu_count() or 1
+    console.print(f"[bold cyan]🖨  Сборка отчетов: {len(jobs)} клиентов, процессов: {workers}[/bold cyan]")
+    started = time.perf_counter()
+    with span("render_reports", jobs=len(jobs), workers=workers):
+        results = render_reports(jobs, args.out or args.dir, workers, args.max_in_flight)
+    wall = time.perf_counter() - started
+
+    failed = [r for r in results if "error" in r]
+    for r in sorted(results, key=lambda r: r["client"]):
+        if "error" in r:
+            console.print(f"[red]❌ {r['client']}: {r['error']}[/red]")
+        else:
+            console.print(f"[green]✔[/green] {r['client']:<30} {r['instruments']:>7} инстр. "
+                          f"{r['seconds'] * 1000:>9.1f} мс [grey50](pid {r['pid']})[/grey50]")
+    busy = sum(r["seconds"] for r in results)
+    console.print(f"[grey50]⏱  Время: {wall:.2f} с (сумма по заданиям {busy:.2f} с); "
+                  f"готово {len(results) - len(failed)}, ошибок {len(failed)}[/grey50]")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    if not ensure_dependencies(template_creator.REQUIRED_MODULES):
+        sys.exit(1)
+    with stage_span("render_reports"), profile_stage("render_reports"):
+        sys.exit(main())
@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+returns.py — доходность портфеля с учетом движения средств: TWR (дневные звенья) и MWR (IRR).
+
+Изменение цены от начала к концу периода искажается покупками и продажами посреди периода,
+поэтому этап берет сделки клиента из листа операций отчета (Data_in/отчет_*.xlsx, лист
+«сделки» / «операции» / «движение средств»; столбцы Дата, ISIN, Количество, Сумма, Валюта, Тип)
+и пишет их в transactions_{клиент}_{начало}__{конец}.json. Лист читается потоково
+(openpyxl read_only + values_only, как справочники в map_instruments).
+
+Портфель — бумаги клиента (stock_etf_*.json с количеством на конец периода). Количества на каждый
+торговый день восстанавливаются назад от конечных по сделкам, стоимость — цены из price_store и
+курсы fx.py в базовой валюте клиента. Покупка — приток в портфель, продажа — отток (по сумме сделки,
+а без суммы — по цене дня). Ввод/вывод денег без ISIN на стоимость бумаг не влияет и показывается
+отдельно (net_deposits).
+
+  TWR = Π (V_d − CF_d) / V_{d−1} − 1 — по всем торговым дням периода;
+  MWR — ставка g, при которой V_0·e^{g·τ_0} + Σ CF_k·e^{g·τ_k} = V_end (τ — лет до конца периода);
+        в отчет идут за период (e^{g·T} − 1) и годовая (e^g − 1).
+
+Все клиенты и периоды считаются одним пакетом: дневные сетки — строки одной матрицы
+(клиент × день), цены — один as-of join по уникальным инструментам на все дни, стоимость
+счетов — bincount по позициям для каждого дня, IRR — пакетный метод Ньютона сразу для всех.
+
+CLI / этап returns (все stock_etf_*.json в папке; сделки — из transactions_*.json):
+  python returns.py [--dir Data_work] [--report Data_in/отчет_….xlsx]
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+from dataclasses import dataclass
+from datetime import date, datetime
+from glob import glob
+from typing import Dict, List, Optional, Tuple
+
+from startup import console, ensure_dependencies, lazy_import
+from instrumentation import count, span, stage_span
+from profiling import add_arguments as add_profile_arguments, profile_stage
+from extract_isin import normalize_sheet_name, parse_quantity
+import price_store
+import fx
+
+np = lazy_import("numpy")
+openpyxl = lazy_import("openpyxl")
+
+REQUIRED_MODULES = ["rich", "numpy", "openpyxl"]
+
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+DATA_IN = os.path.join(BASE_DIR, "Data_in")
+DATA_WORK = os.path.join(BASE_DIR, "Data_work")
+REFERENCE_CACHE_JSON = os.path.join(DATA_WORK, "cache", "references.json")
+
+# Цена старше дня оценки больше чем на столько дней считается отсутствующей
+MAX_PRICE_LAG_DAYS = 7
+
+# Лист операций и его столбцы (заголовки сравниваются casefold+strip)
+TRANSACTION_SHEETS = ("сделки", "операции", "движение средств", "движение денежных средств", "транзакции")
+TRANSACTION_COLUMNS = {
+    "date": ("дата", "дата операции", "дата сделки", "date"),
+    "isin": ("isin",),
+    "ticker": ("тикер", "ticker"),
+    "quantity": ("количество", "кол-во", "quantity"),
+    "amount": ("сумма", "сумма сделки", "amount"),
+    "currency": ("валюта", "currency"),
+    "type": ("тип", "вид операции", "операция", "type"),
+}
+# Тип операции без знака в количестве/сумме → знак
+_NEGATIVE_TYPES = ("прод", "вывод", "списан", "sell", "withdraw")
+_POSITIVE_TYPES = ("пок", "ввод", "зачисл", "buy", "deposit")
+
+# Флаги результата (битовая маска)
+NO_VALUE = 1            # нет стоимости портфеля ни в один день
+MISSING_PRICE = 2       # у части позиций нет цены или курса в какие-то дни (считаются нулем)
+UNPRICED_TRADE = 4      # сделки по бумагам без тикера/цены не учтены
+NOT_CONVERGED = 8       # IRR не сошелся
+FLAG_NAMES = {NO_VALUE: "no_value", MISSING_PRICE: "missing_price",
+              UNPRICED_TRADE: "unpriced_trade", NOT_CONVERGED: "mwr_not_converged"}
+
+# stock_etf_{клиент}_{начало}__{конец}.json (аналогично transactions_ и isin_)
+_NAME_RE = r"_(.+)_(\d{2}\.\d{2}\.\d{4})__(\d{2}\.\d{2}\.\d{4})\.json"
+_STOCK_JSON_RE = re.compile("stock_etf" + _NAME_RE)
+_ISIN_JSON_RE = re.compile("isin" + _NAME_RE)
+
+
+# ---------- Чтение листа операций ----------
+
+def _parse_date(value) -> Optional[str]:
+    """Ячейка даты (datetime/date или строка DD.MM.YYYY / YYYY-MM-DD) → 'DD.MM.YYYY'; иначе None."""
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        return f"{value:%d.%m.%Y}"
+    text = str(value or "").strip()[:10]
+    for fmt in ("%d.%m.%Y", "%Y-%m-%d"):
+        try:
+            return f"{datetime.strptime(text, fmt):%d.%m.%Y}"
+        except ValueError:
+            continue
+    return None
+
+
+def _signed(value: Optional[float], kind: str) -> Optional[float]:
+    """Знак по типу операции, если он задан словами (продажа/вывод — минус)."""
+    if value is None:
+        return None
+    if any(word in kind for word in _NEGATIVE_TYPES):
+        return -abs(value)
+    if any(word in kind for word in _POSITIVE_TYPES):
+        return abs(value)
+    return value
+
+
+def read_transactions(xlsx_path: str) -> List[dict]:
+    """
+    Операции из листа отчета (потоково): [{"date","isin","ticker","quantity","amount","currency","type"}].
+    Сделки — строки с ISIN (количество: + покупка, − продажа), ввод/вывод — без ISIN (сумма: + ввод).
+    Листа нет — пустой список.
+    """
+    wb = openpyxl.load_workbook(xlsx_path, read_only=True, data_only=True)
+    try:
+        sheets = {normalize_sheet_name(name): name for name in wb.sheetnames}
+        name = next((sheets[s] for s in TRANSACTION_SHEETS if s in sheets), None)
+        if name is None:
+            return []
+        rows = wb[name].iter_rows(values_only=True)
+        header = [str(v or "").strip().casefold() for v in next(rows, ())]
+        cols = {key: next((i for i, h in enumerate(header) if h in names), None)
+                for key, names in TRANSACTION_COLUMNS.items()}
+        if cols["date"] is None:
+            return []
+
+        def cell(row, key):
+            i = cols[key]
+            return row[i] if i is not None and i < len(row) else None
+
+        result = []
+        for row in rows:
+            day = _parse_date(cell(row, "date"))
+            if not day:
+                continue
+            kind = str(cell(row, "type") or "").strip().casefold()
+            result.append({
+                "date": day,
+                "isin": str(cell(row, "isin") or "").strip().upper(),
+                "ticker": str(cell(row, "ticker") or "").strip(),
+                "quantity": _signed(parse_quantity(cell(row, "quantity")), kind),
+                "amount": _signed(parse_quantity(cell(row, "amount")), kind),
+                "currency": fx.normalize_currency(cell(row, "currency")),
+                "type": kind,
+            })
+        count("transactions_read", len(result))
+        return result
+    finally:
+        wb.close()
+
+
+# ---------- Расчет ----------
+
+@dataclass
+class Returns:
+    """Результат по счетам: все поля — numpy-массивы длины «число счетов»."""
+    start_value: "np.ndarray"
+    end_value: "np.ndarray"
+    net_flows: "np.ndarray"       # сумма покупок − продаж за период (в базовой валюте)
+    net_deposits: "np.ndarray"    # ввод − вывод денег за период (в базовой валюте)
+    twr: "np.ndarray"
+    mwr: "np.ndarray"             # за период
+    mwr_annualized: "np.ndarray"
+    days: "np.ndarray"            # число дней оценки (торговые дни + границы периода)
+    flags: "np.ndarray"
+
+    def __len__(self) -> int:
+        return int(self.flags.shape[0])
+
+    def flag_names(self, i: int) -> List[str]:
+        return [name for bit, name in FLAG_NAMES.items() if self.flags[i] & bit]
+
+
+def solve_irr(amounts, taus, end_values, iterations: int = 50, tol: float = 1e-10):
+    """
+    Пакетный Ньютон: для каждой строки g, при котором Σ amounts·e^{g·taus} = end_values.
+    amounts, taus — матрицы (счет × день); возвращает (g, сошлось).
+    """
+    g = np.zeros(amounts.shape[0])
+    scale = np.abs(amounts).sum(axis=1) + np.abs(end_values)
+    done = scale == 0
+    for _ in range(iterations):
+        growth = np.exp(np.clip(g[:, None] * taus, -50.0, 50.0))
+        f = (amounts * growth).sum(axis=1) - end_values
+        slope = (amounts * taus * growth).sum(axis=1)
+        done |= np.abs(f) <= tol * scale
+        if done.all():
+            break
+        with np.errstate(divide="ignore", invalid="ignore"):
+            step = np.where(done | (slope == 0), 0.0, f / slope)
+        g -= np.clip(step, -1.0, 1.0)
+    return g, done & (scale > 0)
+
+
+def compute_returns(store: "price_store.PriceStore", rates: "fx.FxRates", accounts: List[dict],
+                    max_lag_days: Optional[int] = MAX_PRICE_LAG_DAYS) -> Returns:
+    """
+    TWR и MWR для пакета счетов. Счет:
+      {"start_date","end_date","base_currency",
+       "positions": [{"isin","ticker","quantity","currency"}]      — на конец периода,
+       "transactions": [{"date","isin","ticker","quantity","amount","currency"}],
+       "tickers": {ISIN: тикер}}                                    — для проданных целиком (необязательно)
+    Цены и курсы считаются по уникальным инструментам (тикер, валюта) на объединение дней всех
+    счетов; стоимость счетов — bincount по позициям для каждого дня сетки, без матриц позиция × день.
+    """
+    n = len(accounts)
+    starts = price_store.to_days([a["start_date"] for a in accounts]) if n else np.empty(0, np.int64)
+    ends = price_store.to_days([a["end_date"] for a in accounts]) if n else np.empty(0, np.int64)
+    bases = [fx.normalize_currency(a.get("base_currency")) or fx.DEFAULT_BASE_CURRENCY for a in accounts]
+
+    # ---------- Сетки дней: строка матрицы на счет, хвост дополнен последним днем ----------
+    periods: Dict[Tuple[int, int], "np.ndarray"] = {}
+    for s, e in set(zip(starts.tolist(), ends.tolist())):
+        periods[s, e] = np.union1d([s, e], price_store.trading_days(s, e))
+    grids = [periods[s, e] for s, e in zip(starts.tolist(), ends.tolist())]
+    lengths = np.array([g.size for g in grids], dtype=np.int64)
+    width = int(lengths.max()) if n else 1
+    grid = np.empty((n, width), dtype=np.int64)
+    for c, g in enumerate(grids):
+        grid[c, :g.size] = g
+        grid[c, g.size:] = g[-1]
+    valid = np.arange(width)[None, :] < lengths[:, None]
+    all_days = np.unique(grid)
+    col = np.searchsorted(all_days, grid)            # день сетки счета → столбец общих рядов
+
+    # ---------- Позиции и сделки → индексы уникальных инструментов (тикер, валюта) ----------
+    instruments: Dict[Tuple[str, str], int] = {}
+
+    def instrument(ticker: str, currency: str) -> int:
+        return instruments.setdefault(((ticker or "").strip(), currency or ""), len(instruments))
+
+    pos_client, pos_inst, pos_qty = [], [], []
+    tr_client, tr_inst, tr_date, tr_qty, tr_amount, tr_ccy = [], [], [], [], [], []
+    ex_client, ex_date, ex_amount, ex_ccy = [], [], [], []
+    for c, acc in enumerate(accounts):
+        held: Dict[str, int] = {}
+        for pos in acc.get("positions") or ():
+            if pos.get("quantity") is None:
+                continue
+            held[pos["isin"]] = instrument(pos.get("ticker"), pos.get("currency"))
+            pos_client.append(c)
+            pos_inst.append(held[pos["isin"]])
+            pos_qty.append(float(pos["quantity"]))
+        tickers = acc.get("tickers") or {}
+        for tx in acc.get("transactions") or ():
+            if not tx.get("isin"):
+                if tx.get("amount") is not None:
+                    ex_client.append(c)
+                    ex_date.append(tx["date"])
+                    ex_amount.append(tx["amount"])
+                    ex_ccy.append(tx.get("currency") or bases[c])
+                continue
+            if tx.get("quantity") is None:
+                continue
+            inst = held.get(tx["isin"])
+            if inst is None:
+                # Бумага продана целиком до конца периода: в конце 0, тикер — из сделки или справочника
+                inst = held[tx["isin"]] = instrument(tx.get("ticker") or tickers.get(tx["isin"]), tx.get("currency"))
+            tr_client.append(c)
+            tr_inst.append(inst)
+            tr_date.append(tx["date"])
+            tr_qty.append(float(tx["quantity"]))
+            tr_amount.append(np.nan if tx.get("amount") is None else float(tx["amount"]))
+            tr_ccy.append(tx.get("currency") or "")
+
+    # ---------- Ряды: цена инструмента в USD и курс базовой валюты на все дни ----------
+    inst_keys = list(instruments)
+    with span("returns_prices", instruments=len(inst_keys), days=int(all_days.size)):
+        tids = store.ticker_ids([t for t, _ in inst_keys])
+        k = all_days.size
+        prices, _ = store.as_of_many(np.repeat(tids, k), np.tile(all_days, len(inst_keys)), max_lag_days)
+        usd = {code: rates.series(code, all_days, max_lag_days)
+               for code in {fx.normalize_currency(ccy) for _, ccy in inst_keys} | set(bases)}
+        inst_usd = prices.reshape(len(inst_keys), k) if inst_keys else np.empty((0, k))
+        for i, (_, ccy) in enumerate(inst_keys):
+            inst_usd[i] *= usd[fx.normalize_currency(ccy)]
+        base_usd = np.empty((n, width))
+        for c, b in enumerate(bases):
+            base_usd[c] = usd[b][col[c]]
+
+    # ---------- Сделки: день сетки (первый ≥ дня сделки), только внутри периода ----------
+    tr_client = np.asarray(tr_client, dtype=np.int64)
+    tr_inst = np.asarray(tr_inst, dtype=np.int64)
+    tr_day = price_store.to_days(tr_date) if tr_date else np.empty(0, np.int64)
+    tr_qty = np.asarray(tr_qty, dtype=np.float64)
+    tr_amount = np.asarray(tr_amount, dtype=np.float64)
+    inside = (tr_day >= starts[tr_client]) & (tr_day <= ends[tr_client]) if tr_client.size else np.zeros(0, bool)
+    tr_priced = tids[tr_inst] >= 0 if tr_inst.size else np.zeros(0, bool)
+    unpriced = tr_client[inside & ~tr_priced]
+    keep = np.flatnonzero(inside & tr_priced)
+    tr_client, tr_inst, tr_day = tr_client[keep], tr_inst[keep], tr_day[keep]
+    tr_qty, tr_amount = tr_qty[keep], tr_amount[keep]
+    tr_ccy = [tr_ccy[i] for i in keep]
+    flat_keys = ((np.arange(n, dtype=np.int64)[:, None] << price_store.DAY_BITS) | grid).reshape(-1)
+    tr_k = np.searchsorted(flat_keys, (tr_client << price_store.DAY_BITS) | tr_day) - tr_client * width
+
+    # ---------- Стоимость по дням: V = Σ q_конец·P − Σ (сделки позже дня)·P ----------
+    pos_client = np.asarray(pos_client, dtype=np.int64)
+    pos_inst = np.asarray(pos_inst, dtype=np.int64)
+    pos_qty = np.asarray(pos_qty, dtype=np.float64)
+    values = np.zeros((n, width))
+    gaps = np.zeros(n, dtype=bool)
+    with span("returns_valuation", accounts=n, positions=int(pos_client.size), trades=int(tr_client.size)):
+        for d in range(width):
+            unit = inst_usd[pos_inst, col[pos_client, d]]
+            missing = np.isnan(unit) & (pos_qty != 0)
+            gaps[pos_client[missing]] = True
+            values[:, d] = np.bincount(pos_client, weights=np.where(missing, 0.0, pos_qty * np.nan_to_num(unit)),
+                                       minlength=n)
+            later = tr_k > d
+            if later.any():
+                unit = inst_usd[tr_inst[later], col[tr_client[later], d]]
+                values[:, d] -= np.bincount(tr_client[later], weights=tr_qty[later] * np.nan_to_num(unit),
+                                            minlength=n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = np.where(valid, values / base_usd, 0.0)
+    gaps |= np.isnan(values).any(axis=1)
+    values = np.nan_to_num(values)
+
+    # ---------- Потоки: сделки по сумме (в базовой валюте), без суммы — по цене дня ----------
+    with np.errstate(invalid="ignore", divide="ignore"):
+        tr_fx = rates.cross(tr_ccy, [bases[c] for c in tr_client], tr_day, max_lag_days)
+        by_amount = np.sign(tr_qty) * np.abs(tr_amount) * tr_fx
+        by_price = tr_qty * inst_usd[tr_inst, col[tr_client, tr_k]] / base_usd[tr_client, tr_k]
+        tr_flow = np.where(np.isnan(tr_amount) | np.isnan(tr_fx), by_price, by_amount)
+    flows = np.zeros((n, width))
+    np.add.at(flows, (tr_client, tr_k), np.nan_to_num(tr_flow))
+
+    ex_client = np.asarray(ex_client, dtype=np.int64)
+    ex_day = price_store.to_days(ex_date) if ex_date else np.empty(0, np.int64)
+    ex_inside = (ex_day >= starts[ex_client]) & (ex_day <= ends[ex_client]) if ex_client.size else np.zeros(0, bool)
+    ex_value = np.asarray(ex_amount, dtype=np.float64) * rates.cross(ex_ccy, [bases[c] for c in ex_client], ex_day,
+                                                                     max_lag_days)
+    net_deposits = np.bincount(ex_client[ex_inside], weights=np.nan_to_num(ex_value[ex_inside]), minlength=n)
+
+    # ---------- TWR: дневные звенья ----------
+    prev, cur = values[:, :-1], values[:, 1:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        links = np.where(valid[:, 1:] & (prev > 0), (cur - flows[:, 1:]) / prev, 1.0)
+    twr = np.prod(links, axis=1) - 1.0
+
+    # ---------- MWR: IRR по потокам (стоимость на начало — первый «взнос») ----------
+    amounts = np.where(valid, flows, 0.0)
+    amounts[:, 0] = values[:, 0]
+    taus = np.where(valid, (ends[:, None] - grid) / 365.0, 0.0)
+    end_values = values[np.arange(n), lengths - 1]
+    with span("returns_irr", accounts=n):
+        g, converged = solve_irr(amounts, taus, end_values)
+    years = (ends - starts) / 365.0
+    mwr = np.expm1(g * years)
+    mwr_annual = np.expm1(g)
+
+    has_value = (values > 0).any(axis=1)
+    flags = (~has_value * NO_VALUE
+             | gaps * MISSING_PRICE
+             | np.bincount(unpriced, minlength=n).astype(bool) * UNPRICED_TRADE
+             | (has_value & ~converged) * NOT_CONVERGED).astype(np.int8)
+    twr = np.where(has_value, twr, np.nan)
+    mwr = np.where(has_value & converged, mwr, np.nan)
+    mwr_annual = np.where(has_value & converged, mwr_annual, np.nan)
+    count("returns_accounts", n)
+    count("returns_flagged", int(np.count_nonzero(flags)))
+    return Returns(values[:, 0], end_values, flows[:, 1:].sum(axis=1), net_deposits, twr, mwr, mwr_annual,
+                   lengths, flags)
+
+
+def _num(value: float) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), 6)
+
+
+def returns_item(result: Returns, i: int, base_currency: str) -> dict:
+    return {
+        "base_currency": base_currency,
+        "start_value": _num(result.start_value[i]),
+        "end_value": _num(result.end_value[i]),
+        "net_flows": _num(result.net_flows[i]),
+        "net_deposits": _num(result.net_deposits[i]),
+        "twr": _num(result.twr[i]),
+        "mwr": _num(result.mwr[i]),
+        "mwr_annualized": _num(result.mwr_annualized[i]),
+        "days": int(result.days[i]),
+        "missing": result.flag_names(i),
+    }
+
+
+def write_json_atomic(path: str, payload: dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+# ---------- Этап ----------
+
+def find_report(data_in: str = DATA_IN) -> Optional[str]:
+    """Единственный отчет_*.xlsx во входной папке (как у extract_isin); нет или несколько — None."""
+    found = [p for p in glob(os.path.join(data_in, "отчет_*.xlsx")) if not os.path.basename(p).startswith("~$")]
+    return found[0] if len(found) == 1 else None
+
+
+def ingest_report(report: str, data_work: str) -> Optional[str]:
+    """Сделки из отчета → transactions_{клиент}_{период}.json для текущего isin_*.json; возвращает путь."""
+    current = [m for m in (_ISIN_JSON_RE.fullmatch(os.path.basename(p))
+                           for p in glob(os.path.join(data_work, "isin_*.json"))) if m]
+    if len(current) != 1:
+        console.print(f"[yellow]⚠️ Ожидался один isin_*.json в {data_work}, найдено: {len(current)} — "
+                      f"сделки из отчета не загружены[/yellow]")
+        return None
+    client, start, end = current[0].groups()
+    with span("transactions_read", file=os.path.basename(report)):
+        items = read_transactions(report)
+    out_path = os.path.join(data_work, f"transactions_{client}_{start}__{end}.json")
+    write_json_atomic(out_path, {"client": client, "period": {"start_date": start, "end_date": end}, "items": items})
+    return out_path
+
+
+def _load_tickers(path: str = REFERENCE_CACHE_JSON) -> Dict[str, str]:
+    """ISIN → тикер из кэша справочников map_instruments (для бумаг, проданных целиком)."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            stocks = json.load(f).get("stocks") or {}
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return {isin: rec.get("ticker", "") for isin, rec in stocks.items() if rec.get("ticker")}
+
+
+def load_accounts(data_work: str) -> List[Tuple[str, dict, dict]]:
+    """(клиент, период, счет) по всем stock_etf_*.json папки; сделки — из парных transactions_*.json."""
+    base_config = fx.load_base_currencies()
+    tickers = _load_tickers()
+    accounts = []
+    for path in sorted(glob(os.path.join(data_work, "stock_etf_*.json"))):
+        m = _STOCK_JSON_RE.fullmatch(os.path.basename(path))
+        if not m:
+            continue
+        client, start, end = m.groups()
+        with open(path, "r", encoding="utf-8") as f:
+            positions = json.load(f).get("items") or []
+        tx_path = os.path.join(data_work, f"transactions_{client}_{start}__{end}.json")
+        try:
+            with open(tx_path, "r", encoding="utf-8") as f:
+                transactions = json.load(f).get("items") or []
+        except FileNotFoundError:
+            transactions = []
+        period = {"start_date": start, "end_date": end}
+        accounts.append((client, period, {**period, "base_currency": fx.base_currency(client, base_config),
+                                          "positions": positions, "transactions": transactions,
+                                          "tickers": tickers}))
+    return accounts
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="TWR и MWR портфелей с учетом сделок")
+    parser.add_argument("--dir", default=DATA_WORK, help="Папка с stock_etf_*.json и transactions_*.json")
+    parser.add_argument("--store", default=price_store.PRICES_DIR, help="Папка хранилища цен")
+    parser.add_argument("--report", default=None,
+                        help="Отчет клиента со сделками (по умолчанию — единственный Data_in/отчет_*.xlsx)")
+    parser.add_argument("--no-ingest", action="store_true", help="Не читать отчет, только transactions_*.json")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if not args.no_ingest:
+        report = args.report or find_report()
+        if report:
+            out = ingest_report(report, args.dir)
+            if out:
+                console.print(f"[green]📥 Сделки из отчета:[/green] [bright_cyan]{out}[/bright_cyan]")
+
+    accounts = load_accounts(args.dir)
+    if not accounts:
+        console.print(f"[yellow]⚠️ В {args.dir} нет stock_etf_*.json[/yellow]")
+        return 1
+
+    store = price_store.PriceStore.open(args.store)
+    rates = fx.FxRates.from_store(store)
+    with span("returns", accounts=len(accounts)):
+        result = compute_returns(store, rates, [acc for _, _, acc in accounts])
+
+    for i, (client, period, acc) in enumerate(accounts):
+        out_path = os.path.join(args.dir, f"returns_{client}_{period['start_date']}__{period['end_date']}.json")
+        write_json_atomic(out_path, {"client": client, "period": period,
+                                     "returns": returns_item(result, i, acc["base_currency"])})
+        twr, mwr = result.twr[i], result.mwr[i]
+        console.print(f"{client:<24} {period['start_date']}..{period['end_date']}  "
+                      f"TWR {'—' if np.isnan(twr) else f'{twr:.2%}':>8}  MWR {'—' if np.isnan(mwr) else f'{mwr:.2%}':>8}")
+    console.print(f"[green]✅ Счетов: {len(result)}; с пометками: {int(np.count_nonzero(result.flags))}[/green]")
+    return 0
+
+
+if __name__ == "__main__":
+    if not ensure_dependencies(REQUIRED_MODULES):
+        sys.exit(1)
+    with stage_span("returns"), profile_stage("returns"):
+        code = main()
+    sys.exit(code)
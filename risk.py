@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+risk.py — риск портфеля за период: волатильность, максимальная просадка, бета к бенчмарку и
+исторический VaR (numpy, матричными операциями).
+
+Для каждого периода собирается общий «универс» — все тикеры, которые держат клиенты в этом
+периоде, плюс бенчмарк. По нему из price_store строится матрица дневных доходностей
+R (торговый день × инструмент); ковариация хранится в факторизованном виде Σ = XᵀX / (D − 1),
+X — центрированная R: ранг не больше числа дней, поэтому N × N никогда не материализуется, а
+ковариации инструментов с бенчмарком (вектор Xᵀx_b) считаются один раз на универс.
+Затем для всех клиентов периода сразу (W — веса, клиент × инструмент):
+  дисперсия  = ‖X Wᵀ‖² / (D − 1)           бета = W · (Xᵀx_b) / ‖x_b‖²
+  доходности портфелей Rp = R Wᵀ → максимальная просадка и VaR (квантиль по дням).
+Матрица доходностей кэшируется в Data_work/cache/risk/ по (универс, период, бенчмарк,
+поколение хранилища цен) — повторный прогон и другие клиенты с тем же набором берут готовое.
+
+Веса — стоимость позиций на конец периода (количество × цена × курс к USD); без количества —
+равные веса. Доходности — в валюте инструмента.
+
+Этап risk: stock_etf_*.json в папке → risk_{клиент}_{начало}__{конец}.json, из них
+template_creator заполняет лист «risk».
+  python risk.py [--dir Data_work] [--benchmark SPY]
+"""
+
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+from dataclasses import dataclass
+from glob import glob
+from typing import Dict, List, Optional, Tuple
+
+from startup import console, ensure_dependencies, lazy_import
+from instrumentation import count, span, stage_span
+from profiling import add_arguments as add_profile_arguments, profile_stage
+import price_store
+import fx
+
+np = lazy_import("numpy")
+
+REQUIRED_MODULES = ["rich", "numpy"]
+
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+DATA_WORK = os.path.join(BASE_DIR, "Data_work")
+CACHE_DIR = os.path.join(DATA_WORK, "cache", "risk")
+
+BENCHMARK_ENV = "REPORT_RISK_BENCHMARK"
+DEFAULT_BENCHMARK = "SPY"
+TRADING_DAYS_PER_YEAR = 252
+VAR_LEVELS = (0.95, 0.99)
+CACHE_VERSION = 1
+
+# Цена старше дня больше чем на столько дней считается отсутствующей
+MAX_PRICE_LAG_DAYS = 7
+
+# Флаги результата (битовая маска)
+NO_HOLDINGS = 1         # нет ни одной позиции с ценами в периоде
+PARTIAL_PRICES = 2      # у части позиций нет цен (исключены, веса перенормированы)
+NO_BENCHMARK = 4        # нет цен бенчмарка — бета не считается
+FLAG_NAMES = {NO_HOLDINGS: "no_holdings", PARTIAL_PRICES: "partial_prices", NO_BENCHMARK: "no_benchmark"}
+
+# Строки листа «risk»: ключ → подпись
+METRIC_NAMES = {
+    "volatility": "Волатильность, годовая",
+    "max_drawdown": "Максимальная просадка",
+    "beta": "Бета к бенчмарку",
+    "var_95": "VaR 95%, 1 день",
+    "var_99": "VaR 99%, 1 день",
+}
+
+# stock_etf_{клиент}_{начало}__{конец}.json
+_STOCK_JSON_RE = re.compile(r"stock_etf_(.+)_(\d{2}\.\d{2}\.\d{4})__(\d{2}\.\d{2}\.\d{4})\.json")
+
+
+@dataclass
+class Universe:
+    """Доходности универса за период: returns (день × инструмент), бенчмарк — последний столбец."""
+    tickers: List[str]
+    returns: "np.ndarray"       # простые дневные доходности, пропуски — 0
+    priced: "np.ndarray"        # bool по инструментам: есть цены в периоде
+    bench_cov: "np.ndarray"     # Xᵀx_b / (D − 1): ковариация каждого инструмента с бенчмарком
+    bench_var: float            # дисперсия бенчмарка (NaN — нет цен)
+
+    @property
+    def column(self) -> Dict[str, int]:
+        return {t: i for i, t in enumerate(self.tickers)}
+
+
+def _cache_path(tickers: List[str], start: int, end: int, benchmark: str, generation: int, cache_dir: str) -> str:
+    key = json.dumps([CACHE_VERSION, start, end, benchmark, generation, tickers], ensure_ascii=False)
+    return os.path.join(cache_dir, hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + ".npz")
+
+
+def build_universe(store: "price_store.PriceStore", tickers: List[str], start: int, end: int,
+                   benchmark: str, cache_dir: Optional[str] = CACHE_DIR) -> Universe:
+    """Матрица доходностей универса (tickers + бенчмарк) за [start, end]; с кэшем на диске."""
+    tickers = sorted(set(tickers) - {benchmark}) + [benchmark]
+    path = _cache_path(tickers, start, end, benchmark, store.generation, cache_dir) if cache_dir else None
+    if path and os.path.exists(path):
+        with np.load(path) as cached:
+            returns, priced = cached["returns"], cached["priced"]
+        count("risk_cache_hits")
+    else:
+        days = np.union1d([start], price_store.trading_days(start, end))
+        tids = store.ticker_ids(tickers)
+        with span("risk_prices", instruments=len(tickers), days=int(days.size)):
+            prices, _ = store.as_of_many(np.repeat(tids, days.size), np.tile(days, len(tickers)), MAX_PRICE_LAG_DAYS)
+        prices = prices.reshape(len(tickers), days.size).T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = prices[1:] / prices[:-1] - 1.0
+        priced = ~np.isnan(returns).all(axis=0) if returns.shape[0] else np.zeros(len(tickers), dtype=bool)
+        returns = np.nan_to_num(returns, nan=0.0, posinf=0.0, neginf=0.0)
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = path + ".tmp.npz"
+            np.savez(tmp, returns=returns, priced=priced)
+            os.replace(tmp, path)
+
+    # Ковариации с бенчмарком — один раз на универс (Σ в факторизованном виде)
+    n_days = returns.shape[0]
+    centered = returns - returns.mean(axis=0) if n_days else returns
+    denom = max(n_days - 1, 1)
+    bench = centered[:, -1]
+    bench_cov = centered.T @ bench / denom
+    bench_var = float(bench @ bench / denom) if priced[-1] else float("nan")
+    return Universe(tickers, returns, priced, bench_cov, bench_var)
+
+
+@dataclass
+class Risk:
+    """Метрики по счетам: все поля — numpy-массивы длины «число счетов»."""
+    volatility: "np.ndarray"
+    max_drawdown: "np.ndarray"
+    beta: "np.ndarray"
+    var: Dict[float, "np.ndarray"]      # уровень → VaR (положительное число — потеря, доля)
+    flags: "np.ndarray"
+
+    def __len__(self) -> int:
+        return int(self.flags.shape[0])
+
+    def flag_names(self, i: int) -> List[str]:
+        return [name for bit, name in FLAG_NAMES.items() if self.flags[i] & bit]
+
+
+def portfolio_risk(universe: Universe, weights, flags=None) -> Risk:
+    """Метрики для матрицы весов (клиент × инструмент универса, строки — доли, в сумме 1)."""
+    weights = np.asarray(weights, dtype=np.float64)
+    n = weights.shape[0]
+    flags = np.zeros(n, dtype=np.int8) if flags is None else flags.astype(np.int8)
+    returns = universe.returns
+    n_days = returns.shape[0]
+
+    with span("risk_matrix", accounts=n, instruments=len(universe.tickers), days=n_days):
+        portfolio = returns @ weights.T                             # день × клиент
+        centered = portfolio - portfolio.mean(axis=0) if n_days else portfolio
+        variance = (centered * centered).sum(axis=0) / max(n_days - 1, 1)   # = w Σ wᵀ
+        volatility = np.sqrt(variance * TRADING_DAYS_PER_YEAR)
+        path = np.cumprod(1.0 + portfolio, axis=0)
+        peaks = np.maximum.accumulate(np.vstack([np.ones((1, n)), path]), axis=0)[1:]
+        drawdown = (1.0 - path / peaks).max(axis=0) if n_days else np.zeros(n)
+        if np.isnan(universe.bench_var) or universe.bench_var == 0:
+            beta = np.full(n, np.nan)
+            flags |= NO_BENCHMARK
+        else:
+            beta = weights @ universe.bench_cov / universe.bench_var
+        var = {level: (-np.quantile(portfolio, 1.0 - level, axis=0) if n_days else np.full(n, np.nan))
+               for level in VAR_LEVELS}
+
+    empty = (flags & NO_HOLDINGS).astype(bool)
+    for arr in (volatility, drawdown, beta, *var.values()):
+        arr[empty] = np.nan
+    return Risk(volatility, drawdown, beta, var, flags)
+
+
+def account_weights(store: "price_store.PriceStore", rates: "fx.FxRates", universe: Universe,
+                    accounts: List[List[dict]], end: int) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    Веса (клиент × инструмент) по стоимости на конец периода в USD; позиции без цен исключаются.
+    Если ни у одной оцененной позиции клиента нет количества — равные веса. Возвращает (веса, флаги).
+    """
+    n = len(accounts)
+    column = universe.column
+    rows, cols, tickers, qty, ccy = [], [], [], [], []
+    for c, positions in enumerate(accounts):
+        for pos in positions:
+            ticker = (pos.get("ticker") or "").strip()
+            if ticker in column:
+                rows.append(c)
+                cols.append(column[ticker])
+                tickers.append(ticker)
+                qty.append(np.nan if pos.get("quantity") is None else float(pos["quantity"]))
+                ccy.append(pos.get("currency") or fx.PIVOT_CURRENCY)
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    qty = np.asarray(qty, dtype=np.float64)
+
+    prices, _ = store.as_of(tickers, price_store.from_day(end), MAX_PRICE_LAG_DAYS) if tickers else (np.empty(0), None)
+    usd = rates.usd_per(ccy, np.full(len(ccy), end, dtype=np.int64)) if ccy else np.empty(0)
+    value = qty * prices * usd
+    usable = universe.priced[cols] if cols.size else np.zeros(0, dtype=bool)
+
+    flags = np.zeros(n, dtype=np.int8)
+    flags[np.unique(rows[~usable])] |= PARTIAL_PRICES
+    # Счета, где стоимость известна хотя бы для одной позиции, — по стоимости; остальные — поровну
+    by_value = np.zeros(n, dtype=bool)
+    by_value[rows[usable & ~np.isnan(value)]] = True
+    weight = np.where(by_value[rows], np.nan_to_num(value), 1.0) * usable
+
+    weights = np.zeros((n, len(universe.tickers)))
+    np.add.at(weights, (rows, cols), weight)
+    totals = weights.sum(axis=1)
+    flags[totals <= 0] |= NO_HOLDINGS
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = np.where(totals[:, None] > 0, weights / totals[:, None], 0.0)
+    return weights, flags
+
+
+def compute_risk(store: "price_store.PriceStore", rates: "fx.FxRates", accounts: List[dict],
+                 benchmark: str = DEFAULT_BENCHMARK, cache_dir: Optional[str] = CACHE_DIR) -> List[dict]:
+    """
+    Метрики для пакета счетов {"start_date","end_date","positions":[...]}: счета группируются по
+    периоду, на каждый период — один универс и одна матричная операция для всех его клиентов.
+    Возвращает по словарю на счет: {"volatility","max_drawdown","beta","var_95","var_99","missing"}.
+    """
+    groups: Dict[Tuple[int, int], List[int]] = {}
+    for i, acc in enumerate(accounts):
+        key = (price_store.to_day(acc["start_date"]), price_store.to_day(acc["end_date"]))
+        groups.setdefault(key, []).append(i)
+
+    results: List[Optional[dict]] = [None] * len(accounts)
+    for (start, end), members in groups.items():
+        positions = [accounts[i].get("positions") or [] for i in members]
+        tickers = {(p.get("ticker") or "").strip() for pos in positions for p in pos} - {""}
+        universe = build_universe(store, sorted(tickers), start, end, benchmark, cache_dir)
+        weights, flags = account_weights(store, rates, universe, positions, end)
+        risk = portfolio_risk(universe, weights, flags)
+        for j, i in enumerate(members):
+            results[i] = {
+                "volatility": risk.volatility[j],
+                "max_drawdown": risk.max_drawdown[j],
+                "beta": risk.beta[j],
+                **{f"var_{round(level * 100)}": values[j] for level, values in risk.var.items()},
+                "missing": risk.flag_names(j),
+            }
+    count("risk_accounts", len(accounts))
+    count("risk_universes", len(groups))
+    return results
+
+
+def _num(value: float) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), 6)
+
+
+def risk_items(result: dict, benchmark: str) -> List[dict]:
+    """Строки risk_*.json (и листа «risk»): {"metric","name","value"}; пометки — в последней строке."""
+    items = [{"metric": key, "name": name + (f" ({benchmark})" if key == "beta" else ""),
+              "value": _num(result[key])} for key, name in METRIC_NAMES.items()]
+    if result["missing"]:
+        items.append({"metric": "missing", "name": "Пометки", "value": ", ".join(result["missing"])})
+    return items
+
+
+def write_json_atomic(path: str, payload: dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Волатильность, просадка, бета и VaR портфелей за период")
+    parser.add_argument("--dir", default=DATA_WORK, help="Папка с stock_etf_*.json")
+    parser.add_argument("--store", default=price_store.PRICES_DIR, help="Папка хранилища цен")
+    parser.add_argument("--benchmark", default=os.environ.get(BENCHMARK_ENV) or DEFAULT_BENCHMARK,
+                        help=f"Тикер бенчмарка (по умолчанию ${BENCHMARK_ENV} или {DEFAULT_BENCHMARK})")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать кэш матриц доходностей")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    files = []
+    for path in sorted(glob(os.path.join(args.dir, "stock_etf_*.json"))):
+        m = _STOCK_JSON_RE.fullmatch(os.path.basename(path))
+        if not m:
+            continue
+        client, start, end = m.groups()
+        with open(path, "r", encoding="utf-8") as f:
+            positions = json.load(f).get("items") or []
+        files.append((client, {"start_date": start, "end_date": end}, positions))
+    if not files:
+        console.print(f"[yellow]⚠️ В {args.dir} нет stock_etf_*.json[/yellow]")
+        return 1
+
+    store = price_store.PriceStore.open(args.store)
+    rates = fx.FxRates.from_store(store)
+    with span("risk", accounts=len(files)):
+        results = compute_risk(store, rates, [{**period, "positions": positions} for _, period, positions in files],
+                               args.benchmark, None if args.no_cache else CACHE_DIR)
+
+    for (client, period, _), result in zip(files, results):
+        out_path = os.path.join(args.dir, f"risk_{client}_{period['start_date']}__{period['end_date']}.json")
+        write_json_atomic(out_path, {"client": client, "period": period, "benchmark": args.benchmark,
+                                     "items": risk_items(result, args.benchmark)})
+    flagged = sum(1 for r in results if r["missing"])
+    console.print(f"[green]✅ Портфелей: {len(results)}; с пометками: {flagged}[/green]")
+    return 0
+
+
+if __name__ == "__main__":
+    if not ensure_dependencies(REQUIRED_MODULES):
+        sys.exit(1)
+    with stage_span("risk"), profile_stage("risk"):
+        code = main()
+    sys.exit(code)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+sp_monitor.py — мониторинг структурных продуктов: барьеры, автоколл и купоны за период.
+
+Условия продуктов — dictionaries/reference_structured/sp_terms.json, {ISIN: условия}:
+  {
+    "underlyings": ["AAPL", "MSFT"],          тикеры базовых активов (worst-of)
+    "strike_date": "15.01.2025",              дата начальной фиксации
+    "initial": {"AAPL": 230.1},               начальные уровни (необязательно: иначе цена на strike_date)
+    "observation_dates": ["15.04.2025", ...], даты наблюдения купона/автоколла
+    "coupon": 2.5,                            купон за наблюдение, % номинала
+    "coupon_barrier": 0.7,                    купонный барьер (доля начального уровня)
+    "memory": true,                           купон с памятью: выплачиваются и пропущенные
+    "autocall_trigger": 1.0,                  уровень автоколла (число или список по датам — step-down)
+    "autocall_from": 2,                       с какого наблюдения (с 1) возможен автоколл
+    "barrier": 0.6,                           защитный барьер
+    "barrier_type": "american",               american — по дневным закрытиям, european — на погашении
+    "maturity": "15.01.2027"
+  }
+Цены — из price_store (тикеры базовых активов).
+
+Все продукты дома считаются одним пакетом: условия раскладываются в матрицы
+(продукт × базовый актив × наблюдение), цены на все даты наблюдения — один as-of join,
+дневной путь для американского барьера — еще один; события находятся векторно
+(cumulative max, argmax по маскам), без цикла по продуктам и PDF.
+
+Этап sp_monitor (после prices, который догружает цены базовых активов в хранилище):
+все sp_*.json в папке → monitoring_{клиент}_{начало}__{конец}.json — по записи на продукт с условиями
+({"isin", "status", ...}); сводка печатается на экран.
+  python sp_monitor.py [--dir Data_work] [--terms sp_terms.json] [--store dictionaries/prices]
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+from glob import glob
+from typing import Dict, List, Optional
+
+from startup import console, ensure_dependencies, lazy_import
+from instrumentation import count, span, stage_span
+from profiling import add_arguments as add_profile_arguments, profile_stage
+import price_store
+
+np = lazy_import("numpy")
+
+REQUIRED_MODULES = ["rich", "numpy"]
+
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+DATA_WORK = os.path.join(BASE_DIR, "Data_work")
+TERMS_JSON = os.path.join(BASE_DIR, "dictionaries", "reference_structured", "sp_terms.json")
+
+# Цена старше даты наблюдения больше чем на столько дней считается отсутствующей
+MAX_PRICE_LAG_DAYS = 5
+
+STATUS_ACTIVE = "active"
+STATUS_AUTOCALLED = "autocalled"
+STATUS_MATURED = "matured"
+
+# sp_{клиент}_{начало}__{конец}.json
+_SP_JSON_RE = re.compile(r"sp_(.+)_(\d{2}\.\d{2}\.\d{4})__(\d{2}\.\d{2}\.\d{4})\.json")
+
+
+def load_terms(path: str = TERMS_JSON) -> Dict[str, dict]:
+    """Условия продуктов {ISIN: условия}; если файла нет — пусто."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {isin.strip().upper(): terms for isin, terms in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
+
+
+def _fmt_day(day: int) -> Optional[str]:
+    return f"{price_store.from_day(day):%d.%m.%Y}" if day >= 0 else None
+
+
+def _num(value: float) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), 6)
+
+
+def monitor(products: List[dict], periods: List[dict], store: "price_store.PriceStore") -> List[dict]:
+    """
+    Мониторинг пакета продуктов. products — условия (формат sp_terms.json), periods — период
+    отчета для каждого продукта {"start_date","end_date"}. Возвращает по словарю на продукт:
+      status, worst_performance / worst_underlying (на конец периода), barrier_breached, breach_date,
+      autocall_date, coupons (выплаты в периоде: [{"date","amount"}]), coupons_total, missing.
+    """
+    n = len(products)
+    if not n:
+        return []
+    n_under = max(len(p.get("underlyings") or ()) for p in products) or 1
+    n_obs = max(len(p.get("observation_dates") or ()) for p in products) or 1
+    big = np.iinfo(np.int64).max >> price_store.DAY_BITS      # «нет даты» — позже любой реальной
+
+    # ---------- Условия → матрицы ----------
+    tickers = [[""] * n_under for _ in range(n)]
+    initial = np.full((n, n_under), np.nan)
+    obs_days = np.full((n, n_obs), big, dtype=np.int64)
+    trigger = np.full((n, n_obs), np.inf)
+    for i, p in enumerate(products):
+        under = p.get("underlyings") or []
+        tickers[i][:len(under)] = under
+        for u, t in enumerate(under):
+            initial[i, u] = (p.get("initial") or {}).get(t, np.nan)
+        dates = p.get("observation_dates") or []
+        if dates:
+            obs_days[i, :len(dates)] = price_store.to_days(dates)
+        trig = p.get("autocall_trigger")
+        if trig is not None:
+            trig = np.broadcast_to(np.asarray(trig, dtype=np.float64), (len(dates),)) if dates else []
+            start = max(int(p.get("autocall_from") or 1), 1) - 1
+            trigger[i, start:len(dates)] = trig[start:]
+    flat_tickers = [t for row in tickers for t in row]
+    tids = store.ticker_ids(flat_tickers).reshape(n, n_under)
+    has_under = np.array([[bool(t) for t in row] for row in tickers])
+    strike = price_store.to_days([p.get("strike_date") or "01.01.1970" for p in products])
+    maturity = np.array([price_store.to_day(p["maturity"]) if p.get("maturity") else big for p in products],
+                        dtype=np.int64)
+    coupon = np.array([float(p.get("coupon") or 0.0) for p in products])
+    # Без купонного барьера купон безусловный; без купона — выплат нет
+    coupon_barrier = np.array([np.inf if not p.get("coupon") else
+                               float(p["coupon_barrier"]) if p.get("coupon_barrier") is not None else -np.inf
+                               for p in products])
+    memory = np.array([bool(p.get("memory")) for p in products])
+    barrier = np.array([float(p["barrier"]) if p.get("barrier") is not None else -np.inf for p in products])
+    american = np.array([(p.get("barrier_type") or "american").lower() == "american" for p in products])
+    start_day = price_store.to_days([per["start_date"] for per in periods])
+    end_day = price_store.to_days([per["end_date"] for per in periods])
+
+    # Начальные уровни, не заданные явно, — цена на дату фиксации (один as-of join)
+    need = np.isnan(initial) & has_under
+    if need.any():
+        fixing, _ = store.as_of_many(tids[need], np.broadcast_to(strike[:, None], need.shape)[need],
+                                     MAX_PRICE_LAG_DAYS)
+        initial[need] = fixing
+
+    def worst_of(days):
+        """Худшая доля начального уровня по базовым активам на даты days (n × k) — одним as-of join."""
+        k = days.shape[1]
+        flat_tids = np.broadcast_to(tids[:, :, None], (n, n_under, k)).reshape(-1)
+        flat_days = np.broadcast_to(days[:, None, :], (n, n_under, k)).reshape(-1)
+        prices, _ = store.as_of_many(flat_tids, flat_days, MAX_PRICE_LAG_DAYS)
+        perf = prices.reshape(n, n_under, k) / initial[:, :, None]
+        # Пустые позиции матрицы (у продукта меньше активов) не участвуют в минимуме
+        perf = np.where(has_under[:, :, None], perf, np.inf)
+        missing = np.isnan(perf).any(axis=1)
+        worst_idx = np.argmin(np.where(np.isnan(perf), np.inf, perf), axis=1)
+        worst = np.take_along_axis(perf, worst_idx[:, None, :], axis=1)[:, 0, :]
+        worst = np.where(missing | np.isinf(worst), np.nan, worst)
+        return worst, worst_idx
+
+    # ---------- Наблюдения: автоколл и купоны ----------
+    with span("sp_observations", products=n, observations=n_obs):
+        worst_obs, _ = worst_of(np.minimum(obs_days, end_day[:, None]))
+    observed = (obs_days <= end_day[:, None]) & (obs_days <= maturity[:, None]) & ~np.isnan(worst_obs)
+    level = np.where(observed, worst_obs, -np.inf)
+
+    call_hit = observed & (level >= trigger)
+    autocalled = call_hit.any(axis=1)
+    call_idx = np.where(autocalled, np.argmax(call_hit, axis=1), n_obs)
+    call_day = np.where(autocalled, obs_days[np.arange(n), np.minimum(call_idx, n_obs - 1)], -1)
+    alive = np.arange(n_obs)[None, :] <= call_idx[:, None]
+
+    pay = observed & alive & (level >= coupon_barrier[:, None])
+    o = np.arange(n_obs)[None, :]
+    last_paid = np.maximum.accumulate(np.where(pay, o, -1), axis=1)
+    prev_paid = np.concatenate([np.full((n, 1), -1), last_paid[:, :-1]], axis=1)
+    units = np.where(memory[:, None], o - prev_paid, 1)
+    amount = np.where(pay, coupon[:, None] * units, 0.0)
+    in_period = (obs_days >= start_day[:, None]) & (obs_days <= end_day[:, None])
+
+    # ---------- Барьер ----------
+    horizon = np.minimum(np.minimum(end_day, maturity), np.where(autocalled, call_day, big))
+    breached = np.zeros(n, dtype=bool)
+    breach_day = np.full(n, -1, dtype=np.int64)
+    if american.any():
+        first_day, last_day = int(strike[american].min()), int(horizon[american].max())
+        grid = price_store.trading_days(first_day, last_day) if last_day >= first_day else np.empty(0, np.int64)
+        if grid.size:
+            with span("sp_barrier_path", products=int(american.sum()), days=int(grid.size)):
+                worst_path, _ = worst_of(np.broadcast_to(grid[None, :], (n, grid.size)))
+            window = (grid[None, :] >= strike[:, None]) & (grid[None, :] <= horizon[:, None]) & american[:, None]
+            hit = window & (worst_path <= barrier[:, None])
+            breached |= hit.any(axis=1)
+            breach_day = np.where(hit.any(axis=1), grid[np.argmax(hit, axis=1)], breach_day)
+    european = ~american & (maturity <= end_day) & ~autocalled
+    if european.any():
+        at_maturity, _ = worst_of(maturity[:, None].copy())
+        hit = european & (at_maturity[:, 0] <= barrier)
+        breached |= hit
+        breach_day = np.where(hit, maturity, breach_day)
+
+    # ---------- Состояние на конец периода ----------
+    worst_end, worst_idx = worst_of(np.minimum(end_day, horizon)[:, None].copy())
+
+    results = []
+    for i, p in enumerate(products):
+        under = p.get("underlyings") or []
+        status = STATUS_AUTOCALLED if autocalled[i] else (STATUS_MATURED if maturity[i] <= end_day[i] else STATUS_ACTIVE)
+        paid = np.flatnonzero((amount[i] > 0) & in_period[i])
+        missing = []
+        if not under:
+            missing.append("no_underlyings")
+        elif np.isnan(initial[i, :len(under)]).any():
+            missing.append("no_initial_level")
+        if under and np.isnan(worst_end[i, 0]):
+            missing.append("no_price")
+        results.append({
+            "status": status,
+            "worst_performance": _num(worst_end[i, 0]),
+            "worst_underlying": under[worst_idx[i, 0]] if under and not np.isnan(worst_end[i, 0]) else None,
+            "barrier_breached": bool(breached[i]),
+            "breach_date": _fmt_day(breach_day[i]),
+            "autocall_date": _fmt_day(call_day[i]),
+            "coupons": [{"date": _fmt_day(obs_days[i, j]), "amount": round(float(amount[i, j]), 6)} for j in paid],
+            "coupons_total": round(float(amount[i, paid].sum()), 6),
+            "missing": missing,
+        })
+    count("sp_monitored", n)
+    count("sp_barrier_breaches", int(breached.sum()))
+    return results
+
+
+def monitoring_json_path(data_dir: str, client: str, period: dict) -> str:
+    return os.path.join(data_dir, f"monitoring_{client}_{period['start_date']}__{period['end_date']}.json")
+
+
+def write_json_atomic(path: str, payload: dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Мониторинг структурных продуктов за период")
+    parser.add_argument("--dir", default=DATA_WORK, help="Папка с sp_*.json")
+    parser.add_argument("--terms", default=TERMS_JSON, help="Условия продуктов (JSON)")
+    parser.add_argument("--store", default=price_store.PRICES_DIR, help="Папка хранилища цен")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    terms = load_terms(args.terms)
+    files, rows = [], []
+    for path in sorted(glob(os.path.join(args.dir, "sp_*.json"))):
+        m = _SP_JSON_RE.fullmatch(os.path.basename(path))
+        if not m:
+            continue
+        client, period = m.group(1), {"start_date": m.group(2), "end_date": m.group(3)}
+        files.append((client, period))
+        with open(path, "r", encoding="utf-8") as f:
+            for rec in json.load(f).get("items") or []:
+                if rec.get("isin") in terms:
+                    rows.append((len(files) - 1, rec["isin"], period))
+    if not rows:
+        console.print(f"[yellow]⚠️ Нет продуктов с условиями ({args.terms}) в sp_*.json папки {args.dir}[/yellow]")
+
+    # Один пакет на все продукты всех клиентов
+    results = []
+    if rows:
+        store = price_store.PriceStore.open(args.store)
+        with span("sp_monitor", products=len(rows)):
+            results = monitor([terms[isin] for _, isin, _ in rows], [period for _, _, period in rows], store)
+    by_file: Dict[int, List[dict]] = {i: [] for i in range(len(files))}
+    for (i, isin, _), r in zip(rows, results):
+        by_file[i].append({"isin": isin, **r})
+        worst = "—" if r["worst_performance"] is None else f"{r['worst_performance']:.2%}"
+        console.print(f"{files[i][0]:<24} {isin:<14} {r['status']:<11} worst {worst:>8}  "
+                      f"барьер {'ПРОБИТ ' + r['breach_date'] if r['barrier_breached'] else 'нет'}  "
+                      f"купоны {r['coupons_total']:g}%")
+    # Файл пишется для каждого sp_*.json (и без продуктов с условиями) — прошлый результат не остается
+    for i, (client, period) in enumerate(files):
+        write_json_atomic(monitoring_json_path(args.dir, client, period),
+                          {"client": client, "period": period, "items": by_file[i]})
+    console.print(f"[green]🛡️ Мониторинг СП:[/green] [bright_cyan]{len(rows)}[/bright_cyan]"
+                  f"[green] продуктов, файлов: {len(files)}[/green]")
+    return 0
+
+
+if __name__ == "__main__":
+    if not ensure_dependencies(REQUIRED_MODULES):
+        sys.exit(1)
+    with stage_span("sp_monitor"), profile_stage("sp_monitor"):
+        code = main()
+    sys.exit(code)
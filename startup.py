@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+startup.py — единый слой запуска для всех модулей проекта.
+
+- ensure_dependencies(): один раз проверяет наличие внешних библиотек (без их импорта,
+  через importlib.util.find_spec) и при необходимости ставит недостающие через pip.
+  Результат передаётся дочерним процессам через переменную окружения, поэтому
+  этапы, запущенные из main.py, повторно ничего не проверяют.
+- lazy_import(): модуль-заглушка, реальный импорт происходит при первом обращении к атрибуту.
+- console / rprint: rich-консоль, которая создаётся только при первом выводе.
+
+Импорт этого модуля не имеет побочных эффектов и не тянет тяжёлые библиотеки.
+"""
+
+import os
+import sys
+import importlib
+import importlib.util
+from typing import Iterable, Optional
+
+# Импортируемое имя модуля → имя pip-пакета
+DEPENDENCIES = {
+    "rich": "rich",
+    "openpyxl": "openpyxl",
+    "xlwings": "xlwings",
+    "prompt_toolkit": "prompt_toolkit",
+    "holidays": "holidays",
+    "numpy": "numpy",
+}
+
+# Проверяются только по явному запросу модуля: xlwings нужен бэкенду --backend xlwings
+# шаблона и name_clients (они передают его в ensure_dependencies сами)
+OPTIONAL_DEPENDENCIES = ("xlwings",)
+DEFAULT_DEPENDENCIES = [m for m in DEPENDENCIES if m not in OPTIONAL_DEPENDENCIES]
+
+# Выставляется после успешной проверки и наследуется дочерними процессами
+DEPS_CHECKED_ENV = "REPORT_DEPS_CHECKED"
+
+
+def missing_dependencies(modules: Iterable[str]) -> list:
+    """Возвращает список модулей, которые не найдены (без их импорта)."""
+    return [m for m in modules if importlib.util.find_spec(m) is None]
+
+
+def ensure_dependencies(modules: Optional[Iterable[str]] = None, install: bool = True) -> bool:
+    """
+    Проверяет наличие модулей (по умолчанию — DEFAULT_DEPENDENCIES, без необязательных);
+    при install=True ставит недостающие через pip.
+    Повторная проверка набора по умолчанию в этом и дочерних процессах пропускается.
+    Возвращает True, если все модули доступны.
+    """
+    if modules is None:
+        if os.environ.get(DEPS_CHECKED_ENV) == "1":
+            return True
+        modules = list(DEFAULT_DEPENDENCIES)
+    missing = missing_dependencies(modules)
+    if missing and install:
+        packages = [DEPENDENCIES.get(m, m) for m in missing]
+        print(f"Устанавливаю недостающие библиотеки: {', '.join(packages)}...")
+        import subprocess
+        subprocess.run([sys.executable, "-m", "pip", "install", *packages])
+        importlib.invalidate_caches()
+        missing = missing_dependencies(missing)
+    if missing:
+        packages = " ".join(DEPENDENCIES.get(m, m) for m in missing)
+        print(f"Модули не установлены: {', '.join(missing)}. Установите вручную: pip install {packages}")
+        return False
+    if set(modules) >= set(DEFAULT_DEPENDENCIES):
+        os.environ[DEPS_CHECKED_ENV] = "1"
+    return True
+
+
+class LazyModule:
+    """Заглушка модуля: импортирует его при первом обращении к любому атрибуту."""
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            name = self.__dict__["_name"]
+            try:
+                module = importlib.import_module(name)
+            except ImportError:
+                if not ensure_dependencies([name.split(".")[0]]):
+                    raise
+                module = importlib.import_module(name)
+            self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __repr__(self) -> str:
+        state = "загружен" if self.__dict__["_module"] is not None else "не загружен"
+        return f"<LazyModule {self.__dict__['_name']} ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """Возвращает ленивую заглушку для модуля name (например, 'openpyxl' или 'rich.table')."""
+    return LazyModule(name)
+
+
+_rich = lazy_import("rich")
+_rich_console = lazy_import("rich.console")
+
+
+class _LazyConsole:
+    """rich.console.Console, создаваемая при первом выводе."""
+
+    def __init__(self):
+        self._console = None
+
+    def __getattr__(self, attr: str):
+        if self._console is None:
+            self._console = _rich_console.Console()
+        return getattr(self._console, attr)
+
+
+console = _LazyConsole()
+
+
+def rprint(*objects, **kwargs) -> None:
+    """Аналог rich.print (разметка [bold]...[/bold]), импортирующий rich при первом вызове."""
+    _rich.print(*objects, **kwargs)
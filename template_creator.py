@@ -7,44 +7,102 @@
 - Загрузка данных из JSON-файлов (имя клиента и даты отчета)
 - Формирование имени выходного файла
 - Архивирование старых файлов портфеля
-- Создание Excel-шаблона с двумя листами
+- Создание Excel-шаблона с листами из TEMPLATE_LAYOUT
+
+Бэкенды создания шаблона (--backend):
+- openpyxl (по умолчанию) — пишет xlsx напрямую потоковым writer'ом, Excel не нужен;
+- xlwings — прежний путь через скрытый экземпляр Excel (только Windows + Excel).
 """
 
 # ===============================
 # Импорт стандартных библиотек
 # ===============================
 import os          # Для работы с файловой системой и путями
-import sys         # Для доступа к sys.executable (путь к Python)
+import sys         # Для завершения с кодом ошибки (sys.exit)
 import json        # Для работы с JSON-файлами
 import shutil      # Для перемещения файлов (архивирование)
-from pathlib import Path  # Для работы с путями (альтернатива os.path)
+import argparse    # Для разбора аргументов командной строки
+import hashlib     # Для версии скомпилированного шаблона (хеш макета)
+import math        # Для отсева NaN/inf при записи чисел
+import re          # Для очистки недопустимых в XML символов
+import zipfile     # Для сборки xlsx из скомпилированного шаблона
+from typing import Dict, Iterable, Optional, Sequence
+from xml.sax.saxutils import escape as xml_escape
+
+# ===============================
+# 📦 rich, openpyxl и xlwings — ленивый импорт через слой startup
+# ===============================
+from startup import console, ensure_dependencies, lazy_import, missing_dependencies
+from instrumentation import count, span, stage_span
+from profiling import add_arguments as add_profile_arguments, profile_stage
+
+xw = lazy_import("xlwings")
+openpyxl = lazy_import("openpyxl")
+openpyxl_cell = lazy_import("openpyxl.cell")
+openpyxl_utils = lazy_import("openpyxl.utils")
+openpyxl_styles = lazy_import("openpyxl.styles")
+
+# xlwings нужен только для необязательного бэкенда --backend xlwings
+REQUIRED_MODULES = ["rich", "openpyxl"]
 
 # ===============================
-# 📦 Проверка и установка rich
+# Макет шаблона
 # ===============================
-try:
-    from rich import print
-    from rich.console import Console
-except ImportError:
-    # Если rich не установлен, устанавливаем его автоматически
-    print("📦 Устанавливаю библиотеку rich...")
-    os.system(f'"{sys.executable}" -m pip install rich')
-    from rich import print
-    from rich.console import Console
-
-# Создаем объект консоли для красивого вывода
-console = Console()
+# Заголовки листа stock_etf_price (стоимость — если во входном отчете есть количество позиций)
+STOCK_ETF_HEADERS = ("ISIN", "Тикер", "Название", "start_date", "start_price", "end_date", "end_price", "Отклонение",
+                     "Количество", "Валюта", "Стоимость", "Базовая валюта", "Стоимость (база)")
+
+# Заголовки листа «портфель»: все сопоставленные инструменты клиента
+PORTFOLIO_HEADERS = ("ISIN", "Тип", "Тикер", "Название", "TermSheet")
+
+# Заголовки листа «bonds»: НКД, доходность и дюрация на конец периода (этап bond_analytics)
+BOND_HEADERS = ("ISIN", "Название", "Дата цены", "Цена", "НКД", "Грязная цена", "YTM", "Дюрация", "Мод. дюрация")
+
+# Заголовки листа «risk»: метрики риска портфеля за период (этап risk)
+RISK_HEADERS = ("Показатель", "Значение")
+
+# Заголовки листа «look_through»: экспозиция сквозь ETF по секторам, странам и эмитентам (этап look_through)
+LOOK_THROUGH_HEADERS = ("Разрез", "Название", "Доля, %")
+
+# Заголовки листа «changes»: изменения портфеля с прошлого прогона (delta_*.json, режим приращений)
+CHANGES_HEADERS = ("Изменение", "ISIN", "Категория", "Название", "Кол-во было", "Кол-во стало")
+
+# Листы в порядке следования: цвет вкладки (RGB для xlsx и ColorIndex для Excel COM),
+# заголовки первой строки (жирные, по центру) и ширина столбцов под заголовками
+TEMPLATE_LAYOUT = (
+    {"name": "портфель", "tab_color": "993300", "color_index": 53,
+     "headers": PORTFOLIO_HEADERS, "column_width": 16},
+    {"name": "stock_etf_price", "tab_color": "0000FF", "color_index": 5,
+     "headers": STOCK_ETF_HEADERS, "column_width": 12},
+    {"name": "bonds", "tab_color": "008000", "color_index": 10,
+     "headers": BOND_HEADERS, "column_width": 14},
+    {"name": "risk", "tab_color": "800080", "color_index": 13,
+     "headers": RISK_HEADERS, "column_width": 28},
+    {"name": "look_through", "tab_color": "008080", "color_index": 14,
+     "headers": LOOK_THROUGH_HEADERS, "column_width": 24},
+    {"name": "changes", "tab_color": "808000", "color_index": 12,
+     "headers": CHANGES_HEADERS, "column_width": 18},
+)
+
+BACKENDS = ("openpyxl", "xlwings")
+
+# Выходы map_instruments (с delta_*.json), этапов цен, bond_analytics, risk и look_through, из которых заполняются листы: вид → префикс имени файла
+MAPPED_KINDS = {"stocks": "stock_etf", "bonds": "bonds", "sp": "sp", "prices": "prices",
+                "bond_metrics": "bond_metrics", "risk": "risk", "exposure": "exposure",
+                "delta": "delta"}
+INSTRUMENT_KINDS = ("stocks", "bonds", "sp")
+BOND_TYPE = "ОБЛИГАЦИЯ"
+SP_TYPE = "СТРУКТУРНЫЙ ПРОДУКТ"
 
 # ===============================
-# 📦 Проверка и установка xlwings
+# Пути
 # ===============================
-try:
-    import xlwings as xw
-except ImportError:
-    # Если xlwings не установлен, устанавливаем его автоматически
-    console.print("📦 Устанавливаю библиотеку xlwings...", style="bold green")
-    os.system(f'"{sys.executable}" -m pip install xlwings')
-    import xlwings as xw
+# Корень проекта можно переопределить переменной окружения REPORT_BASE_DIR
+BASE_DIR = os.environ.get("REPORT_BASE_DIR", r"F:\Python Projets\Report")
+TEMPLATE_CACHE_DIR = os.path.join(BASE_DIR, "Data_work", "cache")
+
+# Версия формата скомпилированного шаблона (входит в хеш вместе с макетом)
+TEMPLATE_SKELETON_VERSION = 1
 
 
 def load_json_data(path: str) -> dict:
@@ -163,17 +221,63 @@ def archive_existing_portfolio_files(folder: str, backup_folder: str) -> list[st
     return moved_files
 
 
-def create_excel_template(output_path: str, filename: str):
+def create_excel_template_openpyxl(output_path: str, filename: str):
     """
-    Создает Excel-файл с двумя листами: "портфель" и "stock_etf_price".
+    Создает Excel-файл с листами из TEMPLATE_LAYOUT без Excel — потоковым writer'ом openpyxl.
     
     Параметры:
         output_path (str): Полный путь к создаваемому Excel-файлу
         filename (str): Имя файла (используется для логирования)
         
+    Логика работы:
+        1. Создает книгу в режиме write-only (строки сразу уходят в XML листа)
+        2. Для каждого листа задает цвет вкладки и ширину столбцов
+        3. Пишет строку заголовков: жирный шрифт, выравнивание по центру
+        4. Сохраняет файл
+        
+    Пример использования:
+        create_excel_template_openpyxl("Data_work/portfolio.xlsx", "portfolio.xlsx")
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    bold = openpyxl_styles.Font(bold=True)
+    center = openpyxl_styles.Alignment(horizontal="center", vertical="center")
+
+    for layout in TEMPLATE_LAYOUT:
+        ws = wb.create_sheet(layout["name"])
+        ws.sheet_properties.tabColor = layout["tab_color"]
+
+        # Ширина задается до первой строки: в write-only режиме <cols> пишется перед данными
+        if layout["column_width"]:
+            for col in range(1, len(layout["headers"]) + 1):
+                letter = openpyxl_utils.get_column_letter(col)
+                ws.column_dimensions[letter].width = layout["column_width"]
+
+        if layout["headers"]:
+            row = []
+            for header in layout["headers"]:
+                cell = openpyxl_cell.WriteOnlyCell(ws, value=header)
+                cell.font = bold
+                cell.alignment = center
+                row.append(cell)
+            ws.append(row)
+
+    wb.save(output_path)
+
+
+def create_excel_template_xlwings(output_path: str, filename: str,
+                                  rows: Optional[Dict[str, Iterable[Sequence]]] = None):
+    """
+    Создает Excel-файл с листами из TEMPLATE_LAYOUT через Excel (xlwings).
+    Нужен Windows и установленный Excel; оставлен как необязательный бэкенд.
+    
+    Параметры:
+        output_path (str): Полный путь к создаваемому Excel-файлу
+        filename (str): Имя файла (используется для логирования)
+        rows (dict): Строки данных по листам {имя листа: строки}; каждый лист пишется одним диапазоном
+        
     Логика работы:
         1. Создает новый экземпляр Excel через xlwings
-        2. Создает лист "портфель" с коричневой вкладкой
+        2. Создает лист "портфель" с коричневой вкладкой и заголовками PORTFOLIO_HEADERS
         3. Добавляет лист "stock_etf_price" с синей вкладкой
         4. Заполняет заголовки таблицы с форматированием
         5. Настраивает ширину столбцов
@@ -184,7 +288,7 @@ def create_excel_template(output_path: str, filename: str):
         - При ошибке корректно закрывает Excel и освобождает ресурсы
         
     Пример использования:
-        create_excel_template("Data_work/portfolio.xlsx", "portfolio.xlsx")
+        create_excel_template_xlwings("Data_work/portfolio.xlsx", "portfolio.xlsx")
     """
     app = None
     try:
@@ -204,6 +308,17 @@ def create_excel_template(output_path: str, filename: str):
         except:
             pass  # Если не удается установить цвет, продолжаем работу
 
+        # Заголовки листа "портфель" — одной записью диапазона, как у остальных листов макета
+        portfolio_layout = TEMPLATE_LAYOUT[0]
+        portfolio_range = sheet.range((1, 1)).resize(1, len(portfolio_layout["headers"]))
+        portfolio_range.value = list(portfolio_layout["headers"])
+        try:
+            portfolio_range.api.Font.Bold = True
+            portfolio_range.api.HorizontalAlignment = -4108
+            portfolio_range.api.ColumnWidth = portfolio_layout["column_width"]
+        except:
+            pass
+
         # ===============================
         # Создание листа "stock_etf_price"
         # ===============================
@@ -219,7 +334,7 @@ def create_excel_template(output_path: str, filename: str):
         # Заполнение заголовков таблицы
         # ===============================
         # Определяем заголовки для листа stock_etf_price
-        headers = ["ISIN", "Тикер", "Название", "start_date", "start_price", "end_date", "end_price", "Отклонение"]
+        headers = list(STOCK_ETF_HEADERS)
         
         # Записываем заголовки в первую строку с форматированием
         for col, header in enumerate(headers, 1):
@@ -238,11 +353,37 @@ def create_excel_template(output_path: str, filename: str):
         # Настройка ширины столбцов
         # ===============================
         try:
-            # Устанавливаем одинаковую ширину для всех столбцов (A-H)
-            stock_sheet.api.Columns("A:H").ColumnWidth = 12
+            # Устанавливаем одинаковую ширину для всех столбцов таблицы
+            stock_sheet.api.Columns(f"A:{column_letter(len(headers))}").ColumnWidth = 12
         except:
             pass
 
+        # ===============================
+        # Остальные листы макета (после "stock_etf_price"): заголовки — одной записью диапазона
+        # ===============================
+        for layout in TEMPLATE_LAYOUT[2:]:
+            extra_sheet = wb.sheets.add(layout["name"], after=wb.sheets[-1])
+            try:
+                extra_sheet.api.Tab.ColorIndex = layout["color_index"]
+            except:
+                pass
+            header_range = extra_sheet.range((1, 1)).resize(1, len(layout["headers"]))
+            header_range.value = list(layout["headers"])
+            try:
+                header_range.api.Font.Bold = True
+                header_range.api.HorizontalAlignment = -4108
+                header_range.api.ColumnWidth = layout["column_width"]
+            except:
+                pass
+
+        # ===============================
+        # Данные: каждый лист — одна запись диапазона (один COM-вызов)
+        # ===============================
+        for sheet_name, sheet_rows in (rows or {}).items():
+            values = [list(r) for r in sheet_rows]
+            if values:
+                wb.sheets[sheet_name].range((2, 1)).value = values
+
         # ===============================
         # Сохранение и закрытие
         # ===============================
@@ -266,7 +407,264 @@ def create_excel_template(output_path: str, filename: str):
         raise  # Перебрасываем исключение дальше
 
 
-def main():
+# ===============================
+# Скомпилированный шаблон (skeleton)
+# ===============================
+_XML_ILLEGAL_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_SHEET_DATA_END = b"</sheetData>"
+
+
+def layout_hash() -> str:
+    """Хеш макета шаблона: меняется при любой правке TEMPLATE_LAYOUT или формата skeleton."""
+    payload = json.dumps({"version": TEMPLATE_SKELETON_VERSION, "layout": TEMPLATE_LAYOUT},
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def column_letter(idx: int) -> str:
+    """Номер столбца (с 1) → буквы Excel: 1 → A, 27 → AA."""
+    letters = ""
+    while idx:
+        idx, rem = divmod(idx - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _cell_xml(ref: str, value) -> str:
+    """XML одной ячейки: числа — как числа, остальное — inline-строкой (без sharedStrings)."""
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        if isinstance(value, float) and not math.isfinite(value):
+            return ""
+        return f'<c r="{ref}"><v>{value!r}</v></c>'
+    text = xml_escape(_XML_ILLEGAL_RE.sub("", str(value)))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def rows_xml(rows: Iterable[Sequence], first_row: int, letters: list) -> Iterable[str]:
+    """Построчно отдает XML строк листа, начиная с номера first_row (пустые ячейки пропускаются)."""
+    for r, row in enumerate(rows, start=first_row):
+        while len(letters) < len(row):
+            letters.append(column_letter(len(letters) + 1))
+        cells = "".join(_cell_xml(f"{letters[c]}{r}", v) for c, v in enumerate(row) if v is not None and v != "")
+        yield f'<row r="{r}">{cells}</row>'
+
+
+class TemplateSkeleton:
+    """
+    Шаблон, скомпилированный один раз: все записи xlsx-архива лежат в памяти,
+    XML листов разрезан по </sheetData>. Отчет собирается копированием записей
+    и вставкой строк клиента между половинами XML нужного листа.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = []          # [(ZipInfo, bytes)] в исходном порядке
+        self.sheets = {}           # имя листа → (имя записи, голова XML, хвост XML, первая свободная строка)
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                self.entries.append((info, zf.read(info)))
+        data = dict((info.filename, body) for info, body in self.entries)
+        # openpyxl пишет листы как sheet1..N в порядке создания (порядок TEMPLATE_LAYOUT)
+        for i, layout in enumerate(TEMPLATE_LAYOUT, 1):
+            entry = f"xl/worksheets/sheet{i}.xml"
+            xml = data[entry]
+            cut = xml.rfind(_SHEET_DATA_END)
+            if cut < 0:
+                raise ValueError(f"В {entry} скомпилированного шаблона нет </sheetData>")
+            first_row = 2 if layout["headers"] else 1
+            self.sheets[layout["name"]] = (entry, xml[:cut], xml[cut:], first_row)
+
+    def render(self, output_path: str, rows: Optional[Dict[str, Iterable[Sequence]]] = None) -> None:
+        """
+        Пишет отчет: копия skeleton + строки клиента ({имя листа: итерируемые строки}).
+        Строки пишутся потоком прямо в zip, не собираясь в памяти. Запись атомарна (tmp + replace).
+        """
+        rows = rows or {}
+        unknown = set(rows) - set(self.sheets)
+        if unknown:
+            raise KeyError(f"В шаблоне нет листов: {', '.join(sorted(unknown))}")
+        patched = {self.sheets[name][0]: name for name in rows}
+
+        tmp_path = f"{output_path}.tmp"
+        try:
+            with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as zf:
+                for info, body in self.entries:
+                    name = patched.get(info.filename)
+                    if name is None:
+                        # Новый ZipInfo на каждую запись: zipfile дописывает в него смещения и CRC
+                        entry = zipfile.ZipInfo(info.filename, info.date_time)
+                        entry.compress_type = zipfile.ZIP_DEFLATED
+                        zf.writestr(entry, body)
+                        continue
+                    _, head, tail, first_row = self.sheets[name]
+                    with zf.open(info.filename, "w", force_zip64=True) as out:
+                        out.write(head)
+                        letters: list = []
+                        for chunk in rows_xml(rows[name], first_row, letters):
+                            out.write(chunk.encode("utf-8"))
+                        out.write(tail)
+            os.replace(tmp_path, output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+_skeletons: Dict[str, TemplateSkeleton] = {}
+
+
+def get_skeleton(cache_dir: str = TEMPLATE_CACHE_DIR) -> TemplateSkeleton:
+    """
+    Возвращает скомпилированный шаблон для текущего макета: из памяти процесса,
+    из cache_dir/template_<хеш>.xlsx или компилирует его заново (устаревшие версии удаляются).
+    """
+    path = os.path.join(cache_dir, f"template_{layout_hash()}.xlsx")
+    skeleton = _skeletons.get(path)
+    if skeleton is not None:
+        return skeleton
+    if os.path.isfile(path):
+        count("template_skeleton_hits")
+    else:
+        count("template_skeleton_misses")
+        os.makedirs(cache_dir, exist_ok=True)
+        with span("template_compile"):
+            # Временное имя уникально для процесса: шаблон могут компилировать параллельные рендеры
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            create_excel_template_openpyxl(tmp_path, os.path.basename(path))
+            os.replace(tmp_path, path)
+        for name in os.listdir(cache_dir):
+            if name.startswith("template_") and name.endswith(".xlsx") and name != os.path.basename(path):
+                try:
+                    os.remove(os.path.join(cache_dir, name))
+                except OSError:
+                    pass
+    skeleton = _skeletons[path] = TemplateSkeleton(path)
+    return skeleton
+
+
+def resolve_backend(backend: str) -> str:
+    """
+    Выбирает бэкенд: явно заданный или, для 'auto', openpyxl (без Excel);
+    если openpyxl недоступен, а xlwings установлен — xlwings.
+    """
+    if backend != "auto":
+        return backend
+    if missing_dependencies(["openpyxl"]) and not missing_dependencies(["xlwings"]):
+        return "xlwings"
+    return "openpyxl"
+
+
+def create_excel_template(output_path: str, filename: str, backend: str = "auto",
+                          rows: Optional[Dict[str, Iterable[Sequence]]] = None):
+    """
+    Создает Excel-файл с листами из TEMPLATE_LAYOUT: "портфель", "stock_etf_price", "bonds",
+    "risk", "look_through" и "changes".
+    
+    Параметры:
+        output_path (str): Полный путь к создаваемому Excel-файлу
+        filename (str): Имя файла (используется для логирования)
+        backend (str): "openpyxl", "xlwings" или "auto" (см. resolve_backend)
+        rows (dict): Строки данных по листам (см. build_sheet_rows); None — пустой шаблон
+        
+    Пример использования:
+        create_excel_template("Data_work/portfolio.xlsx", "portfolio.xlsx")
+    """
+    if resolve_backend(backend) == "xlwings":
+        create_excel_template_xlwings(output_path, filename, rows)
+    else:
+        # Макет компилируется один раз; каждый отчет — копия skeleton со строками клиента
+        get_skeleton().render(output_path, rows)
+
+
+# ===============================
+# Данные из map_instruments
+# ===============================
+def mapped_json_paths(data_work: str, client: str, period: dict) -> Dict[str, str]:
+    """Пути к выходам map_instruments и расчетных этапов для клиента и периода: {вид из MAPPED_KINDS: путь}."""
+    suffix = f"{client}_{period.get('start_date', '')}__{period.get('end_date', '')}.json"
+    return {kind: os.path.join(data_work, f"{prefix}_{suffix}") for kind, prefix in MAPPED_KINDS.items()}
+
+
+def load_mapped_items(path: str) -> list:
+    """Список items из JSON map_instruments; если файла нет — пустой список."""
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file).get("items") or []
+    except FileNotFoundError:
+        return []
+
+
+def portfolio_rows(mapped: Dict[str, list]) -> Iterable[tuple]:
+    """Строки листа «портфель»: акции/ETF, облигации и СП в порядке PORTFOLIO_HEADERS."""
+    for rec in mapped.get("stocks", ()):
+        yield rec.get("isin", ""), rec.get("type", ""), rec.get("ticker", ""), rec.get("name", ""), None
+    for rec in mapped.get("bonds", ()):
+        yield rec.get("isin", ""), BOND_TYPE, None, rec.get("name", ""), None
+    for rec in mapped.get("sp", ()):
+        pdf = os.path.basename(rec.get("pdf_path") or "") or None
+        yield rec.get("isin", ""), rec.get("type") or SP_TYPE, None, None, pdf
+
+
+def stock_etf_price_rows(mapped: Dict[str, list], period: dict) -> Iterable[tuple]:
+    """
+    Строки листа stock_etf_price: ISIN, тикер, название, цены начала/конца периода и отклонение,
+    количество и стоимость на конец периода (в валюте инструмента и в базовой валюте клиента).
+    Цены берутся из prices_*.json (этап isin_ticker_stock_etf); даты — фактические дни цен,
+    без цены — даты периода и пустые ячейки.
+    """
+    start, end = period.get("start_date"), period.get("end_date")
+    prices = {rec.get("isin"): rec for rec in mapped.get("prices", ())}
+    for rec in mapped.get("stocks", ()):
+        price = prices.get(rec.get("isin"), {})
+        yield (rec.get("isin", ""), rec.get("ticker", ""), rec.get("name", ""),
+               price.get("start_date") or start, price.get("start_price"),
+               price.get("end_date") or end, price.get("end_price"), price.get("deviation"),
+               price.get("quantity"), price.get("currency"), price.get("value"),
+               price.get("base_currency"), price.get("value_base"))
+
+
+def bond_rows(mapped: Dict[str, list]) -> Iterable[tuple]:
+    """Строки листа «bonds»: облигации клиента с метриками из bond_metrics_*.json (без метрик — пустые ячейки)."""
+    metrics = {rec.get("isin"): rec for rec in mapped.get("bond_metrics", ())}
+    for rec in mapped.get("bonds", ()):
+        m = metrics.get(rec.get("isin"), {})
+        yield (rec.get("isin", ""), rec.get("name", ""), m.get("price_date"), m.get("clean_price"),
+               m.get("accrued"), m.get("dirty_price"), m.get("ytm"), m.get("duration"), m.get("modified_duration"))
+
+
+def risk_rows(mapped: Dict[str, list]) -> Iterable[tuple]:
+    """Строки листа «risk»: показатель и значение из risk_*.json."""
+    for rec in mapped.get("risk", ()):
+        yield rec.get("name", ""), rec.get("value")
+
+
+def look_through_rows(mapped: Dict[str, list]) -> Iterable[tuple]:
+    """Строки листа «look_through»: разрез, название и доля из exposure_*.json."""
+    for rec in mapped.get("exposure", ()):
+        yield rec.get("group", ""), rec.get("name", ""), rec.get("weight")
+
+
+def changes_rows(mapped: Dict[str, list]) -> Iterable[tuple]:
+    """Строки листа «changes»: сводка и изменения портфеля из delta_*.json (без режима приращений — пусто)."""
+    for rec in mapped.get("delta", ()):
+        yield (rec.get("change", ""), rec.get("isin", ""), rec.get("category", ""), rec.get("name", ""),
+               rec.get("quantity_before"), rec.get("quantity_after"))
+
+
+def build_sheet_rows(mapped: Dict[str, list], period: dict) -> Dict[str, Iterable[tuple]]:
+    """Генераторы строк по листам шаблона — строки создаются по мере записи, целиком в памяти не лежат."""
+    return {
+        "портфель": portfolio_rows(mapped),
+        "stock_etf_price": stock_etf_price_rows(mapped, period),
+        "bonds": bond_rows(mapped),
+        "risk": risk_rows(mapped),
+        "look_through": look_through_rows(mapped),
+        "changes": changes_rows(mapped),
+    }
+
+
+def main(argv=None):
     """
     Главная функция — организует весь процесс создания шаблона.
     
@@ -274,13 +672,14 @@ def main():
         1. Загружает данные из JSON-файлов
         2. Формирует имя выходного файла
         3. Архивирует старые файлы портфеля
-        4. Создает новый Excel-шаблон
+        4. Создает новый Excel-шаблон и заполняет листы данными map_instruments
         5. Выводит информацию о результатах
         
     Обработка ошибок:
         - FileNotFoundError: Если не найдены JSON-файлы
         - json.JSONDecodeError: Если JSON-файлы повреждены
         - Exception: Для всех остальных ошибок
+        В каждом из этих случаев возвращается код 1 (конвейер останавливается на этапе), при успехе — 0.
         
     Пути к файлам:
         - name_clients.json: содержит имя клиента
@@ -288,11 +687,18 @@ def main():
         - Выходной файл: создается в Data_work
         - Резервные копии: сохраняются в Data_Backup
     """
+    parser = argparse.ArgumentParser(description="Создание Excel-шаблона отчета")
+    parser.add_argument("--backend", choices=("auto",) + BACKENDS, default="auto",
+                        help="Чем создавать шаблон: openpyxl (без Excel, по умолчанию) или xlwings (через Excel)")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
     # ===============================
     # Определение путей к файлам
     # ===============================
-    data_work_path = r"F:\Python Projets\Report\Data_work"      # Папка с данными
-    data_backup_path = r"F:\Python Projets\Report\Data_Backup"  # Папка для резервных копий
+    base_dir = BASE_DIR
+    data_work_path = os.path.join(base_dir, "Data_work")      # Папка с данными
+    data_backup_path = os.path.join(base_dir, "Data_Backup")  # Папка для резервных копий
 
     # Формируем полные пути к JSON-файлам
     name_clients_path = os.path.join(data_work_path, "name_clients.json")
@@ -302,7 +708,7 @@ def main():
         # ===============================
         # 1. Загружаем данные из JSON-файлов
         # ===============================
-        console.print(f"[bold cyan]📄 Загружаю данные из JSON-файлов...[/]")
+        console.print("[bold cyan]📄 Загружаю данные из JSON-файлов...[/]")
         name_data = load_json_data(name_clients_path)  # Загружаем данные клиента
         date_data = load_json_data(report_dates_path)  # Загружаем данные дат
 
@@ -329,27 +735,47 @@ def main():
         # ===============================
         # 4. Создаём новый Excel-шаблон
         # ===============================
-        console.print("[blue]🛠 Создаю Excel-шаблон...[/]")
-        create_excel_template(output_path, filename)
+        client_name = name_data.get("client_name", "").strip()
+        mapped_paths = mapped_json_paths(data_work_path, client_name, date_data)
+        with span("mapped_json_read"):
+            mapped = {kind: load_mapped_items(path) for kind, path in mapped_paths.items()}
+        total = sum(len(mapped[kind]) for kind in INSTRUMENT_KINDS)
+        if total:
+            console.print(f"[cyan]📥 Инструменты из map_instruments:[/] акции/ETF {len(mapped['stocks'])}, "
+                          f"облигации {len(mapped['bonds'])}, СП {len(mapped['sp'])}")
+        else:
+            console.print("[yellow]⚠️ Выходы map_instruments для клиента не найдены — будет создан пустой шаблон[/]")
+        count("rows_written", total + len(mapped["stocks"]))
+
+        backend = resolve_backend(args.backend)
+        if backend == "xlwings" and not ensure_dependencies(["xlwings"]):
+            return 1
+        console.print(f"[blue]🛠 Создаю Excel-шаблон ({backend})...[/]")
+        with span("template_create", file=filename, backend=backend, rows=total):
+            create_excel_template(output_path, filename, backend, build_sheet_rows(mapped, date_data))
 
         # ===============================
         # 5. Выводим информацию об успешном создании
         # ===============================
         console.print(f"[bold green]✔️ Файл шаблона отчета создан:[/] [white]{filename}[/]")
         console.print(f"[white]📍 Путь к файлу:[/] [bold cyan]{output_path}[/]")
+        return 0
 
     except FileNotFoundError as e:
         # Обработка ошибки: файлы не найдены
         console.print(f"[red]❌ Ошибка: {e}[/]")
         console.print(
             "[yellow]⚠️ Убедитесь, что файлы name_clients.json и report_dates.json существуют в папке Data_work[/]")
+        return 1
     except json.JSONDecodeError as e:
         # Обработка ошибки: поврежденный JSON
         console.print(f"[red]❌ Ошибка чтения JSON: {e}[/]")
         console.print("[yellow]⚠️ Проверьте корректность JSON-файлов[/]")
+        return 1
     except Exception as e:
         # Обработка всех остальных ошибок
         console.print(f"[bold red]💥 Неожиданная ошибка:[/] {e}")
+        return 1
 
 
 # ===============================
@@ -358,4 +784,8 @@ def main():
 if __name__ == "__main__":
     # Запускаем главную функцию только если скрипт запущен напрямую
     # (не импортирован как модуль)
-    main()
+    if not ensure_dependencies(REQUIRED_MODULES):
+        sys.exit(1)
+    with stage_span("template_creator"), profile_stage("template_creator"):
+        code = main()
+    sys.exit(code)
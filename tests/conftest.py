@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""Общие настройки тестов: модули проекта — из корня репозитория, трассы этапов не пишутся."""
+
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# До импорта instrumentation: иначе замеры из расчетов попадут в logs/ рабочей папки
+os.environ["REPORT_TRACE"] = "0"
+
+
+@pytest.fixture
+def store_factory(tmp_path):
+    """Хранилище цен во временной папке: store_factory({тикер: (даты, цены)})."""
+    import price_store
+
+    def make(records):
+        return price_store.PriceStore.open(str(tmp_path / "prices")).merge(records)
+
+    return make
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Эталонные значения НКД, YTM и дюрации (bond_analytics.py)."""
+
+import numpy as np
+import pytest
+
+import bond_analytics
+
+# 5% годовых, купон раз в полгода, 10 купонов после 15.01.2025
+COUPON, FREQ, MATURITY, SETTLE = 5.0, 2, "15.01.2030", "15.01.2025"
+
+
+def cash_flows(coupon: float = COUPON, freq: int = FREQ, periods: int = 10):
+    flows = np.full(periods, coupon / freq)
+    flows[-1] += 100.0
+    return np.arange(1, periods + 1, dtype=np.float64), flows
+
+
+def metrics(clean, settle=SETTLE):
+    return bond_analytics.bond_metrics([COUPON], [FREQ], [MATURITY], ["30/360"], [settle], [clean])
+
+
+def test_par_bond_yield_equals_coupon():
+    m = metrics(100.0)
+    assert m.flags[0] == 0
+    assert m.accrued[0] == pytest.approx(0.0)
+    assert m.ytm[0] == pytest.approx(0.05, abs=1e-9)
+
+
+def test_par_bond_duration_matches_cash_flow_sum():
+    m = metrics(100.0)
+    t, flows = cash_flows()
+    pv = flows / 1.025 ** t
+    assert m.duration[0] == pytest.approx((t * pv).sum() / pv.sum() / FREQ, abs=1e-9)
+    # Для бумаги по номиналу: модифицированная дюрация = (1 − (1 + y/f)^−n) / y
+    assert m.modified_duration[0] == pytest.approx((1.0 - 1.025 ** -10) / 0.05, abs=1e-9)
+
+
+def test_discount_bond_yield_recovers_pricing_rate():
+    t, flows = cash_flows()
+    price = (flows / 1.03 ** t).sum()            # цена при 6% годовых
+    assert metrics(price).ytm[0] == pytest.approx(0.06, abs=1e-9)
+
+
+def test_accrued_interest_30_360():
+    # 15.01 → 15.04: 90 дней из 360 по купону 5% годовых
+    assert metrics(100.0, settle="15.04.2025").accrued[0] == pytest.approx(1.25)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Эталонные значения TWR/MWR (returns.py)."""
+
+import math
+
+import numpy as np
+import pytest
+
+import fx
+import returns
+
+# Три торговых дня подряд: пн 07.07.2025 — ср 09.07.2025
+DAYS = ["2025-07-07", "2025-07-08", "2025-07-09"]
+PRICES = [100.0, 110.0, 121.0]
+
+
+def account(positions, transactions=()):
+    return {"start_date": "07.07.2025", "end_date": "09.07.2025", "base_currency": "USD",
+            "positions": positions, "transactions": list(transactions)}
+
+
+def test_solve_irr_single_deposit():
+    # 100 через год превратились в 110: непрерывная ставка ln(1.1)
+    g, converged = returns.solve_irr(np.array([[100.0]]), np.array([[1.0]]), np.array([110.0]))
+    assert converged[0]
+    assert g[0] == pytest.approx(math.log(1.1), abs=1e-9)
+
+
+def test_solve_irr_batch_rows_are_independent():
+    amounts = np.array([[100.0, 0.0], [100.0, 50.0], [0.0, 0.0]])
+    taus = np.array([[1.0, 0.5], [1.0, 0.5], [0.0, 0.0]])
+    g, converged = returns.solve_irr(amounts, taus, np.array([110.0, 100.0 * 1.1 + 50.0 * 1.1 ** 0.5, 0.0]))
+    assert converged.tolist() == [True, True, False]
+    assert g[:2] == pytest.approx([math.log(1.1)] * 2, abs=1e-9)
+
+
+def test_no_flows_twr_equals_mwr(store_factory):
+    store = store_factory({"AAA": (DAYS, PRICES)})
+    result = returns.compute_returns(store, fx.FxRates.from_store(store),
+                                     [account([{"isin": "US0000000001", "ticker": "AAA", "quantity": 10,
+                                                "currency": "USD"}])])
+    assert result.start_value[0] == pytest.approx(1000.0)
+    assert result.end_value[0] == pytest.approx(1210.0)
+    assert result.twr[0] == pytest.approx(0.21)
+    assert result.mwr[0] == pytest.approx(0.21)
+    assert result.flags[0] == 0
+
+
+def test_twr_links_daily_returns_around_a_purchase(store_factory):
+    # +10% в первый день, 0% во второй; докупка 10 шт. по 110 во второй день — TWR = 1.1 · 1.0 − 1
+    store = store_factory({"AAA": (DAYS, [100.0, 110.0, 110.0])})
+    buy = {"date": "08.07.2025", "isin": "US0000000001", "quantity": 10, "amount": 1100.0, "currency": "USD"}
+    result = returns.compute_returns(store, fx.FxRates.from_store(store),
+                                     [account([{"isin": "US0000000001", "ticker": "AAA", "quantity": 20,
+                                                "currency": "USD"}], [buy])])
+    assert result.start_value[0] == pytest.approx(1000.0)
+    assert result.end_value[0] == pytest.approx(2200.0)
+    assert result.net_flows[0] == pytest.approx(1100.0)
+    assert result.twr[0] == pytest.approx(0.1)
+    # MWR: 1000·x² + 1100·x = 2200, x — рост за день; за период x² − 1
+    x = (-1100.0 + math.sqrt(1100.0 ** 2 + 4 * 1000.0 * 2200.0)) / 2000.0
+    assert result.mwr[0] == pytest.approx(x * x - 1.0, abs=1e-9)
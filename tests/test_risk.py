@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Эталонные значения беты, просадки, волатильности и VaR (risk.py)."""
+
+import math
+
+import numpy as np
+import pytest
+
+import fx
+import risk
+
+# Четыре торговых дня: пн 07.07.2025 — чт 10.07.2025
+DAYS = ["2025-07-07", "2025-07-08", "2025-07-09", "2025-07-10"]
+BENCH = [100.0, 110.0, 88.0, 99.0]          # доходности +10%, −20%, +12.5%
+DOUBLE = [100.0, 120.0, 72.0, 90.0]         # ровно вдвое большие доходности
+
+
+def run(store_factory, *tickers):
+    store = store_factory({"SPY": (DAYS, BENCH), "AAA": (DAYS, DOUBLE)})
+    accounts = [{"start_date": "07.07.2025", "end_date": "10.07.2025",
+                 "positions": [{"ticker": t, "quantity": 10, "currency": "USD"}]} for t in tickers]
+    return risk.compute_risk(store, fx.FxRates.from_store(store), accounts, benchmark="SPY", cache_dir=None)
+
+
+def test_benchmark_beta_against_itself_is_one(store_factory):
+    result, = run(store_factory, "SPY")
+    assert result["beta"] == pytest.approx(1.0)
+    assert result["missing"] == []
+
+
+def test_beta_of_doubled_returns_is_two(store_factory):
+    result, = run(store_factory, "AAA")
+    assert result["beta"] == pytest.approx(2.0)
+
+
+def test_drawdown_volatility_and_var(store_factory):
+    result, = run(store_factory, "SPY")
+    # Пик 110 → минимум 88
+    assert result["max_drawdown"] == pytest.approx(0.2)
+    daily = np.array([0.1, -0.2, 0.125])
+    assert result["volatility"] == pytest.approx(daily.std(ddof=1) * math.sqrt(risk.TRADING_DAYS_PER_YEAR))
+    # 5%-квантиль трех доходностей (линейная интерполяция): −0.2 + 0.1 · (0.1 − (−0.2))
+    assert result["var_95"] == pytest.approx(0.17)